@@ -6,7 +6,7 @@ import imagehash
 from PIL import Image
 from PyQt5.QtCore import QUrl, pyqtSignal, QThread, QRunnable, QThreadPool, QObject
 
-import CommonUtils
+from common import CommonUtils
 from common.CommonUtils import FileScanner
 
 
@@ -16,6 +16,11 @@ class HashedImage:
         self.image_hash = image_hash
 
 
+def _average_hash(file, hash_size):
+    image = Image.open(file)
+    return HashedImage(file, str(imagehash.average_hash(image, hash_size=hash_size)))
+
+
 class HashWorker(CommonUtils.Command):
     result = pyqtSignal('PyQt_PyObject')
 
@@ -25,11 +30,14 @@ class HashWorker(CommonUtils.Command):
         self.hash_size = hash_size
         self.algorithm = algorithm
 
-    def run(self):
-        image = Image.open(self.file)
-        hash_ = str(imagehash.average_hash(image, hash_size=self.hash_size))
-        hashed = HashedImage(self.file, hash_)
-        print(f"{self.file} -> {hash_}")
+    def do_work(self):
+        self.process_result(_average_hash(self.file, self.hash_size))
+
+    def process_work(self):
+        return _average_hash, (self.file, self.hash_size)
+
+    def process_result(self, hashed):
+        print(f"{hashed.file_name} -> {hashed.image_hash}")
         self.signals.result.emit(hashed)
 
 
@@ -118,7 +126,8 @@ class DuplicateImageFinderRuntime:
                 worker = HashWorker(file, self.hash_size, self.algorithm)
                 worker.signals.result.connect(self.test_foo)
                 runnables.append(worker)
-        self.executor = CommonUtils.CommandExecutionFactory(runnables)
+        # Hashing is pure python work, so it is spread over processes rather than threads
+        self.executor = CommonUtils.CommandExecutionFactory(runnables, backend=CommonUtils.ProcessPoolBackend())
         self.executor.start()
         #
         #
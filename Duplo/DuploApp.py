@@ -1,16 +1,15 @@
 import hashlib
 import itertools
-import subprocess
 import sys
 import tempfile
 from datetime import datetime
 from os import path
-import shlex
 from shutil import which
 
 from PyQt5.QtCore import QObject
 from PyQt5.QtWidgets import QMainWindow, QTextEdit, QHBoxLayout, QWidget, QApplication, QPushButton, QVBoxLayout
 
+from common import ProcessSupervisor
 from common.CommonUtils import Command
 from common.CustomUI import DropZone
 
@@ -45,15 +44,14 @@ class BaseCommand(Command):
     def run_commands(self, commands):
         for command in commands:
             print(command)
-            process = subprocess.Popen(
-                shlex.split(command),
-                stdin=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True
-            )
-
-            for line in process.stderr:
-                self.signals.status.emit(line)
+            ProcessSupervisor.get_default_supervisor().run(command, on_line=self._forward_output, capture_output=False)
+
+    def _forward_output(self, line, stream):
+        if stream == "stderr":
+            self.signals.status.emit(line)
+        else:
+            # The output of the tool goes to the terminal, as it did when the tool wrote to it directly
+            print(line, end="", flush=True)
 
     def post_processing(self, output_file: str):
         pass
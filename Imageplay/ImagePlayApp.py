@@ -50,7 +50,7 @@ class ImagePlayApp(QMainWindow):
 
     def _files_dropped(self, add, files):
         scanner = CommonUtils.FileScanner(files, recurse=True, is_qfiles=True,
-                                          supported_extensions=Imageplay.ui.Image.SUPPORTED_FORMATS)
+                                          supported_extensions=Imageplay.ui.Image.supported_formats())
         if not add:
             self.playlist.clear()
         self.playlist.enqueue(list(scanner.files))
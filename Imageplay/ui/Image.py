@@ -1,6 +1,7 @@
 import json
 import os
 import sys
+from functools import cache
 
 from PyQt5.QtCore import Qt, pyqtSignal, QSize
 from PyQt5.QtGui import QFontDatabase
@@ -13,8 +14,18 @@ from common import MediaMetaData
 import Imageplay
 from Imageplay.ui import Settings
 
-SUPPORTED_FORMATS = list(map(lambda x: f'.{str(x, "utf-8").upper()}', QImageReader.supportedImageFormats()))
-_supported_animation_formats = "|".join(map(lambda x: str(x, "utf-8").upper(), QMovie.supportedFormats()))
+
+@cache
+def supported_formats():
+    """
+    :return: the image file extensions Qt can read, queried from the image plugins the first time they are needed
+    """
+    return list(map(lambda x: f'.{str(x, "utf-8").upper()}', QImageReader.supportedImageFormats()))
+
+
+@cache
+def _supported_animation_formats():
+    return "|".join(map(lambda x: str(x, "utf-8").upper(), QMovie.supportedFormats()))
 
 
 class ImageView(QScrollArea):
@@ -45,7 +56,7 @@ class ImageView(QScrollArea):
     def set_image(self, image_file):
         self.current_file = image_file
         self.zoom = 1
-        if _supported_animation_formats.__contains__(os.path.splitext(image_file)[1][1:].upper()):
+        if _supported_animation_formats().__contains__(os.path.splitext(image_file)[1][1:].upper()):
             Imageplay.logger.info(f"Animation file received: {image_file}")
             # Animation file received
             self.pixmap = None
@@ -26,7 +26,8 @@ class SettingsKeys(Enum):
 
 _settings = AppSettings(
     "ImagePlay",
-    {}
+    {},
+    write_behind=True
 )
 
 
@@ -1,4 +1,4 @@
-import subprocess
+from common import ProcessSupervisor
 
 
 class CommandRunner:
@@ -20,8 +20,8 @@ class CommandRunner:
 
     def execute_wait(self, command):
         script = str(self.baseScript % (self.title, command))
-        subprocess.Popen(script, shell=True).wait()
+        return ProcessSupervisor.get_default_supervisor().run(script, shell=True, pipe_output=False)
 
     def execute_async(self, command):
         script = str(self.baseScript % (self.title, command))
-        subprocess.Popen(script, shell=True)
+        return ProcessSupervisor.get_default_supervisor().submit(script, shell=True, pipe_output=False)
@@ -8,11 +8,12 @@ from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, QProgressBar, QLabel, QPushButton, QMessageBox
 
 import TransCoda
-from TransCoda.core import TransCodaHistory
+from TransCoda.core import TransCodaHistory, EncodeJournal
 from TransCoda.core.Encoda import EncoderCommand, EncoderStatus
 from TransCoda.core.MetaDataOperations import FileMetaDataExtractor
 from TransCoda.ui import TransCodaSettings
 from TransCoda.ui.Actions import MainToolBar, Action
+from TransCoda.ui.HistoryReportView import HistoryReportView
 from TransCoda.ui.MainPanel import MainPanel
 from TransCoda.ui.TerminalView import TerminalView
 from TransCoda.ui.TransCodaSettings import SettingsKeys
@@ -29,15 +30,21 @@ class TransCodaApp(QMainWindow):
         self.progressbar = QProgressBar()
         self.message = QLabel("Ready")
         self.encoder = QLabel("Encoder")
+        self.concurrency = QLabel()
         self.terminal_btn = QPushButton()
         self.terminal_view = TerminalView()
+        self.report_btn = QPushButton()
+        self.report_view = HistoryReportView()
         self.executor = None
+        self.scanners = []
+        self.journal = EncodeJournal.EncodeJournal()
+        self.item_updates = CommonUtils.SignalCoalescer(key_function=lambda item: item.file_key())
         self.timer = QTimer()
         self.init_ui()
 
     def init_ui(self):
         encoder_name = TransCodaSettings.get_encoder_name()
-        self.main_panel.set_items(TransCodaSettings.get_encode_list())
+        interrupted, missing = self.restore_encode_list()
         self.main_panel.files_changed_event.connect(self.files_changed_event)
         self.main_panel.menu_item_event.connect(self.action_event)
         self.tool_bar.set_encode_state(file_count=self.main_panel.row_count(),
@@ -55,14 +62,22 @@ class TransCodaApp(QMainWindow):
         self.terminal_btn.setFlat(True)
         self.terminal_btn.setToolTip("Show Encoder Logs")
         self.terminal_btn.clicked.connect(self.show_encode_logs)
+        self.report_btn.setIcon(TransCoda.theme.ico_report)
+        self.report_btn.setFlat(True)
+        self.report_btn.setToolTip("Show Encode History")
+        self.report_btn.clicked.connect(self.show_history_report)
         self.statusBar().addPermanentWidget(self.encoder, 0)
         self.statusBar().addPermanentWidget(QVLine())
+        self.statusBar().addPermanentWidget(self.concurrency, 0)
+        self.concurrency.setVisible(False)
         self.statusBar().addPermanentWidget(self.progressbar, 0)
         self.statusBar().addPermanentWidget(self.terminal_btn, 0)
+        self.statusBar().addPermanentWidget(self.report_btn, 0)
 
         self.setMinimumSize(800, 600)
         self.setWindowTitle(TransCoda.__APP_NAME__)
         self.setWindowIcon(TransCoda.theme.ico_app_icon)
+        self.item_updates.flush_event.connect(self.item_updates_event)
         self.timer.timeout.connect(self.timer_timeout_event)
         self.timer.setInterval(6000)
         self.timer.setSingleShot(True)
@@ -72,6 +87,40 @@ class TransCodaApp(QMainWindow):
         # Executed after the show, where all dimensions are calculated
         self.progressbar.setFixedWidth(self.progressbar.width())
         self.progressbar.setVisible(False)
+        self.resume_encode_list(interrupted, missing)
+
+    def restore_encode_list(self):
+        items = TransCodaSettings.get_encode_list()
+        interrupted, missing = EncodeJournal.restore(items, self.journal.replay())
+        self.main_panel.set_items(items)
+        return interrupted, missing
+
+    def resume_encode_list(self, interrupted, missing):
+        if len(interrupted) == 0 and len(missing) == 0:
+            return
+        files = [entry.file for entry in missing if entry.url is None and os.path.exists(entry.file)]
+        if len(files) > 0:
+            TransCoda.logger.info(f"Restoring {len(files)} files that were not in the saved encode list")
+            # The metadata is read before the journal is applied, a later metadata result would reset the status.
+            # These files were read in the last session, their metadata is cached
+            extractor = FileMetaDataExtractor(files, batch_size=len(files))
+            extractor.do_work()
+            restarted, _ = EncodeJournal.restore(extractor.files, {entry.key: entry for entry in missing})
+            self.main_panel.update_items(extractor.files)
+            interrupted = interrupted + restarted
+        # The journal has been applied to the encode list, save it so that the journal can start over
+        self.save_encode_list()
+        if len(interrupted) > 0:
+            TransCoda.logger.info(f"Restarting {len(interrupted)} interrupted encodes")
+            keys = {item.file_key() for item in interrupted}
+            self.validate_and_start_encoding(run_indices=[index for index in range(0, self.main_panel.row_count())
+                                                          if self.main_panel.get_items(index).file_key() in keys])
+
+    def save_encode_list(self):
+        TransCodaSettings.save_encode_list(self.main_panel.get_items())
+        # Settings are written behind, the encode list must be on disk before the journal drops the finished items
+        TransCodaSettings.settings.flush()
+        self.journal.compact()
 
     def action_event(self, event, item_indices=None):
         if event == Action.ADD_FILE:
@@ -115,27 +164,49 @@ class TransCodaApp(QMainWindow):
     def files_changed_event(self, is_added, files):
         if is_added:
             self.statusBar().showMessage("Scanning files please wait...")
-            scanner = CommonUtils.FileScanner(files, recurse=True, is_qfiles=True)
-            self.statusBar().showMessage(f"Loading files into {TransCoda.__APP_NAME__}")
-            # Add files first
-            total_added = self.main_panel.add_files(scanner.files)
-            # Fetch and enrich with metadata
-            batches = []
-            for batch in CommonUtils.batch(list(scanner.files), batch_size=20):
-                retriever = FileMetaDataExtractor(batch, batch_size=len(batch))
-                retriever.signals.result.connect(self.result_received_event)
-                batches.append(retriever)
-            # UX
+            scanner = CommonUtils.FileScanWorker(CommonUtils.FileScanner(files, recurse=True, is_qfiles=True,
+                                                                         streaming=True))
+            scanner.files_found_event.connect(self.files_found_event)
+            scanner.finish_event.connect(self.scan_complete_event)
+            self.scanners.append(scanner)
+            scanner.start()
+        self.tool_bar.set_encode_state(file_count=self.main_panel.row_count(),
+                                       encoder_name=TransCodaSettings.get_encoder_name(),
+                                       output_dir=TransCodaSettings.get_output_dir())
+
+    def files_found_event(self, files):
+        self.statusBar().showMessage(f"Loading files into {TransCoda.__APP_NAME__}")
+        # Add files first
+        total_added = self.main_panel.add_files(files)
+        # Fetch and enrich with metadata, starting with the first batch while the scan continues
+        batches = []
+        for batch in CommonUtils.batch(files, batch_size=20):
+            retriever = FileMetaDataExtractor(batch, batch_size=len(batch))
+            retriever.signals.result.connect(self.result_received_event)
+            batches.append(retriever)
+        # UX
+        if self.executor is not None and self.executor.is_running():
+            self.progressbar.setMaximum(self.progressbar.maximum() + total_added)
+            for retriever in batches:
+                self.executor.add_task(retriever)
+        else:
             self.begin_tasks(batches, f"Fetching meta-data for {total_added} files", total_added)
+
+    def scan_complete_event(self, scanner):
+        for worker in [worker for worker in self.scanners if worker.scanner is scanner]:
+            # The finish event is the last thing the worker does, wait for it to exit before releasing it
+            worker.wait()
+            self.scanners.remove(worker)
+        TransCoda.logger.info(f"Scan complete. {len(scanner.files)} files found")
         self.tool_bar.set_encode_state(file_count=self.main_panel.row_count(),
                                        encoder_name=TransCodaSettings.get_encoder_name(),
                                        output_dir=TransCodaSettings.get_output_dir())
 
     def validate_and_start_encoding(self, run_indices=None):
         def create_runnable(_item):
-            runnable = EncoderCommand(_item)
+            runnable = EncoderCommand(_item, journal=self.journal)
             runnable.signals.result.connect(self.result_received_event)
-            runnable.signals.status.connect(self.status_received_event)
+            runnable.signals.status.connect(self.item_updates.post, QtCore.Qt.DirectConnection)
             runnable.signals.log_message.connect(self.terminal_view.log_message)
             return runnable
 
@@ -157,26 +228,39 @@ class TransCodaApp(QMainWindow):
         if len(runnables) <= 0:
             self.statusBar().showMessage("Nothing to encode!")
             return
+        self.journal.record_many([runnable.file for runnable in runnables], EncoderStatus.WAITING)
 
         if TransCodaSettings.sort_by_size():
-            runnables.sort(key=lambda x: x.file.file_size)
+            policy = CommonUtils.SchedulingPolicy.LARGEST_FIRST
+        else:
+            policy = CommonUtils.SchedulingPolicy.FIFO
         self.tool_bar.encoding_started()
         if is_video and TransCodaSettings.is_single_thread_video():
             self.begin_tasks(runnables, f"Dispatching {len(runnables)} jobs for serial encoding", len(runnables),
-                             threads=1)
+                             threads=1, policy=policy)
+        elif TransCodaSettings.is_adaptive_threads():
+            controller = CommonUtils.ConcurrencyController(max_threads=TransCodaSettings.get_max_threads())
+            self.begin_tasks(runnables, f"Dispatching {len(runnables)} jobs for adaptive encoding", len(runnables),
+                             threads=TransCodaSettings.get_max_threads(), policy=policy, controller=controller)
         else:
             self.begin_tasks(runnables, f"Dispatching {len(runnables)} jobs for encoding", len(runnables),
-                             threads=TransCodaSettings.get_max_threads())
+                             threads=TransCodaSettings.get_max_threads(), policy=policy)
 
-    def begin_tasks(self, tasks, status_message, total_size, threads=TransCodaSettings.get_max_threads()):
+    def begin_tasks(self, tasks, status_message, total_size, threads=TransCodaSettings.get_max_threads(),
+                    policy=CommonUtils.SchedulingPolicy.FIFO, controller=None):
         TransCoda.logger.info(status_message)
         self.progressbar.setVisible(True)
         self.progressbar.setValue(0)
         self.progressbar.setMaximum(total_size)
         self.executor = CommonUtils.CommandExecutionFactory(tasks,
                                                             logger=TransCoda.logger,
-                                                            max_threads=threads)
+                                                            max_threads=threads,
+                                                            policy=policy,
+                                                            controller=controller)
         self.executor.finish_event.connect(self.jobs_complete_event)
+        self.executor.concurrency_event.connect(self.concurrency_changed_event)
+        if controller is not None:
+            self.concurrency_changed_event(self.executor.get_max_threads(), controller.reason)
         self.statusBar().showMessage(status_message)
         self.executor.start()
 
@@ -187,29 +271,40 @@ class TransCodaApp(QMainWindow):
         self.timer.start()
 
     def result_received_event(self, result):
-        for result_item in result:
-            if result_item.status in [EncoderStatus.SUCCESS, EncoderStatus.ERROR]:
-                TransCodaHistory.set_history(
-                    input_file=result_item.display_name(),
-                    output_file=result_item.output_file,
-                    start_time=result_item.encode_start_time,
-                    end_time=result_item.encode_end_time,
-                    input_size=result_item.file_size,
-                    output_size=result_item.encode_output_size,
-                    status=result_item.status,
-                    encoder=result_item.encode_command,
-                    message=result_item.encode_messages
-                )
-        self.main_panel.update_items(result)
+        TransCodaHistory.set_history_many(
+            TransCodaHistory.HistoryEntry(
+                input_file=result_item.display_name(),
+                output_file=result_item.output_file,
+                start_time=result_item.encode_start_time,
+                end_time=result_item.encode_end_time,
+                input_size=result_item.file_size,
+                output_size=result_item.encode_output_size,
+                status=result_item.status,
+                encoder=result_item.encode_command,
+                encoder_name=result_item.encoder,
+                message=result_item.encode_messages
+            ) for result_item in result if result_item.status in [EncoderStatus.SUCCESS, EncoderStatus.ERROR])
+        self.item_updates.post_all(result)
         self.progressbar.setValue(self.progressbar.value() + len(result))
-        self.update_status_bar()
 
-    def status_received_event(self, status):
-        self.main_panel.update_items([status])
+    def item_updates_event(self, items):
+        self.main_panel.update_items(items)
         self.update_status_bar()
 
+    def concurrency_changed_event(self, threads, reason):
+        self.concurrency.setText(f"Threads: {threads}")
+        self.concurrency.setToolTip(reason)
+        self.concurrency.setVisible(True)
+        self.statusBar().showMessage(f"Encoding {threads} files at the same time. {reason}", msecs=3000)
+
     def jobs_complete_event(self, all_results, time_taken):
+        self.journal.record_finished()
+        self.item_updates.flush()
         self.progressbar.setValue(self.progressbar.maximum())
+        self.concurrency.setVisible(False)
+        if self.executor is not None:
+            TransCoda.logger.info(f"Execution summary: {self.executor.tracer.summary()}, "
+                                  f"counters: {dict(self.executor.tracer.counters)}")
         self.executor = None
         self.statusBar().showMessage(f"Processed {len(all_results)} files in {time_taken} seconds", msecs=400)
         self.set_window_title()
@@ -251,9 +346,13 @@ class TransCodaApp(QMainWindow):
     def show_encode_logs(self):
         self.terminal_view.show()
 
+    def show_history_report(self):
+        self.report_view.show()
+        self.report_view.raise_()
+
     def closeEvent(self, close_event) -> None:
         TransCoda.logger.info("Saving encode list...")
-        TransCodaSettings.save_encode_list(self.main_panel.get_items())
+        self.save_encode_list()
         TransCoda.logger.info("Saving UI...")
         TransCodaSettings.settings.save_ui(self, TransCoda.logger)
 
@@ -2,10 +2,12 @@ import datetime
 import os
 from enum import Enum
 
-from common import CommonUtils
+from PyQt5.QtCore import Qt
+
+from common import CommonUtils, ChecksumCache
 import TransCoda
 from TransCoda.ui import TransCodaSettings
-from TransCoda.core import ProcessRunners
+from TransCoda.core import ProcessRunners, EncodeCache
 
 
 class EncoderStatus(Enum):
@@ -29,18 +31,22 @@ class TranscodaError(Exception):
 
 class EncoderCommand(CommonUtils.Command):
 
-    def __init__(self, file_item):
+    def __init__(self, file_item, journal=None):
         super().__init__()
         self.file = file_item
+        self.journal = journal
+        self.tracer.name = file_item.file_name
+        self.runner = None
 
     def work_size(self):
-        return 1
+        return self.file.file_size
 
     def do_work(self):
         self.file.encode_start_time = datetime.datetime.now()
         encoder = self.file.encoder_props
         try:
-            self._check_file()
+            with self.tracer.span("check_file"):
+                self._check_file()
         except Exception as exception:
             self.emit_exception(exception)
             return
@@ -56,6 +62,7 @@ class EncoderCommand(CommonUtils.Command):
                     executable = "copy"
                 else:
                     self.file.status = EncoderStatus.SKIPPED
+                    self._record(EncoderStatus.SKIPPED)
                     self.signals.result.emit([self.file])
                     return
             else:
@@ -64,36 +71,93 @@ class EncoderCommand(CommonUtils.Command):
                 if executable not in ProcessRunners.runners_registry:
                     raise TranscodaError(f"Unable to find a process handler for executable {executable}")
 
+            cache_key = None
+            if executable != "copy" and self.file.url is None and TransCodaSettings.is_encode_cache_enabled():
+                with self.tracer.span("cache_lookup"):
+                    cache_key = self._cache_key(executable)
+                    if self._cache().get(cache_key, self.file.output_file, link=self._link_cached_output()):
+                        self.file.encode_messages = "The result of an earlier encode of the same content was reused"
+                        self._encode_complete()
+                        return
+
             process_runner = ProcessRunners.runners_registry[executable]
-            runner = process_runner(input_file=self.file.file,
-                                    input_url=self.file.url,
-                                    output_file=self.file.output_file,
-                                    base_command=self.file.encode_command,
-                                    delete_metadata=TransCodaSettings.get_delete_metadata())
-            runner.status_event.connect(self.status_event)
-            runner.message_event.connect(self.log_message)
-            runner.run()
-            output_stat = os.stat(self.file.output_file)
-            if TransCodaSettings.get_preserve_timestamps():
-                os.utime(self.file.output_file, (self.file.access_time, self.file.modify_time))
-            self.file.encode_end_time = datetime.datetime.now()
-            self.file.encode_cpu_time = (self.file.encode_end_time - self.file.encode_start_time).total_seconds()
-            self.file.encode_compression_ratio = 100 - (output_stat.st_size / (self.file.file_size + 1)) * 100
-            self.file.status = EncoderStatus.SUCCESS
-            self.file.encode_output_size = output_stat.st_size
-            self.file.encode_percent = 100
-            self.signals.result.emit([self.file])
+            runner_options = {}
+            # Videos are only encoded in segments when they are encoded one at a time, the segments then take the
+            # threads that would have encoded other files
+            if executable == "ffmpeg" and self.file.url is None and self.file.is_video() \
+                    and TransCodaSettings.is_segment_video() and TransCodaSettings.is_single_thread_video():
+                process_runner = ProcessRunners.SegmentedFFMPEGProcessRunner
+                runner_options = {"segment_seconds": TransCodaSettings.get_segment_seconds(),
+                                  "max_segments": TransCodaSettings.get_max_threads()}
+            self.runner = process_runner(input_file=self.file.file,
+                                         input_url=self.file.url,
+                                         output_file=self.file.output_file,
+                                         base_command=self.file.encode_command,
+                                         delete_metadata=TransCodaSettings.get_delete_metadata(),
+                                         **runner_options)
+            # Output is read on the process supervisor thread, which has no event loop to queue the events to
+            self.runner.status_event.connect(self.status_event, Qt.DirectConnection)
+            self.runner.message_event.connect(self.log_message, Qt.DirectConnection)
+            if self.is_cancelled():
+                self.runner.cancel()
+            # From here the output file may be partly written
+            self._record(EncoderStatus.IN_PROGRESS)
+            with self.tracer.span("process", executable=executable):
+                self.runner.run()
+            if cache_key is not None:
+                with self.tracer.span("cache_store"):
+                    self._cache().put(cache_key, self.file.output_file, link=self._link_cached_output())
+            self._encode_complete()
         except Exception as exception:
             self.emit_exception(exception)
 
+    def _encode_complete(self):
+        with self.tracer.span("stat"):
+            output_stat = os.stat(self.file.output_file)
+        if TransCodaSettings.get_preserve_timestamps():
+            os.utime(self.file.output_file, (self.file.access_time, self.file.modify_time))
+        self.file.encode_end_time = datetime.datetime.now()
+        self.file.encode_cpu_time = (self.file.encode_end_time - self.file.encode_start_time).total_seconds()
+        self.file.encode_compression_ratio = 100 - (output_stat.st_size / (self.file.file_size + 1)) * 100
+        self.file.status = EncoderStatus.SUCCESS
+        self.file.encode_output_size = output_stat.st_size
+        self.file.encode_percent = 100
+        self._record(EncoderStatus.SUCCESS)
+        self.signals.result.emit([self.file])
+
+    def _cache_key(self, executable):
+        digest = CommonUtils.calculate_sha256_hash(self.file.file, cache=ChecksumCache.get_default_cache())
+        _, extension = os.path.splitext(self.file.output_file)
+        return EncodeCache.make_key(digest, executable, self.file.encode_command, extension,
+                                    TransCodaSettings.get_delete_metadata())
+
+    @staticmethod
+    def _link_cached_output():
+        # Setting the times of an output that is linked to the cache would set the times of every output linked to it
+        return not TransCodaSettings.get_preserve_timestamps()
+
+    @staticmethod
+    def _cache():
+        return EncodeCache.get_default_cache(TransCodaSettings.get_encode_cache_size())
+
+    def cancel(self):
+        super().cancel()
+        if self.runner is not None:
+            self.runner.cancel()
+
     def emit_exception(self, exception):
         self.file.encode_end_time = datetime.datetime.now()
         self.file.encode_cpu_time = (self.file.encode_end_time - self.file.encode_start_time).total_seconds()
         TransCoda.logger.exception(exception)
         self.file.status = EncoderStatus.ERROR
         self.file.encode_messages = str(exception)
+        self._record(EncoderStatus.ERROR)
         self.signals.result.emit([self.file])
 
+    def _record(self, status):
+        if self.journal is not None:
+            self.journal.record(self.file, status)
+
     def status_event(self, _file, total, completed):
         self.file.encode_percent = (completed / total) * 100
         self.file.status = EncoderStatus.IN_PROGRESS
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from common import CommonUtils
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def make_key(source_digest, executable, command, extension, delete_metadata=False):
+    """
+    The key of an encode. Two encodes with the same key produce the same output
+    :param source_digest: the SHA256 checksum of the input file
+    :param executable: the encoder executable
+    :param command: the encoder command
+    :param extension: the extension of the output file, which sets the output format of some encoders
+    :param delete_metadata: whether the tags of the input are dropped from the output
+    :return: the key
+    """
+    key = json.dumps([source_digest, executable, command, extension.lower(), bool(delete_metadata)])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class EncodeCache:
+    """
+    A content addressed cache of encoded files, so that a file that has already been encoded with the same encoder is
+    not encoded again, even if it is at a different path. The outputs are kept in the cache directory, named by their
+    key, and are hard linked to the new output file where possible, or copied otherwise. When the stored outputs grow
+    beyond max_bytes, the least recently used outputs are evicted.
+    A stored output whose size or modification time has changed, for example because an output it is linked to was
+    re-tagged, is dropped.
+    The cache can be shared between threads
+    """
+    def __init__(self, cache_dir=None, max_bytes=10 * 1073741824, link=True):
+        """
+        :param cache_dir: the directory to keep the outputs in. The directory in the TransCoda data directory is used
+        if not provided
+        :param max_bytes: the maximum size of the stored outputs
+        :param link: hard link the outputs rather than copy them, when the file system allows it
+        """
+        if cache_dir is None:
+            cache_dir = os.path.join(CommonUtils.get_app_data_dir("TransCoda"), "encode_cache")
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.link = link
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS outputs(key TEXT PRIMARY KEY, bytes INTEGER, last_used REAL, "
+                         "mtime_ns INTEGER)")
+        if "mtime_ns" not in [column for _, column, *_ in self._db.execute("PRAGMA table_info(outputs)")]:
+            # Outputs stored before the modification time was kept cannot be verified, they are dropped when used
+            self._db.execute("ALTER TABLE outputs ADD COLUMN mtime_ns INTEGER")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_outputs_last_used ON outputs(last_used)")
+        self._db.commit()
+        self._entries, self._bytes = self._db.execute("SELECT COUNT(*), IFNULL(SUM(bytes), 0) FROM outputs").fetchone()
+
+    def get(self, key, output_file, link=None):
+        """
+        Places the stored output of an encode at the output file
+        :param key: the key of the encode, see make_key
+        :param output_file: the output file. An existing file is replaced
+        :param link: hard link the output, defaults to the link setting of the cache. An output that is modified
+        after it is placed, for example by setting its times, must be copied, or every output linked to it changes
+        :return: True if the output was found, False if the file has to be encoded
+        """
+        with self._lock:
+            record = self._db.execute("SELECT bytes, mtime_ns FROM outputs WHERE key=?", [key]).fetchone()
+        if record is None:
+            return False
+        stored = self._path(key)
+        try:
+            stats = os.stat(stored)
+            if (stats.st_size, stats.st_mtime_ns) != tuple(record):
+                raise OSError(f"{stored} has changed since it was stored")
+            # A copy can take a while, the cache is not locked while the output is placed
+            self._place(stored, output_file, self.link if link is None else link)
+        except OSError:
+            with self._lock:
+                self._remove([key])
+                self._db.commit()
+            return False
+        with self._lock:
+            self._db.execute("UPDATE outputs SET last_used=? WHERE key=?", [time.time(), key])
+            self._db.commit()
+        return True
+
+    def put(self, key, output_file, link=None):
+        """
+        Stores the output of an encode
+        :param key: the key of the encode, see make_key
+        :param output_file: the output file
+        :param link: hard link the output, defaults to the link setting of the cache, see get
+        :return: True if the output was stored
+        """
+        try:
+            if os.path.getsize(output_file) > self.max_bytes:
+                return False
+            stored = self._path(key)
+            os.makedirs(os.path.dirname(stored), exist_ok=True)
+            temp_file = f"{stored}.{threading.get_ident()}.tmp"
+            self._place(output_file, temp_file, self.link if link is None else link)
+            os.replace(temp_file, stored)
+            stats = os.stat(stored)
+        except OSError:
+            return False
+        size = stats.st_size
+        with self._lock:
+            existing = self._db.execute("SELECT bytes FROM outputs WHERE key=?", [key]).fetchone()
+            self._db.execute("INSERT OR REPLACE INTO outputs VALUES(?, ?, ?, ?)",
+                             [key, size, time.time(), stats.st_mtime_ns])
+            if existing is None:
+                self._entries += 1
+            else:
+                self._bytes -= existing[0]
+            self._bytes += size
+            if self._bytes > self.max_bytes:
+                self._evict()
+            self._db.commit()
+        return True
+
+    def _evict(self):
+        # Evict down to 90% of the limit so that eviction does not run on every encode once the cache is full
+        keep = int(self.max_bytes * 0.9)
+        records = self._db.execute("SELECT key FROM (SELECT key, SUM(bytes) OVER (ORDER BY last_used DESC) AS running "
+                                   "FROM outputs) WHERE running > ?", [keep]).fetchall()
+        self._remove([key for key, in records])
+
+    def _remove(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+        self._db.executemany("DELETE FROM outputs WHERE key=?", [(key,) for key in keys])
+        self._entries, self._bytes = self._db.execute("SELECT COUNT(*), IFNULL(SUM(bytes), 0) FROM outputs").fetchone()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    @staticmethod
+    def _place(source, destination, link):
+        if os.path.lexists(destination):
+            os.remove(destination)
+        if link:
+            try:
+                os.link(source, destination)
+                return
+            except OSError:
+                # Different file systems, or a file system without hard links
+                pass
+        shutil.copyfile(source, destination)
+
+    def __len__(self):
+        return self._entries
+
+    def size(self):
+        """
+        :return: the number of bytes of outputs stored
+        """
+        return self._bytes
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+
+def get_default_cache(max_bytes):
+    """
+    :param max_bytes: the maximum size of the stored outputs, used when the cache is first opened
+    :return: the encode cache shared by the application
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = EncodeCache(max_bytes=max_bytes)
+        return _default_cache
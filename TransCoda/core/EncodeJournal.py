@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+from common import CommonUtils
+from TransCoda.core.Encoda import EncoderStatus
+
+JournalEntry = namedtuple("JournalEntry", ["key", "file", "url", "status", "output_file", "time"])
+
+# The states of an item that has not finished encoding
+UNFINISHED = {EncoderStatus.WAITING, EncoderStatus.IN_PROGRESS}
+_FINISHED_MARKER = "finished"
+# The resolution of file modification times on some file systems
+_MTIME_TOLERANCE = 2
+
+
+class EncodeJournal:
+    """
+    An append-only journal of the state transitions of the items being encoded. Each transition is a line of JSON
+    that is flushed to disk before the next one is written, so a crash loses at most the line being written.
+    The encode list is still saved when the application closes, the journal is replayed over it when the application
+    starts, to find the items whose encode was interrupted and the state of the items that finished since the encode
+    list was saved.
+    The journal can be shared between threads
+    """
+    def __init__(self, journal_file=None):
+        """
+        :param journal_file: the journal file. The file in the TransCoda data directory is used if not provided
+        """
+        if journal_file is None:
+            journal_file = os.path.join(CommonUtils.get_app_data_dir("TransCoda"), "encode_journal.jsonl")
+        self.journal_file = journal_file
+        self._lock = threading.Lock()
+        self._file = open(journal_file, "a")
+
+    def record(self, item, status):
+        """
+        Records the new status of an item
+        :param item: the FileItem
+        :param status: the EncoderStatus
+        """
+        self.record_many([item], status)
+
+    def record_many(self, items, status):
+        """
+        Records the new status of many items with a single write
+        """
+        now = time.time()
+        self._write("".join(json.dumps({"key": item.file_key(), "file": item.file, "url": item.url,
+                                        "status": status.name, "output_file": item.output_file, "time": now}) + "\n"
+                            for item in items))
+
+    def record_finished(self):
+        """
+        Records that the executor has stopped. Items still waiting were dropped rather than interrupted
+        """
+        self._write(json.dumps({"event": _FINISHED_MARKER, "time": time.time()}) + "\n")
+
+    def replay(self):
+        """
+        Reads the journal back
+        :return: a dictionary of item key to the JournalEntry of its last transition. Items that were waiting when
+        the executor stopped are returned as READY
+        """
+        with self._lock:
+            return self._replay_locked()
+
+    def _replay_locked(self):
+        self._file.flush()
+        entries = {}
+        with open(self.journal_file) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last line is incomplete if the application died while writing it
+                    continue
+                if record.get("event") == _FINISHED_MARKER:
+                    for key, entry in entries.items():
+                        if entry.status in UNFINISHED:
+                            entries[key] = entry._replace(status=EncoderStatus.READY)
+                else:
+                    entries[record["key"]] = JournalEntry(record["key"], record["file"], record["url"],
+                                                          EncoderStatus[record["status"]], record["output_file"],
+                                                          record["time"])
+        return entries
+
+    def compact(self):
+        """
+        Rewrites the journal with only the items that have not finished. Called once the encode list, which holds the
+        state of the finished items, has been saved
+        """
+        temp_file = self.journal_file + ".tmp"
+        # A transition recorded between the read and the rewrite would be lost
+        with self._lock:
+            unfinished = [entry for entry in self._replay_locked().values() if entry.status in UNFINISHED]
+            with open(temp_file, "w") as f:
+                for entry in unfinished:
+                    f.write(json.dumps(entry._replace(status=entry.status.name)._asdict()) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(temp_file, self.journal_file)
+            self._file = open(self.journal_file, "a")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def _write(self, text):
+        with self._lock:
+            self._file.write(text)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+
+def restore(items, entries):
+    """
+    Applies the replayed journal to the saved encode list
+    :param items: the FileItems of the saved encode list, updated in place
+    :param entries: the replayed journal
+    :return: a tuple of the items whose encode was interrupted, with their status reset to READY, and the entries of
+    the items that were encoded but are missing from the encode list, such as items added since it was last saved.
+    The partial outputs of the missing items are deleted too, restore the items re-created for them to restart them
+    """
+    interrupted = []
+    found = set()
+    for item in items:
+        entry = entries.get(item.file_key())
+        if entry is None:
+            continue
+        found.add(entry.key)
+        if entry.status in UNFINISHED:
+            remove_partial_output(entry)
+            item.status = EncoderStatus.READY
+            item.clear_execution()
+            interrupted.append(item)
+        else:
+            item.status = entry.status
+    missing = [entry for key, entry in entries.items() if key not in found]
+    for entry in missing:
+        if entry.status in UNFINISHED:
+            remove_partial_output(entry)
+    return interrupted, missing
+
+
+def remove_partial_output(entry):
+    """
+    Deletes the output of an encode that was killed part way through. The output is only deleted if it was written
+    after the encode started, a file that already existed is left alone
+    :param entry: the JournalEntry of the interrupted encode
+    :return: True if the output was deleted
+    """
+    if entry.status != EncoderStatus.IN_PROGRESS or not entry.output_file:
+        return False
+    try:
+        if os.path.getmtime(entry.output_file) + _MTIME_TOLERANCE < entry.time:
+            return False
+        os.remove(entry.output_file)
+        return True
+    except OSError:
+        return False
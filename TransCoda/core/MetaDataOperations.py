@@ -11,6 +11,12 @@ from TransCoda.core.Encoda import EncoderStatus
 from TransCoda.ui.File import FileItem, Header
 
 
+_METADATA_FIELDS = [MetaDataFields.bit_rate, MetaDataFields.duration, MetaDataFields.codec_long_name,
+                    MetaDataFields.sample_rate, MetaDataFields.channels, MetaDataFields.artist,
+                    MetaDataFields.album_artist, MetaDataFields.title, MetaDataFields.album, MetaDataFields.track,
+                    MetaDataFields.genre]
+
+
 class FileMetaDataExtractor(CommonUtils.Command):
     def __init__(self, input_files, batch_size=15):
         super().__init__()
@@ -22,11 +28,16 @@ class FileMetaDataExtractor(CommonUtils.Command):
 
     def do_work(self):
         batch = []
+        to_read = [item.file for item in self.files
+                   if item.url is None and item.status != EncoderStatus.REMOVE and item.is_supported()]
+        all_metadata = dict(zip(to_read, MediaMetaData.get_metadata_many(to_read, fields=_METADATA_FIELDS),
+                                strict=True))
+        all_history = TransCodaHistory.get_history_many([item.display_name() for item in self.files])
         for item in self.files:
             if item.url is not None:
                 item.status = EncoderStatus.READY
             elif item.status != EncoderStatus.REMOVE and item.is_supported():
-                metadata = MediaMetaData.get_metadata(item.file)
+                metadata = all_metadata[item.file]
                 if not metadata:
                     item.status = EncoderStatus.UNSUPPORTED
                     item.update_output_file()
@@ -49,7 +60,7 @@ class FileMetaDataExtractor(CommonUtils.Command):
                     self._add_optional_field(item_meta_data, Header.genre, metadata, MetaDataFields.genre)
                     item.add_metadata(item_meta_data)
 
-            history = TransCodaHistory.get_history(item.display_name())
+            history = all_history.get(item.display_name())
             if history:
                 item.history_result = history
 
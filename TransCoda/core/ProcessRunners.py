@@ -1,14 +1,20 @@
 import datetime
+import json
 import os
 import random
 import re
 import shlex
 import shutil
 import subprocess
+import tempfile
+import threading
 from shutil import which
 
 from PyQt5.QtCore import QObject, pyqtSignal
 
+import TransCoda
+from common import CommonUtils, ProcessSupervisor
+
 
 class ProcessRunner(QObject):
     status_event = pyqtSignal(str, int, int)
@@ -18,6 +24,8 @@ class ProcessRunner(QObject):
         super().__init__()
         self.__dict__.update(kwargs)
         self.status_throttle = 0
+        self.process = None
+        self.cancelled = False
 
     def update_status(self, input_file, total, completed):
         if self.status_throttle == 0:
@@ -26,6 +34,30 @@ class ProcessRunner(QObject):
         else:
             self.status_throttle = self.status_throttle - 1
 
+    def execute(self, command, on_line):
+        """
+        Runs a command on the shared process supervisor and waits for it to end
+        :param command: the command
+        :param on_line: called with each line the command writes to stdout or stderr
+        :raises ProcessCancelledException: if the runner was cancelled before the command ended
+        """
+        self.process = ProcessSupervisor.get_default_supervisor().submit(
+            command, on_line=lambda line, _stream: on_line(line), merge_stderr=True, capture_output=False)
+        if self.cancelled:
+            self.process.cancel()
+        result = self.process.result()
+        if result.cancelled:
+            raise ProcessCancelledException(f"{command} was cancelled")
+        return result
+
+    def cancel(self):
+        """
+        Kills the running command
+        """
+        self.cancelled = True
+        if self.process is not None:
+            self.process.cancel()
+
 
 class FileCopyProcessRunner(ProcessRunner):
     def __init__(self, **kwargs):
@@ -48,19 +80,14 @@ class YoutubeDlProcessRunner(ProcessRunner):
     def run(self):
         command = f"youtube-dl {self.input_url} {self.base_command} \'{self._get_file_name()}\'"
         self.message_event.emit(self.input_file, datetime.datetime.now(), command)
-        process = subprocess.Popen(
-            shlex.split(command),
-            stdin=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True
-        )
-
-        for line in process.stderr:
-            self.message_event.emit(self.input_file, datetime.datetime.now(), line)
-            self.progress = self.progress + 1
-            if self.progress >= 100:
-                self.progress = 0
-            self.update_status(self.input_file, 100, self.progress)
+        self.execute(command, self._read_progress)
+
+    def _read_progress(self, line):
+        self.message_event.emit(self.input_file, datetime.datetime.now(), line)
+        self.progress = self.progress + 1
+        if self.progress >= 100:
+            self.progress = 0
+        self.update_status(self.input_file, 100, self.progress)
 
     def _get_file_name(self):
         file_name_command = f"youtube-dl --get-filename --output-na-placeholder '' " \
@@ -108,35 +135,27 @@ class YoutubeDlFfmpegProcessRunner(YoutubeDlProcessRunner):
 class FFMPEGProcessRunner(ProcessRunner):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        self.total_secs = None
         if which("ffmpeg") is None:
             raise EncoderNotFoundException
 
     def run(self):
         command = self.generate_command()
         self.message_event.emit(self.input_file, datetime.datetime.now(), command)
-        process = subprocess.Popen(
-            shlex.split(command),
-            stdin=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True
-        )
-
-        duration_found = False
-        time_seeking = False
-        total_secs = 0
-        for line in process.stderr:
-            self.message_event.emit(self.input_file, datetime.datetime.now(), line)
-            if not duration_found:
-                dur = re.search("duration: [0-9:]+", line.lower())
-                if dur:
-                    total_secs = self.get_seconds(dur.group(0)[10:])
-                    duration_found = True
-                    time_seeking = True
-            elif time_seeking:
-                time = re.search("time=[0-9:]+", line.lower())
-                if time:
-                    completed = self.get_seconds(time.group(0)[5:])
-                    self.update_status(self.input_file, total_secs, completed)
+        self.total_secs = None
+        self.execute(command, self._read_progress)
+
+    def _read_progress(self, line):
+        self.message_event.emit(self.input_file, datetime.datetime.now(), line)
+        if self.total_secs is None:
+            dur = re.search("duration: [0-9:]+", line.lower())
+            if dur:
+                self.total_secs = self.get_seconds(dur.group(0)[10:])
+        else:
+            time = re.search("time=[0-9:]+", line.lower())
+            if time:
+                completed = self.get_seconds(time.group(0)[5:])
+                self.update_status(self.input_file, self.total_secs, completed)
 
     @staticmethod
     def get_seconds(string):
@@ -150,6 +169,203 @@ class FFMPEGProcessRunner(ProcessRunner):
                f" -i \"{self.input_file}\" {self.base_command} \"{self.output_file}\""
 
 
+def split_at_keyframes(keyframes, duration, segment_seconds):
+    """
+    Plans the segments of a video. Segments start at a keyframe and are at least segment_seconds long, except for the
+    last one, which is never shorter than half of that
+    :param keyframes: the times of the keyframes of the video, in seconds
+    :param duration: the duration of the video, in seconds
+    :param segment_seconds: the minimum length of a segment
+    :return: a list of the start and length of each segment, in seconds
+    """
+    starts = [0.0]
+    for keyframe in sorted(keyframes):
+        if keyframe - starts[-1] >= segment_seconds and duration - keyframe >= segment_seconds / 2:
+            starts.append(keyframe)
+    return [(start, end - start) for start, end in zip(starts, starts[1:] + [duration], strict=True)]
+
+
+class _SegmentCommand(CommonUtils.Command):
+    """
+    Runs one of the ffmpeg commands of a SegmentedFFMPEGProcessRunner
+    """
+    def __init__(self, runner, index, length, output_file, command):
+        super().__init__()
+        self.runner = runner
+        self.index = index
+        self.length = length
+        self.output_file = output_file
+        self.command = command
+        self.result = None
+
+    def do_work(self):
+        self.result = self.runner.execute_segment(self)
+
+
+class SegmentedFFMPEGProcessRunner(FFMPEGProcessRunner):
+    """
+    Encodes a video as segments that start at its keyframes. The segments are encoded at the same time on a
+    CommandExecutionFactory and joined, without encoding them again, with the ffmpeg concat demuxer. The audio is
+    encoded separately, in one piece, so that the joins do not introduce gaps in it, and muxed with the joined video.
+    The progress of all the segments is reported as the progress of the video.
+    Videos too short to split, with streams other than video and audio, such as subtitles and attachments, or that
+    cannot be encoded in segments, are encoded in one piece
+    """
+    def __init__(self, segment_seconds=60, max_segments=None, **kwargs):
+        super().__init__(segment_seconds=segment_seconds, max_segments=max_segments or os.cpu_count() or 1, **kwargs)
+        if which("ffprobe") is None:
+            raise EncoderNotFoundException
+        self.executor = None
+        self._lock = threading.Lock()
+        self._handles = []
+        self._progress = {}
+        self._total = 0
+
+    def run(self):
+        try:
+            duration, has_audio = self._probe()
+            segments = split_at_keyframes(self._keyframes(), duration, self.segment_seconds)
+            if len(segments) < 2:
+                raise SegmentationException(f"{duration} seconds is too short to split")
+            with tempfile.TemporaryDirectory(prefix=".segments_", dir=os.path.dirname(self.output_file)) as work_dir:
+                self._encode_segments(segments, duration, has_audio, work_dir)
+        except SegmentationException as exception:
+            if self.cancelled:
+                raise ProcessCancelledException(f"{self.input_file} was cancelled") from exception
+            self.message_event.emit(self.input_file, datetime.datetime.now(),
+                                    f"Encoding in one piece, the video could not be encoded in segments: {exception}")
+            super().run()
+
+    def cancel(self):
+        super().cancel()
+        with self._lock:
+            handles = list(self._handles)
+        for handle in handles:
+            handle.cancel()
+        if self.executor is not None:
+            self.executor.stop_scan()
+
+    def execute_segment(self, segment):
+        """
+        Runs the command of a segment, called from the threads of the executor
+        :param segment: the _SegmentCommand
+        :return: the ProcessResult
+        """
+        self.message_event.emit(self.input_file, datetime.datetime.now(), segment.command)
+        handle = ProcessSupervisor.get_default_supervisor().submit(
+            segment.command, on_line=lambda line, _stream: self._read_segment_progress(segment, line),
+            merge_stderr=True, capture_output=False)
+        with self._lock:
+            self._handles.append(handle)
+        if self.cancelled:
+            handle.cancel()
+        return handle.result()
+
+    def _encode_segments(self, segments, duration, has_audio, work_dir):
+        _, extension = os.path.splitext(self.output_file)
+        commands = []
+        for index, (start, length) in enumerate(segments):
+            output_file = os.path.join(work_dir, f"segment_{index:05d}{extension}")
+            commands.append(_SegmentCommand(self, index, length, output_file,
+                                            self._segment_command(start, length, output_file)))
+        if has_audio:
+            output_file = os.path.join(work_dir, f"audio{extension}")
+            commands.append(_SegmentCommand(self, len(segments), duration, output_file,
+                                            self._audio_command(output_file)))
+        self._progress = {}
+        self._total = sum(command.length for command in commands)
+        self.executor = CommonUtils.CommandExecutionFactory(commands, logger=TransCoda.logger,
+                                                            max_threads=self.max_segments)
+        if self.cancelled:
+            self.executor.stop_scan()
+        self.executor.start()
+        self.executor.wait()
+        if self.cancelled:
+            raise ProcessCancelledException(f"{self.input_file} was cancelled")
+        failed = [command for command in commands if command.result is None or command.result.returncode != 0]
+        if len(failed) > 0:
+            raise SegmentationException(f"{len(failed)} of {len(commands)} segments failed")
+
+        concat_list = os.path.join(work_dir, "segments.txt")
+        with open(concat_list, "w") as f:
+            for command in commands[:len(segments)]:
+                escaped = command.output_file.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        mux_command = self._mux_command(concat_list, commands[-1].output_file if has_audio else None)
+        self.message_event.emit(self.input_file, datetime.datetime.now(), mux_command)
+        result = self.execute(mux_command, self._log_line)
+        if result.returncode != 0:
+            raise SegmentationException(f"The segments could not be joined, ffmpeg exited with {result.returncode}")
+
+    def _probe(self):
+        result = ProcessSupervisor.get_default_supervisor().run(
+            f"ffprobe -v error -show_entries format=duration:stream=codec_type -of json \"{self.input_file}\"")
+        try:
+            probe = json.loads(result.stdout)
+            duration = float(probe["format"]["duration"])
+        except (ValueError, KeyError) as exception:
+            raise SegmentationException(f"The duration could not be read. {result.stderr.strip()}") from exception
+        stream_types = {stream.get("codec_type") for stream in probe.get("streams", [])}
+        # The joined video is muxed with the encoded audio only, a one piece encode keeps the other streams
+        other_types = stream_types - {"video", "audio"}
+        if len(other_types) > 0:
+            raise SegmentationException(f"The {', '.join(sorted(map(str, other_types)))} streams are kept in one piece")
+        return duration, "audio" in stream_types
+
+    def _keyframes(self):
+        keyframes = []
+
+        def read_packet(line, stream):
+            # pts_time,flags for example 10.010000,K_
+            fields = line.strip().split(",")
+            if stream == "stdout" and len(fields) >= 2 and "K" in fields[1]:
+                try:
+                    keyframes.append(float(fields[0]))
+                except ValueError:
+                    pass
+
+        result = ProcessSupervisor.get_default_supervisor().run(
+            f"ffprobe -v error -select_streams v:0 -show_entries packet=pts_time,flags -of csv=p=0 "
+            f"\"{self.input_file}\"", on_line=read_packet, capture_output=False)
+        if result.returncode != 0:
+            raise SegmentationException("The keyframes could not be read")
+        return keyframes
+
+    def _read_segment_progress(self, segment, line):
+        self._log_line(line)
+        time = re.search("time=[0-9:]+", line.lower())
+        if time:
+            self._progress[segment.index] = min(self.get_seconds(time.group(0)[5:]), segment.length)
+            self.update_status(self.input_file, int(self._total), int(sum(self._progress.values())))
+
+    def _log_line(self, line):
+        self.message_event.emit(self.input_file, datetime.datetime.now(), line)
+
+    def _segment_command(self, start, length, output_file):
+        # The other streams are dropped on input, they are encoded or copied from the input file in one piece
+        return f"ffmpeg" \
+               f" -hide_banner -loglevel repeat+verbose -y" \
+               f" -ss {start:.6f} -t {length:.6f} -an -sn -dn" \
+               f" -i \"{self.input_file}\" {self.base_command} \"{output_file}\""
+
+    def _audio_command(self, output_file):
+        return f"ffmpeg" \
+               f" -hide_banner -loglevel repeat+verbose -y" \
+               f" -vn -sn -dn" \
+               f" -i \"{self.input_file}\" {self.base_command} \"{output_file}\""
+
+    def _mux_command(self, concat_list, audio_file):
+        inputs = f" -f concat -safe 0 -i \"{concat_list}\""
+        maps = " -map 0:v"
+        if audio_file is not None:
+            inputs += f" -i \"{audio_file}\""
+            maps += " -map 1:a"
+        metadata = "-1" if self.delete_metadata else str(2 if audio_file is not None else 1)
+        return f"ffmpeg" \
+               f" -hide_banner -loglevel repeat+verbose -y" \
+               f"{inputs} -i \"{self.input_file}\"{maps} -map_metadata {metadata} -c copy \"{self.output_file}\""
+
+
 class HandbrakeProcessRunner(ProcessRunner):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -159,22 +375,17 @@ class HandbrakeProcessRunner(ProcessRunner):
     def run(self):
         command = self.generate_command()
         self.message_event.emit(self.input_file, datetime.datetime.now(), command)
-        process = subprocess.Popen(
-            shlex.split(command),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True
-        )
-
-        for line in process.stdout:
-            self.message_event.emit(self.input_file, datetime.datetime.now(), line)
-            progress = re.search("Encoding: task 1 of 1", line)
-            if progress:
-                txt = line.replace("Encoding: task 1 of 1, ", "")
-                tokens = txt.split("%")
-                self.update_status(self.input_file, 100, float(tokens[0]))
-            elif line.startswith("Encode done!"):
-                self.update_status(self.input_file, 100, 100)
+        self.execute(command, self._read_progress)
+
+    def _read_progress(self, line):
+        self.message_event.emit(self.input_file, datetime.datetime.now(), line)
+        progress = re.search("Encoding: task 1 of 1", line)
+        if progress:
+            txt = line.replace("Encoding: task 1 of 1, ", "")
+            tokens = txt.split("%")
+            self.update_status(self.input_file, 100, float(tokens[0]))
+        elif line.startswith("Encode done!"):
+            self.update_status(self.input_file, 100, 100)
 
     def generate_command(self):
         return f"HandBrakeCLI"\
@@ -185,6 +396,14 @@ class EncoderNotFoundException(Exception):
     """Thrown when FFMPEG was not found in the system"""
 
 
+class ProcessCancelledException(Exception):
+    """Thrown when an encoder process is killed before it completes"""
+
+
+class SegmentationException(Exception):
+    """Thrown when a video cannot be encoded in segments"""
+
+
 runners_registry = {
     "ffmpeg": FFMPEGProcessRunner,
     "HandBrakeCLI": HandbrakeProcessRunner,
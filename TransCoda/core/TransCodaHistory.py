@@ -1,8 +1,13 @@
+import datetime
 import json
 import os
+import shutil
 import sqlite3
+import threading
+from collections import namedtuple
 from enum import Enum
 
+from common import CommonUtils
 from TransCoda.core.Encoda import EncoderStatus
 
 
@@ -17,57 +22,254 @@ class TransCodaHistoryFields(Enum):
     encoder = "encoder"
 
 
-_history_db = os.path.join(os.path.dirname(__file__), "../resource/history.json1.sqlite")
+# An execution of an encoder. encoder is the command that was run and encoder_name the name of the encoder in the
+# settings, if known
+HistoryEntry = namedtuple("HistoryEntry", ["input_file", "output_file", "start_time", "end_time", "input_size",
+                                           "output_size", "status", "message", "encoder", "encoder_name"],
+                          defaults=[None])
 
-with sqlite3.connect(_history_db) as _db:
-    _db.execute("CREATE TABLE IF NOT EXISTS history(file_name TEXT PRIMARY KEY, data json)")
-    _db.commit()
+# The executions of an encoder. failure_rate is the percentage of executions that failed, compression_ratio the
+# average space saved by the successful executions, as a percentage of the input size, and throughput the input bytes
+# encoded per second. Executions recorded before the encode times were kept do not count towards the throughput
+EncoderStatistics = namedtuple("EncoderStatistics", ["encoder", "executions", "failures", "failure_rate",
+                                                     "compression_ratio", "input_size", "output_size", "seconds",
+                                                     "throughput"])
+
+_SCHEMA_VERSION = 1
+_EXECUTION_COLUMNS = "file_name, output_file, start_time, end_time, input_size, output_size, status, message, " \
+                     "encoder, encoder_name"
+
+# The history used to be stored inside the package, it is moved to the data directory the first time it is opened
+_legacy_history_db = os.path.join(os.path.dirname(__file__), "../resource/history.json1.sqlite")
+
+_default_history = None
+_default_history_lock = threading.Lock()
+
+
+class TransCodaHistory:
+    """
+    The encode history of each input file. The history is kept in a SQLite database, in WAL mode, through a single
+    connection, so that reads are not blocked while encodes are being recorded.
+    The history of many files is read with one query and many encodes are recorded in one transaction.
+    The history can be shared between threads
+    """
+    def __init__(self, history_db=None):
+        """
+        :param history_db: the database file. The file in the TransCoda data directory is used if not provided
+        """
+        if history_db is None:
+            history_db = os.path.join(CommonUtils.get_app_data_dir("TransCoda"), "history.json1.sqlite")
+            if not os.path.exists(history_db) and os.path.exists(_legacy_history_db):
+                shutil.copyfile(_legacy_history_db, history_db)
+        self.history_db = history_db
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(history_db, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._upgrade()
+
+    def _upgrade(self):
+        """
+        Creates the executions table. The history used to be stored as a JSON array of executions per file, in the
+        history table, those executions are moved to the executions table in the same transaction
+        """
+        if self._db.execute("PRAGMA user_version").fetchone()[0] >= _SCHEMA_VERSION:
+            return
+        self._db.execute("BEGIN")
+        try:
+            self._db.execute("CREATE TABLE IF NOT EXISTS executions(id INTEGER PRIMARY KEY, file_name TEXT NOT NULL, "
+                             "output_file TEXT, start_time TEXT, end_time TEXT, seconds REAL, input_size INTEGER, "
+                             "output_size INTEGER, status TEXT, message TEXT, encoder TEXT, encoder_name TEXT)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_executions_file_name ON executions(file_name)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_executions_encoder ON executions(encoder_name, encoder)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_executions_end_time ON executions(end_time)")
+            if self._db.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='history'").fetchone():
+                # The JSON history only kept the dates, as YYYY.MM.DD
+                self._db.execute(f"INSERT INTO executions({_EXECUTION_COLUMNS}) "
+                                 f"SELECT file_name, json_extract(value, '$.output_file'), "
+                                 f"replace(json_extract(value, '$.start_time'), '.', '-'), "
+                                 f"replace(json_extract(value, '$.end_time'), '.', '-'), "
+                                 f"json_extract(value, '$.input_size'), json_extract(value, '$.output_size'), "
+                                 f"json_extract(value, '$.status'), json_extract(value, '$.message'), "
+                                 f"json_extract(value, '$.encoder'), NULL "
+                                 f"FROM history, json_each(history.data) ORDER BY history.rowid, json_each.key")
+                self._db.execute("DROP TABLE history")
+            self._db.execute(f"PRAGMA user_version={_SCHEMA_VERSION}")
+            self._db.commit()
+        except Exception:
+            self._db.rollback()
+            raise
+
+    def get_history(self, file_name):
+        """
+        :param file_name: the input file
+        :return: the list of executions of the file, or None if it has never been encoded
+        """
+        return self.get_history_many([file_name]).get(file_name)
+
+    def get_history_many(self, file_names):
+        """
+        Reads the history of many files with one query, rather than one per file
+        :param file_names: the input files
+        :return: a dictionary of file to its list of executions, for the files that have been encoded before
+        """
+        with self._lock:
+            records = self._db.execute(f"SELECT {_EXECUTION_COLUMNS} FROM executions "
+                                       f"WHERE file_name IN (SELECT value FROM json_each(?)) ORDER BY id",
+                                       [json.dumps(list(file_names))]).fetchall()
+        history = {}
+        for record in records:
+            history.setdefault(record[0], []).append(_to_execution(record))
+        return history
+
+    def set_history(self, input_file, output_file, start_time, end_time, input_size, output_size, status, message,
+                    encoder, encoder_name=None):
+        """
+        Records an execution of a file. See HistoryEntry for the arguments
+        """
+        self.set_history_many([HistoryEntry(input_file, output_file, start_time, end_time, input_size, output_size,
+                                            status, message, encoder, encoder_name)])
+
+    def set_history_many(self, entries):
+        """
+        Records many executions in a single transaction
+        :param entries: the HistoryEntry of each execution
+        """
+        records = [_to_record(entry) for entry in entries]
+        with self._lock:
+            self._db.executemany(f"INSERT INTO executions({_EXECUTION_COLUMNS}, seconds) "
+                                 f"VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", records)
+            self._db.commit()
+
+    def del_history(self, file_name):
+        with self._lock:
+            self._db.execute("DELETE FROM executions where file_name=?", [file_name])
+            self._db.commit()
+
+    def encoder_statistics(self, since=None, until=None):
+        """
+        Summarizes the executions of each encoder
+        :param since: only count the executions that ended at or after this datetime
+        :param until: only count the executions that ended before this datetime
+        :return: the EncoderStatistics of each encoder, the most used first
+        """
+        where, parameters = _time_range(since, until)
+        with self._lock:
+            records = self._db.execute(
+                f"SELECT IFNULL(encoder_name, encoder) AS name, COUNT(*), SUM(status = 'ERROR'), "
+                f"AVG(CASE WHEN status = 'SUCCESS' THEN 100 - output_size * 100.0 / NULLIF(input_size, 0) END), "
+                f"SUM(CASE WHEN status = 'SUCCESS' THEN input_size END), "
+                f"SUM(CASE WHEN status = 'SUCCESS' THEN output_size END), "
+                f"SUM(CASE WHEN status = 'SUCCESS' AND seconds > 0 THEN seconds END), "
+                f"SUM(CASE WHEN status = 'SUCCESS' AND seconds > 0 THEN input_size END) "
+                f"FROM executions {where} GROUP BY name ORDER BY COUNT(*) DESC, name", parameters).fetchall()
+        statistics = []
+        for name, executions, failures, ratio, input_size, output_size, seconds, timed_input_size in records:
+            statistics.append(EncoderStatistics(
+                encoder=name, executions=executions, failures=failures, failure_rate=failures * 100 / executions,
+                compression_ratio=ratio, input_size=input_size or 0, output_size=output_size or 0,
+                seconds=seconds or 0, throughput=timed_input_size / seconds if seconds else None))
+        return statistics
+
+    def recent_failures(self, since=None, limit=100):
+        """
+        :param since: only return the executions that ended at or after this datetime
+        :param limit: the maximum number of executions to return
+        :return: the HistoryEntry of the failed executions, the most recent first. The times are datetimes
+        """
+        where, parameters = _time_range(since, None, "status = 'ERROR'")
+        with self._lock:
+            records = self._db.execute(f"SELECT {_EXECUTION_COLUMNS} FROM executions {where} "
+                                       f"ORDER BY end_time DESC, id DESC LIMIT ?", parameters + [limit]).fetchall()
+        return [HistoryEntry(file_name, output_file, _to_datetime(start_time), _to_datetime(end_time), input_size,
+                             output_size, EncoderStatus[status], message, encoder, encoder_name)
+                for file_name, output_file, start_time, end_time, input_size, output_size, status, message, encoder,
+                encoder_name in records]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _to_record(entry):
+    seconds = (entry.end_time - entry.start_time).total_seconds() if entry.start_time and entry.end_time else None
+    return (entry.input_file, entry.output_file, _to_text(entry.start_time), _to_text(entry.end_time),
+            entry.input_size, entry.output_size, entry.status.name, entry.message, entry.encoder, entry.encoder_name,
+            seconds)
+
+
+def _to_execution(record):
+    _, output_file, start_time, end_time, input_size, output_size, status, message, encoder, _ = record
+    # Executions are still reported with the dates only, as they were when the history was stored as JSON
+    return {
+        TransCodaHistoryFields.output_file: output_file,
+        TransCodaHistoryFields.start_time: start_time[:10].replace("-", ".") if start_time else None,
+        TransCodaHistoryFields.end_time: end_time[:10].replace("-", ".") if end_time else None,
+        TransCodaHistoryFields.status: EncoderStatus[status],
+        TransCodaHistoryFields.message: message,
+        TransCodaHistoryFields.input_size: input_size,
+        TransCodaHistoryFields.output_size: output_size,
+        TransCodaHistoryFields.encoder: encoder
+    }
+
+
+def _to_text(time):
+    return time.isoformat(sep=" ", timespec="seconds") if time else None
+
+
+def _to_datetime(text):
+    return datetime.datetime.fromisoformat(text) if text else None
+
+
+def _time_range(since, until, *conditions):
+    conditions = list(conditions)
+    parameters = []
+    if since is not None:
+        conditions.append("end_time >= ?")
+        parameters.append(_to_text(since))
+    if until is not None:
+        conditions.append("end_time < ?")
+        parameters.append(_to_text(until))
+    return ("WHERE " + " AND ".join(conditions) if conditions else ""), parameters
+
+
+def get_default_history():
+    """
+    :return: the history shared by the application. The database is opened on first use rather than on import,
+    keeping SQLite off the startup path
+    """
+    global _default_history
+    with _default_history_lock:
+        if _default_history is None:
+            _default_history = TransCodaHistory()
+        return _default_history
 
 
 def get_history(file_name):
-    with sqlite3.connect(_history_db) as db:
-        record = db.execute("SELECT data FROM history WHERE file_name=?", [file_name]).fetchone()
-
-    if record is None:
-        return None
-    else:
-        result = []
-        json_array = json.loads(record[0])
-        for execution in json_array:
-            ex_item = {}
-            for entry in execution:
-                key = TransCodaHistoryFields[entry]
-                if key == TransCodaHistoryFields.status:
-                    value = EncoderStatus[execution[entry]]
-                else:
-                    value = execution[entry]
-                ex_item[key] = value
-            result.append(ex_item)
-        return result
-
-
-def set_history(input_file, output_file, start_time, end_time, input_size, output_size, status, message, encoder):
-    data = [
-        {
-            TransCodaHistoryFields.output_file.name: output_file,
-            TransCodaHistoryFields.start_time.value: start_time.strftime("%Y.%m.%d"),
-            TransCodaHistoryFields.end_time.value: end_time.strftime("%Y.%m.%d"),
-            TransCodaHistoryFields.status.value: status.name,
-            TransCodaHistoryFields.message.value: message,
-            TransCodaHistoryFields.input_size.value: input_size,
-            TransCodaHistoryFields.output_size.value: output_size,
-            TransCodaHistoryFields.encoder.value: encoder
-        }
-    ]
-
-    with sqlite3.connect(_history_db) as db:
-        db.execute("INSERT INTO history VALUES(?, ?)"
-                   "ON CONFLICT (file_name) DO UPDATE SET "
-                   "data=json_insert(data, '$[#]', json_extract(excluded.data, '$[0]'))", [input_file, json.dumps(data)])
-        db.commit()
+    return get_default_history().get_history(file_name)
+
+
+def get_history_many(file_names):
+    return get_default_history().get_history_many(file_names)
+
+
+def set_history(input_file, output_file, start_time, end_time, input_size, output_size, status, message, encoder,
+                encoder_name=None):
+    get_default_history().set_history(input_file, output_file, start_time, end_time, input_size, output_size, status,
+                                      message, encoder, encoder_name)
+
+
+def set_history_many(entries):
+    get_default_history().set_history_many(entries)
 
 
 def del_history(file_name):
-    with sqlite3.connect(_history_db) as db:
-        db.execute("DELETE FROM history where file_name=?", [file_name])
-        db.commit()
\ No newline at end of file
+    get_default_history().del_history(file_name)
+
+
+def encoder_statistics(since=None, until=None):
+    return get_default_history().encoder_statistics(since, until)
+
+
+def recent_failures(since=None, limit=100):
+    return get_default_history().recent_failures(since, limit)
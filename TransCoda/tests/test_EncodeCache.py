@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+from TransCoda.core import EncodeCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    _cache = EncodeCache.EncodeCache(str(tmp_path / "cache"), max_bytes=1000)
+    yield _cache
+    _cache.close()
+
+
+def _write(path, size):
+    path.write_bytes(b"x" * size)
+    return str(path)
+
+
+def test__make_key():
+    key = EncodeCache.make_key("digest", "ffmpeg", "-c:a libmp3lame", ".mp3")
+    assert key == EncodeCache.make_key("digest", "ffmpeg", "-c:a libmp3lame", ".MP3")
+    assert key != EncodeCache.make_key("other", "ffmpeg", "-c:a libmp3lame", ".mp3")
+    assert key != EncodeCache.make_key("digest", "ffmpeg", "-c:a libmp3lame -q:a 2", ".mp3")
+    assert key != EncodeCache.make_key("digest", "ffmpeg", "-c:a libmp3lame", ".mp3", delete_metadata=True)
+
+
+def test__reuse_output(cache, tmp_path):
+    output = _write(tmp_path / "first.mp3", 100)
+    assert not cache.get("key", str(tmp_path / "second.mp3"))
+    assert cache.put("key", output)
+    assert cache.get("key", str(tmp_path / "second.mp3"))
+    assert (tmp_path / "second.mp3").read_bytes() == b"x" * 100
+    assert os.stat(tmp_path / "second.mp3").st_ino == os.stat(output).st_ino
+    assert (len(cache), cache.size()) == (1, 100)
+
+
+def test__copy_output(tmp_path):
+    cache = EncodeCache.EncodeCache(str(tmp_path / "cache"), link=False)
+    output = _write(tmp_path / "first.mp3", 100)
+    cache.put("key", output)
+    assert cache.get("key", str(tmp_path / "second.mp3"))
+    assert os.stat(tmp_path / "second.mp3").st_ino != os.stat(output).st_ino
+    cache.close()
+
+
+def test__changed_output_is_dropped(cache, tmp_path):
+    output = _write(tmp_path / "first.mp3", 100)
+    cache.put("key", output)
+    # The stored output is linked to the first output, which was re-tagged
+    with open(output, "ab") as f:
+        f.write(b"tags")
+    assert not cache.get("key", str(tmp_path / "second.mp3"))
+    assert len(cache) == 0
+
+    # Re-tagged in place, without changing the size
+    cache.put("key", output)
+    with open(output, "r+b") as f:
+        f.write(b"TAG")
+    os.utime(output, ns=(0, os.stat(output).st_mtime_ns + 1000000000))
+    assert not cache.get("key", str(tmp_path / "second.mp3"))
+
+
+def test__copied_output_can_be_modified(cache, tmp_path):
+    output = _write(tmp_path / "first.mp3", 100)
+    cache.put("key", output, link=False)
+    assert cache.get("key", str(tmp_path / "second.mp3"), link=False)
+    # Setting the times of the output, as preserving the times of the input does, leaves the stored output unchanged
+    os.utime(tmp_path / "second.mp3", (0, 0))
+    os.utime(output, (0, 0))
+    assert os.stat(cache._path("key")).st_mtime != 0
+    assert cache.get("key", str(tmp_path / "third.mp3"))
+
+
+def test__least_recently_used_outputs_are_evicted(cache, tmp_path):
+    for i in range(0, 5):
+        cache.put(f"key_{i}", _write(tmp_path / f"output_{i}.mp3", 300))
+        if i == 2:
+            assert cache.get("key_0", str(tmp_path / "reused.mp3"))
+    assert cache.size() <= 1000
+    assert cache.get("key_4", str(tmp_path / "reused.mp3"))
+    assert not cache.get("key_1", str(tmp_path / "reused.mp3"))
+    assert not os.path.exists(cache._path("key_1"))
+    assert not cache.put("too_large", _write(tmp_path / "large.mkv", 2000))
@@ -0,0 +1,105 @@
+import os
+import time
+
+import pytest
+
+from TransCoda.core import EncodeJournal
+from TransCoda.core.Encoda import EncoderStatus
+
+
+class _Item:
+    def __init__(self, file, output_file, status=EncoderStatus.READY):
+        self.file = file
+        self.url = None
+        self.output_file = output_file
+        self.status = status
+        self.cleared = False
+
+    def file_key(self):
+        return self.file
+
+    def clear_execution(self):
+        self.cleared = True
+
+
+@pytest.fixture
+def journal(tmp_path):
+    _journal = EncodeJournal.EncodeJournal(str(tmp_path / "journal.jsonl"))
+    yield _journal
+    _journal.close()
+
+
+def test__replay_last_transition(journal, tmp_path):
+    items = [_Item(f"IN_{i}", str(tmp_path / f"OUT_{i}")) for i in range(0, 3)]
+    journal.record_many(items, EncoderStatus.WAITING)
+    journal.record(items[0], EncoderStatus.IN_PROGRESS)
+    journal.record(items[0], EncoderStatus.SUCCESS)
+    journal.record(items[1], EncoderStatus.IN_PROGRESS)
+    entries = journal.replay()
+    assert {key: entry.status for key, entry in entries.items()} == {
+        "IN_0": EncoderStatus.SUCCESS, "IN_1": EncoderStatus.IN_PROGRESS, "IN_2": EncoderStatus.WAITING}
+
+
+def test__incomplete_line_is_ignored(journal):
+    journal.record(_Item("IN_0", "OUT_0"), EncoderStatus.WAITING)
+    with open(journal.journal_file, "a") as f:
+        f.write('{"key": "IN_1", "fi')
+    assert list(journal.replay()) == ["IN_0"]
+
+
+def test__waiting_items_are_dropped_when_finished(journal):
+    items = [_Item("IN_0", "OUT_0"), _Item("IN_1", "OUT_1")]
+    journal.record_many(items, EncoderStatus.WAITING)
+    journal.record(items[0], EncoderStatus.ERROR)
+    journal.record_finished()
+    journal.record(items[0], EncoderStatus.WAITING)
+    entries = journal.replay()
+    assert entries["IN_0"].status == EncoderStatus.WAITING
+    assert entries["IN_1"].status == EncoderStatus.READY
+
+
+def test__restore_and_compact(journal, tmp_path):
+    partial = tmp_path / "OUT_1"
+    existing = tmp_path / "OUT_2"
+    existing.write_bytes(b"encoded last week")
+    os.utime(existing, (time.time() - 86400, time.time() - 86400))
+    items = [_Item("IN_0", "OUT_0"), _Item("IN_1", str(partial)), _Item("IN_2", str(existing))]
+    journal.record_many(items + [_Item("IN_3", "OUT_3")], EncoderStatus.WAITING)
+    journal.record(items[0], EncoderStatus.SUCCESS)
+    journal.record(items[1], EncoderStatus.IN_PROGRESS)
+    journal.record(items[2], EncoderStatus.IN_PROGRESS)
+    partial.write_bytes(b"half an encode")
+
+    interrupted, missing = EncodeJournal.restore(items, journal.replay())
+    assert [item.file for item in interrupted] == ["IN_1", "IN_2"]
+    assert all(item.status == EncoderStatus.READY and item.cleared for item in interrupted)
+    assert items[0].status == EncoderStatus.SUCCESS
+    assert [entry.key for entry in missing] == ["IN_3"]
+    assert not partial.exists()
+    assert existing.exists()
+
+    journal.compact()
+    assert sorted(journal.replay()) == ["IN_1", "IN_2", "IN_3"]
+    journal.record(items[1], EncoderStatus.SUCCESS)
+    assert journal.replay()["IN_1"].status == EncoderStatus.SUCCESS
+
+
+def test__restore_items_missing_from_the_encode_list(journal, tmp_path):
+    partial = tmp_path / "OUT_1"
+    items = [_Item("IN_0", str(tmp_path / "OUT_0")), _Item("IN_1", str(partial)), _Item("IN_2", "OUT_2")]
+    journal.record_many(items, EncoderStatus.WAITING)
+    journal.record(items[0], EncoderStatus.SUCCESS)
+    journal.record(items[1], EncoderStatus.IN_PROGRESS)
+    partial.write_bytes(b"half an encode")
+
+    # The items were added in the session that crashed, the saved encode list does not have them
+    interrupted, missing = EncodeJournal.restore([], journal.replay())
+    assert interrupted == []
+    assert [entry.key for entry in missing] == ["IN_0", "IN_1", "IN_2"]
+    assert not partial.exists()
+
+    recreated = [_Item("IN_0", "OUT_0"), _Item("IN_1", "OUT_1"), _Item("IN_2", "OUT_2")]
+    interrupted, _ = EncodeJournal.restore(recreated, {entry.key: entry for entry in missing})
+    assert [item.file for item in interrupted] == ["IN_1", "IN_2"]
+    assert recreated[0].status == EncoderStatus.SUCCESS
+    assert all(item.status == EncoderStatus.READY for item in interrupted)
@@ -0,0 +1,103 @@
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from common.ProcessSupervisor import ProcessResult
+from TransCoda.core import ProcessRunners
+
+
+@pytest.fixture
+def runner(monkeypatch, tmp_path):
+    monkeypatch.setattr(ProcessRunners, "which", lambda executable: executable)
+    return ProcessRunners.SegmentedFFMPEGProcessRunner(input_file="/videos/in.mkv", input_url=None,
+                                                       output_file=str(tmp_path / "out.mkv"),
+                                                       base_command="-c:v libx264 -c:a aac", delete_metadata=False,
+                                                       segment_seconds=10, max_segments=2)
+
+
+def test__split_at_keyframes():
+    keyframes = [0, 4, 8, 12, 16, 20, 24, 28, 32, 36]
+    assert ProcessRunners.split_at_keyframes(keyframes, 40, 10) == [(0, 12), (12, 12), (24, 16)]
+    # The last segment is not shorter than half of the segment length
+    assert ProcessRunners.split_at_keyframes(keyframes, 38, 10) == [(0, 12), (12, 12), (24, 14)]
+    assert ProcessRunners.split_at_keyframes(keyframes, 40, 60) == [(0, 40)]
+    assert ProcessRunners.split_at_keyframes([], 40, 10) == [(0, 40)]
+
+
+def test__commands(runner):
+    segment = runner._segment_command(12, 12, "/tmp/segment_00001.mkv")
+    assert "-ss 12.000000 -t 12.000000 -an -sn -dn -i \"/videos/in.mkv\"" in segment
+    assert segment.endswith("-c:v libx264 -c:a aac \"/tmp/segment_00001.mkv\"")
+    assert "-vn -sn -dn -i \"/videos/in.mkv\"" in runner._audio_command("/tmp/audio.mkv")
+
+    mux = runner._mux_command("/tmp/segments.txt", "/tmp/audio.mkv")
+    assert "-f concat -safe 0 -i \"/tmp/segments.txt\" -i \"/tmp/audio.mkv\" -i \"/videos/in.mkv\"" in mux
+    assert "-map 0:v -map 1:a -map_metadata 2 -c copy" in mux
+    runner.delete_metadata = True
+    assert "-map 0:v -map_metadata -1 -c copy" in runner._mux_command("/tmp/segments.txt", None)
+
+
+def test__progress_of_all_segments(runner):
+    events = []
+    runner.status_event.connect(lambda file, total, completed: events.append((total, completed)))
+    first = ProcessRunners._SegmentCommand(runner, 0, 12, "a.mkv", "")
+    second = ProcessRunners._SegmentCommand(runner, 1, 28, "b.mkv", "")
+    runner._total = 40
+    runner._read_segment_progress(first, "frame=  100 fps=25 time=00:00:10.00 bitrate=N/A")
+    runner.status_throttle = 0
+    runner._read_segment_progress(second, "frame=  200 fps=25 time=00:00:20.00 bitrate=N/A")
+    runner.status_throttle = 0
+    runner._read_segment_progress(first, "frame=  300 fps=25 time=00:00:12.04 bitrate=N/A")
+    assert events == [(40, 10), (40, 30), (40, 32)]
+
+
+def test__short_video_encoded_in_one_piece(runner, monkeypatch):
+    encoded = []
+    monkeypatch.setattr(runner, "_probe", lambda: (15.0, True))
+    monkeypatch.setattr(runner, "_keyframes", lambda: [0, 5, 10])
+    monkeypatch.setattr(ProcessRunners.FFMPEGProcessRunner, "run", lambda self: encoded.append(self))
+    runner.run()
+    assert encoded == [runner]
+
+
+def test__streams_only_kept_in_one_piece(runner, monkeypatch):
+    class _Supervisor:
+        def __init__(self, stream_types):
+            self.output = json.dumps({"streams": [{"codec_type": stream_type} for stream_type in stream_types],
+                                      "format": {"duration": "120.0"}})
+
+        def run(self, command, **kwargs):
+            return ProcessResult(0, self.output, "", False, False)
+
+    monkeypatch.setattr(ProcessRunners.ProcessSupervisor, "get_default_supervisor",
+                        lambda: _Supervisor(["video", "audio"]))
+    assert runner._probe() == (120.0, True)
+    monkeypatch.setattr(ProcessRunners.ProcessSupervisor, "get_default_supervisor",
+                        lambda: _Supervisor(["video", "audio", "subtitle", "attachment"]))
+    with pytest.raises(ProcessRunners.SegmentationException, match="attachment, subtitle"):
+        runner._probe()
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None,
+                    reason="ffmpeg is not installed")
+def test__segmented_encode(tmp_path):
+    input_file = str(tmp_path / "in.mkv")
+    subprocess.run(["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "testsrc=duration=12:size=160x120:rate=25",
+                    "-f", "lavfi", "-i", "sine=duration=12", "-c:v", "mpeg4", "-g", "25", "-c:a", "pcm_s16le",
+                    input_file], check=True)
+    output_file = str(tmp_path / "out.mkv")
+    runner = ProcessRunners.SegmentedFFMPEGProcessRunner(input_file=input_file, input_url=None,
+                                                         output_file=output_file, base_command="-c:v mpeg4 -c:a flac",
+                                                         delete_metadata=False, segment_seconds=3, max_segments=2)
+    messages = []
+    runner.message_event.connect(lambda file, time, message: messages.append(message))
+    runner.run()
+    assert any("segment_00003" in message for message in messages)
+    duration, has_audio = ProcessRunners.SegmentedFFMPEGProcessRunner._probe(
+        ProcessRunners.SegmentedFFMPEGProcessRunner(input_file=output_file, output_file=output_file))
+    assert has_audio
+    assert abs(duration - 12) < 0.5
+    assert [name for name in os.listdir(tmp_path) if name.startswith(".segments_")] == []
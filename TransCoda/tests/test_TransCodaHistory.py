@@ -1,9 +1,21 @@
 import datetime
+import json
+import sqlite3
+
+import pytest
 
 from TransCoda.core import TransCodaHistory
 from TransCoda.core.Encoda import EncoderStatus
 
 
+@pytest.fixture(autouse=True)
+def history(tmp_path, monkeypatch):
+    _history = TransCodaHistory.TransCodaHistory(str(tmp_path / "history.json1.sqlite"))
+    monkeypatch.setattr(TransCodaHistory, "_default_history", _history)
+    yield _history
+    _history.close()
+
+
 def test__insert_history_item():
     TransCodaHistory.del_history("TEST_FILE")
     TransCodaHistory.set_history("TEST_FILE", "OUTPUT", datetime.datetime.now(), datetime.datetime.now(), 100, 200,
@@ -46,3 +58,64 @@ def test__fetch_history_item_exists():
 def test__fetch_history_item_not_exists():
     value = TransCodaHistory.get_history("TEST_IMAGINARY_FILE")
     assert value is None
+
+
+def test__history_many(history):
+    time_val = datetime.datetime.now()
+    entries = [TransCodaHistory.HistoryEntry(f"TEST_FILE_{i % 3}", "OUTPUT", time_val, time_val, 100, 200,
+                                             EncoderStatus.SUCCESS, "FOO", "ENC") for i in range(0, 1000)]
+    TransCodaHistory.set_history_many(entries)
+    result = TransCodaHistory.get_history_many([f"TEST_FILE_{i}" for i in range(0, 5000)])
+    assert sorted(result) == ["TEST_FILE_0", "TEST_FILE_1", "TEST_FILE_2"]
+    assert len(result["TEST_FILE_0"]) == 334
+    assert result["TEST_FILE_2"][0][TransCodaHistory.TransCodaHistoryFields.status] == EncoderStatus.SUCCESS
+    assert history._db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test__json_history_is_migrated(tmp_path):
+    history_db = str(tmp_path / "legacy.sqlite")
+    with sqlite3.connect(history_db) as db:
+        db.execute("CREATE TABLE history(file_name TEXT PRIMARY KEY, data json)")
+        db.execute("INSERT INTO history VALUES(?, ?)", ["TEST_FILE", json.dumps([
+            {"output_file": "OUT_1", "start_time": "2020.01.02", "end_time": "2020.01.02", "status": "ERROR",
+             "message": "FOO", "input_size": 100, "output_size": 0, "encoder": "ENC"},
+            {"output_file": "OUT_2", "start_time": "2020.01.03", "end_time": "2020.01.03", "status": "SUCCESS",
+             "message": None, "input_size": 100, "output_size": 50, "encoder": "ENC"}])])
+    db.close()
+    history = TransCodaHistory.TransCodaHistory(history_db)
+    result = history.get_history("TEST_FILE")
+    assert [value[TransCodaHistory.TransCodaHistoryFields.output_file] for value in result] == ["OUT_1", "OUT_2"]
+    assert result[0][TransCodaHistory.TransCodaHistoryFields.start_time] == "2020.01.02"
+    assert result[1][TransCodaHistory.TransCodaHistoryFields.status] == EncoderStatus.SUCCESS
+    history.close()
+    # The migration is done once
+    history = TransCodaHistory.TransCodaHistory(history_db)
+    assert len(history.get_history("TEST_FILE")) == 2
+    assert history._db.execute("SELECT name FROM sqlite_master WHERE name='history'").fetchone() is None
+    history.close()
+
+
+def test__encoder_statistics(history):
+    end = datetime.datetime(2021, 3, 1, 12, 0, 0)
+    start = end - datetime.timedelta(seconds=10)
+    history.set_history_many([
+        TransCodaHistory.HistoryEntry("A", "A.mp3", start, end, 1000, 250, EncoderStatus.SUCCESS, None, "lame", "MP3"),
+        TransCodaHistory.HistoryEntry("B", "B.mp3", start, end, 1000, 750, EncoderStatus.SUCCESS, None, "lame", "MP3"),
+        TransCodaHistory.HistoryEntry("C", "C.mp3", start, end, 1000, 0, EncoderStatus.ERROR, "BAD", "lame", "MP3"),
+        TransCodaHistory.HistoryEntry("D", "D.ogg", start - datetime.timedelta(days=60),
+                                      end - datetime.timedelta(days=60), 100, 50, EncoderStatus.SUCCESS, None, "oggenc"),
+    ])
+    mp3, ogg = history.encoder_statistics()
+    assert (mp3.encoder, mp3.executions, mp3.failures) == ("MP3", 3, 1)
+    assert abs(mp3.failure_rate - 100 / 3) < 1e-9
+    assert mp3.compression_ratio == 50
+    assert (mp3.input_size, mp3.output_size, mp3.seconds, mp3.throughput) == (2000, 1000, 20, 100)
+    assert (ogg.encoder, ogg.executions) == ("oggenc", 1)
+
+    recent = history.encoder_statistics(since=end - datetime.timedelta(days=30))
+    assert [stats.encoder for stats in recent] == ["MP3"]
+    assert history.encoder_statistics(until=end - datetime.timedelta(days=30))[0].encoder == "oggenc"
+
+    failures = history.recent_failures()
+    assert len(failures) == 1
+    assert (failures[0].input_file, failures[0].message, failures[0].end_time) == ("C", "BAD", end)
@@ -308,16 +308,26 @@ class FileItemModel(QAbstractTableModel):
         return len(items_to_add)
 
     def update_items(self, items_to_update):
+        # One lookup for the whole batch rather than a linear search per item. Rows are removed last so that the
+        # looked up indices stay valid, and the updated rows are refreshed with a single event
+        lookup = {item.file_key(): index for index, item in enumerate(self.file_items)}
+        removed = set()
+        first_updated, last_updated = len(self.file_items), -1
         for updated in items_to_update:
-            item, index = self.find_item(updated.file_key())
+            index = lookup.get(updated.file_key(), -1)
             if updated.status == EncoderStatus.REMOVE:
-                self.remove_rows([index])
-            elif item:
+                if index >= 0:
+                    removed.add(index)
+            elif index >= 0:
                 self.file_items[index] = updated
-                self.refresh_items(index, index)
-                self.createIndex(index, 0)
+                first_updated, last_updated = min(first_updated, index), max(last_updated, index)
             else:
                 self.set_items([updated])
+                lookup[updated.file_key()] = len(self.file_items) - 1
+        if last_updated >= 0:
+            self.refresh_items(first_updated, last_updated)
+        if len(removed) > 0:
+            self.remove_rows(removed)
 
     def get_items(self, index=None):
         if index is not None:
@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QComboBox, QDialog, QHeaderView, QLabel, QTableWidget, QTableWidgetItem, QVBoxLayout
+
+import TransCoda
+from common import CommonUtils
+from TransCoda.core import TransCodaHistory
+
+
+class HistoryReportView(QDialog):
+    _PERIODS = {
+        "Last 7 days": 7,
+        "Last 30 days": 30,
+        "Last 365 days": 365,
+        "All time": None
+    }
+    _ENCODER_COLUMNS = ["Encoder", "Encodes", "Failed", "Failure Rate", "Avg. Ratio", "Input Size", "Encoded Size",
+                        "Throughput"]
+    _FAILURE_COLUMNS = ["Ended", "Input File", "Encoder", "Message"]
+
+    def __init__(self):
+        super().__init__()
+        self.period_selector = QComboBox()
+        self.encoders = QTableWidget(0, len(self._ENCODER_COLUMNS))
+        self.failures = QTableWidget(0, len(self._FAILURE_COLUMNS))
+        self.init_ui()
+
+    def init_ui(self):
+        self.period_selector.addItems(self._PERIODS.keys())
+        self.period_selector.setCurrentText("Last 30 days")
+        self.period_selector.currentTextChanged.connect(self.refresh)
+        for table, columns in [(self.encoders, self._ENCODER_COLUMNS), (self.failures, self._FAILURE_COLUMNS)]:
+            table.setHorizontalHeaderLabels(columns)
+            table.setEditTriggers(QTableWidget.NoEditTriggers)
+            table.setSelectionBehavior(QTableWidget.SelectRows)
+            table.verticalHeader().setVisible(False)
+            table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+            table.horizontalHeader().setStretchLastSection(True)
+        layout = QVBoxLayout()
+        layout.setContentsMargins(2, 2, 2, 2)
+        layout.addWidget(self.period_selector)
+        layout.addWidget(self.encoders)
+        layout.addWidget(QLabel("Recent Failures"))
+        layout.addWidget(self.failures)
+        self.setLayout(layout)
+        self.setModal(False)
+        self.setMinimumSize(800, 450)
+        self.setWindowTitle(f"{TransCoda.__APP_NAME__} Encode History")
+        self.setWindowIcon(TransCoda.theme.ico_app_icon)
+
+    def showEvent(self, event):
+        self.refresh()
+        super().showEvent(event)
+
+    def refresh(self):
+        days = self._PERIODS[self.period_selector.currentText()]
+        since = None if days is None else datetime.now() - timedelta(days=days)
+        self._fill(self.encoders, [
+            [stats.encoder, stats.executions, stats.failures, self._percent(stats.failure_rate),
+             self._percent(stats.compression_ratio), CommonUtils.human_readable_filesize(stats.input_size),
+             CommonUtils.human_readable_filesize(stats.output_size),
+             f"{CommonUtils.human_readable_filesize(stats.throughput)}/s" if stats.throughput else ""]
+            for stats in TransCodaHistory.encoder_statistics(since=since)])
+        self._fill(self.failures, [
+            [str(failure.end_time), failure.input_file, failure.encoder_name or failure.encoder, failure.message]
+            for failure in TransCodaHistory.recent_failures(since=since)])
+
+    @staticmethod
+    def _percent(value):
+        return "" if value is None else f"{value:.2f}%"
+
+    @staticmethod
+    def _fill(table, rows):
+        table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            for column, value in enumerate(values):
+                item = QTableWidgetItem()
+                item.setData(Qt.DisplayRole, value)
+                table.setItem(row, column, item)
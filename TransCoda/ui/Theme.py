@@ -36,6 +36,7 @@ class Theme:
         self.ico_progress_done = self._get_icon("progress_done")
         self.ico_progress_unknown = self._get_icon("progress_unknown")
         self.ico_terminal = self._get_icon("utilities-terminal")
+        self.ico_report = self._get_icon("x-office-spreadsheet")
         self.ico_add = self._get_icon("list-add")
         self.ico_add_item = self._get_icon("list-add-item")
         self.ico_clear = self._get_icon("edit-clear")
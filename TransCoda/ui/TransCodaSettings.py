@@ -23,8 +23,13 @@ class SettingsKeys(Enum):
     max_threads = "max_threads"
     delete_metadata = "delete_metadata"
     single_thread_video = "single_thread_video"
+    segment_video = "segment_video"
+    segment_seconds = "segment_seconds"
+    adaptive_threads = "adaptive_threads"
     sort_by_size = "sort_by_size"
     skip_previously_processed = "skip_previously_processed"
+    reuse_encodes = "reuse_encodes"
+    encode_cache_size = "encode_cache_size"
     columns = "columns"
     sort_order = "sort_order"
     copy_extensions = "copy_extensions"
@@ -33,7 +38,8 @@ class SettingsKeys(Enum):
 
 settings = AppSettings(
     "TransCoda",
-    {}
+    {},
+    write_behind=True
 )
 
 
@@ -82,6 +88,17 @@ def is_history_enforced():
     return settings.get_setting(SettingsKeys.skip_previously_processed, Qt.Unchecked) == Qt.Checked
 
 
+def is_encode_cache_enabled():
+    return settings.get_setting(SettingsKeys.reuse_encodes, Qt.Unchecked) == Qt.Checked
+
+
+def get_encode_cache_size():
+    """
+    :return: the maximum size of the encode cache, in bytes
+    """
+    return int(settings.get_setting(SettingsKeys.encode_cache_size, 10)) * 1073741824
+
+
 def sort_by_size():
     return settings.get_setting(SettingsKeys.sort_by_size, Qt.Unchecked) == Qt.Checked
 
@@ -98,6 +115,21 @@ def is_single_thread_video():
     return settings.get_setting(SettingsKeys.single_thread_video, Qt.Unchecked) == Qt.Checked
 
 
+def is_segment_video():
+    return settings.get_setting(SettingsKeys.segment_video, Qt.Unchecked) == Qt.Checked
+
+
+def get_segment_seconds():
+    """
+    :return: the minimum length of a segment of a video encoded in segments, in seconds
+    """
+    return int(settings.get_setting(SettingsKeys.segment_seconds, 60))
+
+
+def is_adaptive_threads():
+    return settings.get_setting(SettingsKeys.adaptive_threads, Qt.Unchecked) == Qt.Checked
+
+
 def save_encode_list(items):
     items_pickle = pickle.dumps(items)
     settings.apply_setting(SettingsKeys.encode_list, items_pickle)
@@ -132,9 +164,15 @@ class TransCodaSettings(QDialog):
         self.preserve_times = QCheckBox("Preserve original file times in result")
         self.delete_metadata = QCheckBox("Delete all tag information in result")
         self.single_thread_video = QCheckBox("Process video in a single thread only")
+        self.segment_video = QCheckBox("When processing video in a single thread, split long videos at keyframes and "
+                                       "encode the parts at the same time")
+        self.segment_seconds = QSpinBox()
+        self.adaptive_threads = QCheckBox("Tune the number of files encoded at the same time to the system load")
         self.use_system_theme = QCheckBox("Use System theme for icons (requires restart)")
         self.history = QCheckBox("Skip files if they have been processed before")
         self.sort_by_size = QCheckBox("Encode the largest files first")
+        self.reuse_encodes = QCheckBox("Reuse the result of files with the same content encoded with the same encoder")
+        self.encode_cache_size = QSpinBox()
         self.encoder_editor = TransCodaEditor.TransCodaEditor(caption="Available Encoders")
         self.max_threads = QSpinBox()
         self.unsupported_extensions_to_copy = QLineEdit()
@@ -151,7 +189,12 @@ class TransCodaSettings(QDialog):
         self._set_checkbox(self.overwrite_files, SettingsKeys.overwrite_files, self.set_setting)
         self._set_checkbox(self.history, SettingsKeys.skip_previously_processed, self.set_setting)
         self._set_checkbox(self.sort_by_size, SettingsKeys.sort_by_size, self.set_setting)
+        self._set_checkbox(self.reuse_encodes, SettingsKeys.reuse_encodes, self.set_setting)
         self._set_checkbox(self.single_thread_video, SettingsKeys.single_thread_video, self.set_setting)
+        self._set_checkbox(self.segment_video, SettingsKeys.segment_video, self.set_setting)
+        self.segment_video.setEnabled(self.single_thread_video.isChecked())
+        self.single_thread_video.stateChanged.connect(lambda state: self.segment_video.setEnabled(state == Qt.Checked))
+        self._set_checkbox(self.adaptive_threads, SettingsKeys.adaptive_threads, self.set_setting)
         self._set_checkbox(self.use_system_theme, SettingsKeys.use_system_theme, self.set_setting)
 
         self.encoder_editor.select_encoder(settings.get_setting(SettingsKeys.encoder_path, "NA"))
@@ -162,6 +205,18 @@ class TransCodaSettings(QDialog):
         self.max_threads.setValue(settings.get_setting(SettingsKeys.max_threads, self.max_threads.maximum()))
         self.max_threads.valueChanged.connect(partial(self.set_setting, SettingsKeys.max_threads))
 
+        self.encode_cache_size.setMinimum(1)
+        self.encode_cache_size.setMaximum(10240)
+        self.encode_cache_size.setSuffix(" GiB")
+        self.encode_cache_size.setValue(get_encode_cache_size() // 1073741824)
+        self.encode_cache_size.valueChanged.connect(partial(self.set_setting, SettingsKeys.encode_cache_size))
+
+        self.segment_seconds.setMinimum(10)
+        self.segment_seconds.setMaximum(3600)
+        self.segment_seconds.setSuffix(" s")
+        self.segment_seconds.setValue(get_segment_seconds())
+        self.segment_seconds.valueChanged.connect(partial(self.set_setting, SettingsKeys.segment_seconds))
+
         self.unsupported_extensions_to_copy.setText(get_copy_extensions())
         self.unsupported_extensions_to_copy.editingFinished.connect(partial(self.set_setting,
                                                                             SettingsKeys.copy_extensions))
@@ -185,7 +240,18 @@ class TransCodaSettings(QDialog):
         h_layout.addWidget(QLabel("Number of files to encode at the same time"))
         h_layout.addWidget(self.max_threads)
         layout.addLayout(h_layout)
+        layout.addWidget(self.adaptive_threads)
         layout.addWidget(self.single_thread_video)
+        layout.addWidget(self.segment_video)
+        h_layout = QHBoxLayout()
+        h_layout.addWidget(QLabel("Minimum length of a part of a video"))
+        h_layout.addWidget(self.segment_seconds)
+        layout.addLayout(h_layout)
+        layout.addWidget(self.reuse_encodes)
+        h_layout = QHBoxLayout()
+        h_layout.addWidget(QLabel("Space to keep encoded files in for reuse (requires restart)"))
+        h_layout.addWidget(self.encode_cache_size)
+        layout.addLayout(h_layout)
 
         layout.addWidget(QHLine())
         layout.addWidget(QLabel("<u>Unsupported files</u>"))
@@ -0,0 +1,115 @@
+import os
+import sqlite3
+import threading
+import time
+
+from common import CommonUtils
+
+# Reads record when a checksum was last used, these updates are written with the next write, or once this many
+# have been collected, so that reads do not hold the write lock of a cache shared by many processes
+_TOUCH_BATCH_SIZE = 1000
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+class ChecksumCache:
+    """
+    A persistent cache of file checksums. A checksum is reused as long as the size, modification time and inode of the
+    file have not changed since it was calculated. When the cache grows beyond max_entries, the least recently used
+    checksums are evicted.
+    The cache can be shared between threads, and between processes, the database is in WAL mode
+    """
+    def __init__(self, cache_file=None, max_entries=1000000):
+        if cache_file is None:
+            cache_file = os.path.join(CommonUtils.get_app_data_dir("common"), "checksums.sqlite")
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._touched = {}
+        self._db = sqlite3.connect(cache_file, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS checksums(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                         "inode INTEGER, digest TEXT, last_used REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON checksums(last_used)")
+        self._db.commit()
+        self._entries = self._db.execute("SELECT COUNT(*) FROM checksums").fetchone()[0]
+
+    def get(self, file, stats=None):
+        """
+        Find the cached checksum of a file
+        :param file: the file
+        :param stats: the os.stat of the file, if already known
+        :return: the checksum, or None if the file is not cached or has changed since it was cached
+        """
+        stats = os.stat(file) if stats is None else stats
+        with self._lock:
+            record = self._db.execute("SELECT digest FROM checksums WHERE path=? AND size=? AND mtime_ns=? AND inode=?",
+                                      [file, stats.st_size, stats.st_mtime_ns, stats.st_ino]).fetchone()
+            if record is None:
+                return None
+            self._touched[file] = time.time()
+            if len(self._touched) >= _TOUCH_BATCH_SIZE:
+                self._write_touched()
+                self._db.commit()
+            return record[0]
+
+    def put(self, file, digest, stats=None):
+        """
+        Save the checksum of a file
+        :param file: the file
+        :param digest: the checksum
+        :param stats: the os.stat of the file when the checksum was calculated
+        """
+        stats = os.stat(file) if stats is None else stats
+        with self._lock:
+            self._write_touched()
+            exists = self._db.execute("SELECT 1 FROM checksums WHERE path=?", [file]).fetchone() is not None
+            self._db.execute("INSERT OR REPLACE INTO checksums VALUES(?, ?, ?, ?, ?, ?)",
+                             [file, stats.st_size, stats.st_mtime_ns, stats.st_ino, digest, time.time()])
+            if not exists:
+                self._entries += 1
+            if self._entries > self.max_entries:
+                # Other processes add to the cache too, the count is only an estimate until it is read again
+                self._entries = self._db.execute("SELECT COUNT(*) FROM checksums").fetchone()[0]
+                if self._entries > self.max_entries:
+                    self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        # Evict a tenth of the cache at a time so that eviction does not run on every insert once the cache is full
+        keep = max(int(self.max_entries * 0.9), 1)
+        self._db.execute("DELETE FROM checksums WHERE path IN "
+                         "(SELECT path FROM checksums ORDER BY last_used ASC LIMIT ?)", [self._entries - keep])
+        self._entries = keep
+
+    def _write_touched(self):
+        if len(self._touched) > 0:
+            self._db.executemany("UPDATE checksums SET last_used=? WHERE path=?",
+                                 [(last_used, path) for path, last_used in self._touched.items()])
+            self._touched.clear()
+
+    def __len__(self):
+        return self._entries
+
+    def commit(self):
+        with self._lock:
+            self._write_touched()
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._write_touched()
+            self._db.commit()
+            self._db.close()
+
+
+def get_default_cache():
+    """
+    :return: the checksum cache shared by all applications
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ChecksumCache()
+        return _default_cache
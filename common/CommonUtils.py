@@ -1,23 +1,67 @@
 import datetime
 import hashlib
+import heapq
+import itertools
 import logging
 import mimetypes
+import multiprocessing
 import os
+import queue
 import subprocess
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from enum import Enum
 from functools import partial
 from os import path
 
-from PyQt5.QtCore import QObject, pyqtSignal, QSettings, QThread, QThreadPool, QRunnable, QTimer, QCoreApplication
+import psutil
+from PyQt5.QtCore import QObject, pyqtSignal, QSettings, QThread, QThreadPool, QRunnable, QTimer, QCoreApplication, \
+    QStandardPaths, Qt
 from PyQt5.QtWidgets import QCheckBox, QRadioButton, QGroupBox, QWidget, QSplitter, QAction
 
 from common.CustomUI import FileChooserTextBox
+from common.ResultSpool import JobSummary
+from common.Tracing import Tracer, now_ns
 
+_HASH_BLOCK_SIZE = 1048576  # (1MB) The size of each read from the file
+_hash_buffers = threading.local()
+_FINGERPRINT_SAMPLE_SIZE = 65536  # (64KB) The size of each sample in a quick fingerprint
 
-def batch(iterable, batch_size=10):
-    iterable = list(iterable)
-    total_size = len(iterable)
-    for index in range(0, total_size, batch_size):
-        yield iterable[index:min(index + batch_size, total_size)]
+
+def batch(iterable, batch_size=10, max_batch_size=None, size_of=None):
+    """
+    Splits any iterable, including generators, into lists. The iterable is read lazily, only the batch being built
+    is held in memory
+    :param iterable: the items to split
+    :param batch_size: the maximum number of items in a batch, None for no limit
+    :param max_batch_size: the maximum total size of the items in a batch, as measured by size_of. A batch always
+    holds at least one item, even if that item alone is larger
+    :param size_of: a function that returns the size of an item, such as its size in bytes. Required with
+    max_batch_size
+    :raises ValueError: if max_batch_size is set without size_of
+    """
+    # Checked here rather than in the generator, which would only raise once the first batch is requested
+    if max_batch_size is not None and size_of is None:
+        raise ValueError("max_batch_size requires size_of")
+    return _batch(iterable, batch_size, max_batch_size, size_of)
+
+
+def _batch(iterable, batch_size, max_batch_size, size_of):
+    current = []
+    current_size = 0
+    for item in iterable:
+        item_size = size_of(item) if max_batch_size is not None else 0
+        if len(current) > 0 and ((batch_size is not None and len(current) >= batch_size) or
+                                 (max_batch_size is not None and current_size + item_size > max_batch_size)):
+            yield current
+            current = []
+            current_size = 0
+        current.append(item)
+        current_size += item_size
+    if len(current) > 0:
+        yield current
 
 
 def get_logger(app_name):
@@ -32,14 +76,145 @@ def get_logger(app_name):
     return log
 
 
-def calculate_sha256_hash(file):
-    block_size = 1048576  # (1MB) The size of each read from the file
+def get_app_data_dir(app_name):
+    """
+    Finds the directory where an application can store its data files, creating it if required
+    :param app_name: the application name
+    :return: the path of the data directory
+    """
+    data_dir = path.join(QStandardPaths.writableLocation(QStandardPaths.GenericDataLocation), "github.com/ag-sd",
+                         app_name)
+    os.makedirs(data_dir, exist_ok=True)
+    return data_dir
+
+
+def list_directory(directory):
+    """
+    Lists a single directory. Like os.walk, symbolic links to directories are not included as they are not followed
+    :param directory: the directory to list
+    :return: List of (name, is_dir) tuples. Unreadable directories are returned as empty
+    """
+    entries = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir and entry.is_symlink():
+                    continue
+                entries.append((entry.name, is_dir))
+    except OSError:
+        pass
+    return entries
+
+
+def calculate_sha256_hash(file, cache=None):
+    """
+    Calculates the SHA256 checksum of a file
+    :param file: the file to hash
+    :param cache: Optional, a ChecksumCache. If the file has not changed since it was cached, it will not be read again
+    :return: the hex digest of the file
+    """
+    if cache is None:
+        return _sha256_file(file)
+    stats = os.stat(file)
+    digest = cache.get(file, stats)
+    if digest is None:
+        digest = _sha256_file(file)
+        cache.put(file, digest, stats)
+    return digest
+
+
+def calculate_sha256_hashes(files, cache=None, max_workers=None, use_processes=False):
+    """
+    Calculates the SHA256 checksums of several files in parallel
+    :param files: the files to hash
+    :param cache: Optional, a ChecksumCache. Files that have not changed since they were cached will not be read again
+    :param max_workers: the number of files to hash at the same time
+    :param use_processes: hash in a process pool rather than a thread pool. Useful for very large files
+    :return: a dictionary of file to hex digest
+    """
+    digests = {}
+    stats = {}
+    for file in files:
+        if cache is not None:
+            stats[file] = os.stat(file)
+            digest = cache.get(file, stats[file])
+            if digest is not None:
+                digests[file] = digest
+                continue
+        digests[file] = None
+
+    pending = [file for file, digest in digests.items() if digest is None]
+    if len(pending) > 0:
+        executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with executor(max_workers=max_workers) as pool:
+            for file, digest in zip(pending, pool.map(_sha256_file, pending), strict=True):
+                digests[file] = digest
+                if cache is not None:
+                    cache.put(file, digest, stats[file])
+    return digests
+
+
+def calculate_quick_fingerprint(file, sample_size=_FINGERPRINT_SAMPLE_SIZE):
+    """
+    Calculates a fingerprint of a file from its size and a sample of its head, middle and tail. Files with different
+    fingerprints are certainly different, files with the same fingerprint are very likely, but not certainly, identical
+    :param file: the file to fingerprint
+    :param sample_size: the number of bytes sampled from each of the head, middle and tail of the file
+    :return: the fingerprint
+    """
+    size = os.path.getsize(file)
     file_hash = hashlib.sha256()
     with open(file, 'rb') as f:
-        file_bytes = f.read(block_size)
-        while len(file_bytes) > 0:
-            file_hash.update(file_bytes)
-            file_bytes = f.read(block_size)
+        if size <= 3 * sample_size:
+            file_hash.update(f.read())
+        else:
+            for offset in (0, (size - sample_size) // 2, size - sample_size):
+                f.seek(offset)
+                file_hash.update(f.read(sample_size))
+    return f"{size}:{file_hash.hexdigest()}"
+
+
+def find_identical_files(files, cache=None, sample_size=_FINGERPRINT_SAMPLE_SIZE):
+    """
+    Finds files with identical content. Files are grouped by size first, then by their quick fingerprint, and only
+    the files that still collide are compared by their full SHA256 hash
+    :param files: the files to compare
+    :param cache: Optional, a ChecksumCache used for the full hashes
+    :param sample_size: the sample size of the quick fingerprint
+    :return: a list of groups of identical files. Files with unique content are not included
+    """
+    def group_by(_files, key_function):
+        groups = defaultdict(list)
+        for _file in _files:
+            groups[key_function(_file)].append(_file)
+        return [group for group in groups.values() if len(group) > 1]
+
+    identical = []
+    for size_group in group_by(set(files), os.path.getsize):
+        for fingerprint_group in group_by(size_group, partial(calculate_quick_fingerprint, sample_size=sample_size)):
+            if os.path.getsize(fingerprint_group[0]) <= 3 * sample_size:
+                # The fingerprint already covers the whole file
+                identical.append(fingerprint_group)
+            else:
+                identical.extend(group_by(fingerprint_group, partial(calculate_sha256_hash, cache=cache)))
+    return identical
+
+
+def _sha256_file(file):
+    # The read buffer is reused across calls so that hashing does not allocate a new block for every read
+    if not hasattr(_hash_buffers, "buffer"):
+        _hash_buffers.buffer = bytearray(_HASH_BLOCK_SIZE)
+    view = memoryview(_hash_buffers.buffer)
+    file_hash = hashlib.sha256()
+    with open(file, 'rb', buffering=0) as f:
+        size = f.readinto(view)
+        while size:
+            file_hash.update(view[:size])
+            size = f.readinto(view)
     return file_hash.hexdigest()
 
 
@@ -147,15 +322,24 @@ class AppSettings(QObject):
     In order to save a UI, prefix each of its child widgets names with stateful_
     NOTE: The UI needs to have a object name if you are dealing with multiple saved UI's
     Currently supported stateful widgets are QCheckBox, QRadioButton, QGroupBox, FileChooser
+    In write behind mode, changed settings are written at most once every flush_interval milliseconds and when the
+    application quits, rather than on every change. Events are still fired as soon as a setting changes
     """
     settings_change_event = pyqtSignal(object, object)
 
-    def __init__(self, app_name, default_settings):
+    def __init__(self, app_name, default_settings, write_behind=False, flush_interval=1000):
         super().__init__()
         self._app_settings = QSettings("github.com/ag-sd", app_name)
         self._config = self._app_settings.value("app_settings")
         if self._config is None:
             self._config = default_settings
+        self.write_behind = write_behind
+        self._dirty = False
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.setInterval(flush_interval)
+        self._flush_timer.timeout.connect(self.flush)
+        self._quit_connected = False
 
     def apply_setting(self, key, value):
         """
@@ -165,9 +349,33 @@ class AppSettings(QObject):
         :return:
         """
         self._config[key] = value
-        self._app_settings.setValue("app_settings", self._config)
+        # Without an application there is no event loop to run the flush timer, so the setting is written now
+        if self.write_behind and QCoreApplication.instance() is not None:
+            self._dirty = True
+            self._schedule_flush()
+        else:
+            self._app_settings.setValue("app_settings", self._config)
         self.settings_change_event.emit(key, value)
 
+    def flush(self):
+        """
+        Writes the settings changed since the last write
+        """
+        self._flush_timer.stop()
+        if self._dirty:
+            self._dirty = False
+            self._app_settings.setValue("app_settings", self._config)
+            self._app_settings.sync()
+
+    def _schedule_flush(self):
+        # Settings are usually created on import, before the application exists
+        if not self._quit_connected:
+            QCoreApplication.instance().aboutToQuit.connect(self.flush)
+            self._quit_connected = True
+        # The timer is not restarted by later changes, so a long burst of changes is still written every interval
+        if not self._flush_timer.isActive():
+            self._flush_timer.start()
+
     def save_ui(self, ui, logger=None, ignore_children=False):
         """
         https://stackoverflow.com/questions/23279125/python-pyqt4-functions-to-save-and-restore-ui-widget-values
@@ -251,46 +459,56 @@ class FileScanner:
     """
     A class to scan a collection of Qfile file URL's which may represent files or directories
     and create a list of files in this collection
+    In streaming mode, the directories are not walked in the constructor. Instead, call scan_batches to walk the
+    directories concurrently and receive the files in batches as they are found
+    If a ScanIndex is provided, directories that have not changed since the last scan are not listed again and the
+    supported files added or removed since the last scan are collected in added_files and removed_files
     """
-    def __init__(self, file_urls, recurse=False, supported_extensions=None, is_qfiles=True, partial_mimetypes_list=None):
+    def __init__(self, file_urls, recurse=False, supported_extensions=None, is_qfiles=True, partial_mimetypes_list=None,
+                 streaming=False, index=None):
         super().__init__()
         self.supported_extensions = self._get_extensions(supported_extensions, partial_mimetypes_list)
         self.recurse = recurse
+        self.index = index
+        self.added_files = set()
+        self.removed_files = set()
+        self._cancelled = False
         if is_qfiles:
-            self.files, self.rejected_files = self._scan_q_files(file_urls, recurse)
+            self._dirs, self._files = self._scan_q_files(file_urls)
+        else:
+            self._dirs, self._files = self._scan_p_files(file_urls)
+        if streaming:
+            self.files, self.rejected_files = set(), set()
         else:
-            self.files, self.rejected_files = self._scan_p_files(file_urls, recurse)
+            self.files, self.rejected_files = self._walk(list(self._dirs), list(self._files), [], recurse)
 
-    def _scan_p_files(self, file_urls, recurse):
+    def _scan_p_files(self, file_urls):
         """
             Routine for finding all files in a directory
             :param file_urls: the **PYTHON STRING** paths to find files in
-            :param recurse: Recurse into subdirectories
-            :return: List of files found in the path sorted in descending order of file size
+            :return: Tuple of directories to walk and supported files found in the paths
         """
-        return self._scan_files(file_urls, recurse, None)
+        return self._scan_files(file_urls, None)
 
-    def _scan_q_files(self, file_urls, recurse):
+    def _scan_q_files(self, file_urls):
         """
             Routine for finding all files in a directory
             :param file_urls: the **PyQT5 QFile** paths to find files in
-            :param recurse: Recurse into subdirectories
-            :return: List of files found in the path sorted in descending order of file size
+            :return: Tuple of directories to walk and supported files found in the paths
         """
         def qfile_to_file(qfile):
             if qfile.isLocalFile():
                 return qfile.toLocalFile()
             else:
                 return None
-        return self._scan_files(file_urls, recurse, qfile_to_file)
+        return self._scan_files(file_urls, qfile_to_file)
 
-    def _scan_files(self, file_urls, recurse, normalizing_function=None):
+    def _scan_files(self, file_urls, normalizing_function=None):
         """
             Routine for finding all files in a directory
             :param file_urls: the paths to find files in
-            :param recurse: Recurse into subdirectories
             :param normalizing_function used to convert the file_url from any non standard format to a string
-            :return: List of files found in the path sorted in descending order of file size
+            :return: Tuple of directories to walk and supported files found in the paths
         """
         rejected_files = []
         dirs = []
@@ -308,21 +526,89 @@ class FileScanner:
                 files.append(normalized_file)           # Process it if a supported file
             else:
                 rejected_files.append(normalized_file)  # Reject it if not a dir or supported file
-        return self._walk(dirs, files, [], recurse)
+        return dirs, files
 
     def _walk(self, dirs, files, rejects, recurse):
         while len(dirs) > 0:
             _dir = dirs.pop()
-            for dirName, _, fileList in os.walk(_dir, topdown=True):
-                for file in fileList:
-                    if self.is_supported(file):
-                        files.append(os.path.join(dirName, file))
-                    else:
-                        rejects.append(os.path.join(dirName, file))
-                if not recurse:
-                    break
+            dir_files, dir_rejects, sub_dirs = self._scan_directory(_dir)
+            files.extend(dir_files)
+            rejects.extend(dir_rejects)
+            if recurse:
+                dirs.extend(sub_dirs)
+        if self.index is not None:
+            self.index.commit()
         return set(files), set(rejects)
 
+    def _scan_directory(self, directory):
+        """
+        Lists a single directory, using the scan index if one is set
+        :param directory: the directory to list
+        :return: Tuple of supported files, rejected files and sub directories that can be walked
+        """
+        if self.index is None:
+            entries = list_directory(directory)
+        else:
+            entries, added, removed = self.index.list_directory(directory)
+            self.added_files.update(file for file in added if self.is_supported(file))
+            self.removed_files.update(file for file in removed if self.is_supported(file))
+        files = []
+        rejects = []
+        sub_dirs = []
+        for name, is_dir in entries:
+            if is_dir:
+                sub_dirs.append(path.join(directory, name))
+            elif self.is_supported(name):
+                files.append(path.join(directory, name))
+            else:
+                rejects.append(path.join(directory, name))
+        return files, rejects, sub_dirs
+
+    def scan_batches(self, batch_size=500, max_workers=None):
+        """
+        Walks the directories concurrently and yields the supported files in batches as they are found.
+        The files found are also accumulated in self.files and self.rejected_files
+        :param batch_size: the maximum number of files in each batch
+        :param max_workers: the number of directories that can be listed at the same time
+        :return: a generator of lists of files. Nothing is yielded if the scanner was cancelled before the scan started
+        """
+        if self._cancelled:
+            return
+        pending = [file for file in self._files if file not in self.files]
+        self.files.update(pending)
+        pool = ThreadPoolExecutor(max_workers=max_workers or min(32, (os.cpu_count() or 1) + 4))
+        try:
+            futures = {pool.submit(self._scan_directory, _dir) for _dir in self._dirs}
+            while len(futures) > 0 and not self._cancelled:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dir_files, dir_rejects, sub_dirs = future.result()
+                    if self.recurse and not self._cancelled:
+                        futures.update(pool.submit(self._scan_directory, _dir) for _dir in sub_dirs)
+                    self.rejected_files.update(dir_rejects)
+                    for file in dir_files:
+                        if file not in self.files:
+                            self.files.add(file)
+                            pending.append(file)
+                while len(pending) >= batch_size and not self._cancelled:
+                    yield pending[:batch_size]
+                    del pending[:batch_size]
+            if len(pending) > 0 and not self._cancelled:
+                yield pending
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+            if self.index is not None:
+                self.index.commit()
+
+    def cancel(self):
+        """
+        Stops a scan started with scan_batches. No further batches will be yielded
+        """
+        self._cancelled = True
+
+    def is_cancelled(self):
+        return self._cancelled
+
     def is_supported(self, file):
         if self.supported_extensions is not None:
             _, ext = os.path.splitext(file)
@@ -349,6 +635,70 @@ class FileScanner:
         return extensions
 
 
+class SignalCoalescer(QObject):
+    """
+    Collects updates posted from any thread and delivers them to the thread that owns the coalescer, usually the UI
+    thread, at a fixed rate. Updates with the same key are merged, only the latest one is delivered.
+    Connect worker signals to post with Qt.DirectConnection so that updates are merged before they reach the UI
+    event queue
+    """
+    flush_event = pyqtSignal('PyQt_PyObject')
+
+    def __init__(self, key_function=None, rate_hz=20, parent=None):
+        super().__init__(parent)
+        self.key_function = key_function if key_function is not None else id
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._timer = QTimer(self)
+        self._timer.setInterval(int(1000 / rate_hz))
+        self._timer.timeout.connect(self.flush)
+        self._timer.start()
+
+    def post(self, value):
+        key = self.key_function(value)
+        with self._lock:
+            self._pending[key] = value
+
+    def post_all(self, values):
+        for value in values:
+            self.post(value)
+
+    def flush(self):
+        """
+        Delivers the pending updates now, in the order their keys were first posted
+        """
+        with self._lock:
+            values = list(self._pending.values())
+            self._pending.clear()
+        if len(values) > 0:
+            self.flush_event.emit(values)
+
+    def stop(self):
+        self._timer.stop()
+        self.flush()
+
+
+class FileScanWorker(QThread):
+    """
+    Runs a streaming FileScanner on a background thread and emits the files in batches as they are found
+    """
+    files_found_event = pyqtSignal('PyQt_PyObject')
+    finish_event = pyqtSignal('PyQt_PyObject')
+
+    def __init__(self, scanner, batch_size=500):
+        super().__init__()
+        self.scanner = scanner
+        self.batch_size = batch_size
+
+    def run(self):
+        for files in self.scanner.scan_batches(batch_size=self.batch_size):
+            self.files_found_event.emit(files)
+        self.finish_event.emit(self.scanner)
+
+    def stop_scan(self):
+        self.scanner.cancel()
+
+
 class ProcessRunnerException(Exception):
     def __init__(self, cmd, exit_code, stdout, stderr):
         self.cmd = cmd
@@ -372,10 +722,16 @@ class Command(QRunnable):
         super().__init__()
         self.signals = CommandSignals()
         self.time_taken_seconds = None
+        self.priority = 0
+        self.timeout = None
+        self.tracer = Tracer(type(self).__name__)
+        self.queued_ns = None
+        self._cancelled = False
 
     def run(self):
         start_time = datetime.datetime.now()
-        self.do_work()
+        with self.tracer.span("run"):
+            self.do_work()
         end_time = datetime.datetime.now()
         self.time_taken_seconds = (end_time - start_time).total_seconds()
         self.signals.__complete__.emit(self.time_taken_seconds)
@@ -386,76 +742,375 @@ class Command(QRunnable):
     def work_size(self):
         pass
 
+    def process_work(self):
+        """
+        Commands that can run in a separate process return their work as a picklable (function, args) tuple.
+        The function is run in a ProcessPoolBackend and its return value is passed to process_result.
+        :return: the (function, args) tuple, or None if the command can only run on a thread
+        """
+        return None
+
+    def process_result(self, result):
+        """
+        Receives the return value of the process_work function, in the parent process
+        :param result: the value returned by the function
+        """
+        self.signals.result.emit(result)
+
+    def cancel(self):
+        """
+        Requests the command to stop. Long running commands should check is_cancelled and return early
+        """
+        self._cancelled = True
+
+    def is_cancelled(self):
+        return self._cancelled
+
+
+class SchedulingPolicy(Enum):
+    """
+    The order in which a CommandExecutionFactory dispatches its pending commands
+    FIFO            : In the order the commands were added
+    PRIORITY        : Highest Command.priority first, in the order they were added for equal priorities
+    LARGEST_FIRST   : Largest Command.work_size first
+    """
+    FIFO = 1
+    PRIORITY = 2
+    LARGEST_FIRST = 3
+
+    def sort_key(self, command):
+        if self == SchedulingPolicy.PRIORITY:
+            return -command.priority
+        elif self == SchedulingPolicy.LARGEST_FIRST:
+            return -(command.work_size() or 0)
+        return 0
+
+
+class _ScheduledCommand(QRunnable):
+    """
+    Runs a command on the thread pool and reports its completion to the factory directly from the worker thread
+    """
+    def __init__(self, factory, command):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.factory = factory
+        self.command = command
+
+    def run(self):
+        try:
+            self.command.run()
+        except Exception as exception:
+            self.factory.tracer.count("failed")
+            self.factory.log(f"{self.command} failed: {exception}")
+        finally:
+            self.factory.command_complete(self.command)
+
+
+class ThreadPoolBackend:
+    """
+    The default CommandExecutionFactory backend. Runs commands on a QThreadPool
+    """
+    def __init__(self):
+        self.thread_pool = QThreadPool()
+
+    def max_workers(self):
+        return self.thread_pool.maxThreadCount()
+
+    def start(self, factory, command):
+        runnable = _ScheduledCommand(factory, command)
+        self.thread_pool.start(runnable)
+        return runnable
+
+    def shutdown(self):
+        pass
+
+
+class ProcessPoolBackend:
+    """
+    A CommandExecutionFactory backend that runs commands in a pool of processes, so that pure python work is not
+    serialized by the GIL. Only the work returned by Command.process_work runs in the child process, its result is
+    passed back to Command.process_result, which emits the usual signals. Commands that do not provide process work
+    are run on a thread pool.
+    """
+    def __init__(self, max_workers=None):
+        self._max_workers = max_workers or os.cpu_count() or 1
+        self._pool = None
+        self._threads = ThreadPoolBackend()
+
+    def max_workers(self):
+        return self._max_workers
+
+    def start(self, factory, command):
+        work = command.process_work()
+        if work is None:
+            return self._threads.start(factory, command)
+        if self._pool is None:
+            # Forking a process that runs Qt threads is not safe, so the children are spawned
+            self._pool = ProcessPoolExecutor(max_workers=self._max_workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        function, args = work
+        start_time = datetime.datetime.now()
+        future = self._pool.submit(function, *args)
+        future.add_done_callback(partial(self._process_complete, factory, command, start_time, now_ns()))
+        return future
+
+    @staticmethod
+    def _process_complete(factory, command, start_time, start_ns, future):
+        try:
+            if not future.cancelled():
+                command.tracer.add_span("process", start_ns, now_ns())
+                command.process_result(future.result())
+        except Exception as exception:
+            factory.tracer.count("failed")
+            factory.log(f"{command} failed: {exception}")
+        finally:
+            command.time_taken_seconds = (datetime.datetime.now() - start_time).total_seconds()
+            command.signals.__complete__.emit(command.time_taken_seconds)
+            factory.command_complete(command)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+
+class ConcurrencyController:
+    """
+    Tunes the number of commands a CommandExecutionFactory runs at the same time from the system load.
+    At every interval, the CPU usage, I/O wait and the throughput of completed commands since the last sample are
+    compared. The limit shrinks when the system is waiting on I/O, is reverted if the previous change lowered the
+    throughput and grows while the CPU has headroom. The limit is always between min_threads and max_threads
+    """
+    def __init__(self, min_threads=1, max_threads=None, interval=2.0, cpu_high=90.0, iowait_high=25.0):
+        self.min_threads = max(min_threads, 1)
+        self.max_threads = max(max_threads or os.cpu_count() or 1, self.min_threads)
+        self.interval = interval
+        self.cpu_high = cpu_high
+        self.iowait_high = iowait_high
+        self.limit = max(self.min_threads, self.max_threads // 2)
+        self.reason = "Starting"
+        self._last_sample_time = None
+        self._last_completed = 0
+        self._last_throughput = None
+        self._last_change = 0
+
+    def sample(self, completed, now=None):
+        """
+        Samples the system load and adjusts the limit if required
+        :param completed: the total number of commands completed so far
+        :param now: the monotonic time of the sample
+        :return: True if the limit changed
+        """
+        now = time.monotonic() if now is None else now
+        if self._last_sample_time is None:
+            # Establish the baseline, psutil measures CPU usage since its previous call
+            psutil.cpu_times_percent()
+            self._last_sample_time = now
+            self._last_completed = completed
+            return False
+        elapsed = now - self._last_sample_time
+        if elapsed < self.interval:
+            return False
+
+        cpu_times = psutil.cpu_times_percent()
+        iowait = getattr(cpu_times, "iowait", 0.0)
+        cpu_busy = 100.0 - cpu_times.idle - iowait
+        throughput = (completed - self._last_completed) / elapsed
+        throughput_dropped = self._last_throughput is not None and throughput < self._last_throughput * 0.9
+
+        if iowait > self.iowait_high:
+            change, reason = -1, f"I/O bound, {iowait:.0f}% I/O wait"
+        elif throughput_dropped and self._last_change != 0:
+            change, reason = -self._last_change, f"Reverting, throughput fell to {throughput:.2f}/s"
+        elif cpu_busy > self.cpu_high:
+            change, reason = 0, f"CPU saturated at {cpu_busy:.0f}%"
+        else:
+            change, reason = 1, f"CPU has headroom at {cpu_busy:.0f}%"
+
+        limit = min(max(self.limit + change, self.min_threads), self.max_threads)
+        self._last_change = limit - self.limit
+        self._last_sample_time = now
+        self._last_completed = completed
+        self._last_throughput = throughput
+        self.reason = reason
+        if limit == self.limit:
+            return False
+        self.limit = limit
+        return True
+
 
 class CommandExecutionFactory(QThread):
+    """
+    Runs commands on a thread pool. The factory thread dispatches pending commands in the order of the scheduling
+    policy as soon as a thread becomes available and emits finish_event when all the commands are complete.
+    If max_pending is set, add_task blocks while that many commands are pending.
+    If job_timeout (or Command.timeout) is set, commands running for longer are asked to cancel.
+    Stopping the factory drops all pending commands immediately; running commands are allowed to finish.
+    Commands run on a ThreadPoolBackend unless another backend, such as a ProcessPoolBackend, is provided.
+    If a ConcurrencyController is provided, it sets the number of commands running at the same time and every change
+    is reported with concurrency_event.
+    The tracer collects the spans of every command run, including the time it waited in the queue, and counters of
+    the completed, failed, timed out and dropped commands
+    If a ResultSpool is provided, the results of every command are appended to it as they are emitted, and only a
+    JobSummary of the completed commands is kept, rather than the time taken by each command. The summary is emitted
+    with finish_event and the results can be read back from the spool
+    """
     finish_event = pyqtSignal('PyQt_PyObject', int)
     result_event = pyqtSignal('PyQt_PyObject')
+    concurrency_event = pyqtSignal(int, str)
 
-    def __init__(self, runnable_commands, logger=None, max_threads=None):
+    def __init__(self, runnable_commands, logger=None, max_threads=None, policy=SchedulingPolicy.FIFO,
+                 max_pending=None, job_timeout=None, backend=None, controller=None, spool=None):
         super().__init__()
-        self.pending_jobs = runnable_commands
-        self.total_jobs = len(self.pending_jobs)
-        self.completed = []
-        self.thread_pool = QThreadPool()
+        self.backend = ThreadPoolBackend() if backend is None else backend
+        self.spool = spool
+        self.controller = controller
+        self.tracer = Tracer(type(self).__name__)
+        self.policy = policy
+        self.max_pending = max_pending
+        self.job_timeout = job_timeout
+        self.total_jobs = 0
+        self.completed = [] if spool is None else JobSummary()
+        self.timed_out = []
         self.stop = False
         self.logger = logger
+        self._condition = threading.Condition()
+        self._pending = []
+        self._sequence = itertools.count()
+        self._active = {}
+        self._dispatching = False
+        self._finished = False
         if max_threads:
-            self.max_threads = min(max_threads, self.thread_pool.maxThreadCount())
+            self.max_threads = min(max_threads, self.backend.max_workers())
         else:
-            self.max_threads = self.thread_pool.maxThreadCount()
+            self.max_threads = self.backend.max_workers()
+        if self.controller is not None:
+            self.controller.max_threads = min(self.controller.max_threads, self.backend.max_workers())
+            self.controller.limit = min(self.controller.limit, self.controller.max_threads)
+            self.max_threads = self.controller.limit
+        for command in runnable_commands:
+            self._enqueue(command)
 
         self.log(f"Multi-threading with maximum of {self.max_threads} threads")
 
-    def add_task(self, task):
-        self.pending_jobs.append(task)
+    def add_task(self, task, timeout=None):
+        """
+        Adds a command to the pending queue. If the factory had already finished, it is started again
+        :param task: the command to add
+        :param timeout: the seconds to wait for space in a bounded queue. None waits for ever
+        :raises queue.Full: if the queue is still full after the timeout
+        """
+        with self._condition:
+            if self.stop:
+                self.log(f"Stop has been received. {task} will not be run")
+                return
+            if self.max_pending is not None and not self._condition.wait_for(
+                    lambda: len(self._pending) < self.max_pending or self.stop, timeout):
+                raise queue.Full
+            self._enqueue(task)
+            restart = self._finished
+            self._finished = False
+            self._condition.notify_all()
+        if restart:
+            self.wait()
+            self.start()
+
+    def _enqueue(self, command):
+        if self.spool is not None:
+            # Results are emitted on the worker threads, spool them there rather than queueing them to this thread
+            command.signals.result.connect(self.spool.append, Qt.DirectConnection)
+        command.queued_ns = now_ns()
+        heapq.heappush(self._pending, (self.policy.sort_key(command), next(self._sequence), command))
         self.total_jobs += 1
-        self.run()
 
     def get_max_threads(self):
         return self.max_threads
 
     def get_active_thread_count(self):
-        return self.thread_pool.activeThreadCount()
+        with self._condition:
+            return len(self._active)
+
+    def get_pending_count(self):
+        with self._condition:
+            return len(self._pending)
 
     def stop_scan(self):
-        self.stop = True
+        with self._condition:
+            self.stop = True
+            dropped = len(self._pending)
+            self._pending.clear()
+            self._condition.notify_all()
+        self.tracer.count("dropped", dropped)
+        self.log(f"Stop has been received. Dropped {dropped} pending jobs, "
+                 f"waiting for {self.get_active_thread_count()} threads to finish")
 
     def run(self):
         self.do_work()
 
-    def thread_complete(self, result):
-        self.completed.append(result)
-        self.do_work()
+    def command_complete(self, command):
+        self.tracer.merge(command.tracer)
+        self.tracer.count("completed")
+        with self._condition:
+            self._active.pop(command, None)
+            self.completed.append(command.time_taken_seconds or 0)
+            self._condition.notify_all()
 
     def is_running(self):
-        return self.thread_pool.activeThreadCount() > 0
+        with self._condition:
+            return len(self._active) > 0 or (len(self._pending) > 0 and not self.stop)
 
     def do_work(self):
-        if len(self.pending_jobs) > 0:
-            if self.stop:
-                self.log(f"Stop has been received. Waiting for threads to finish before exiting... {self.check_thread()}")
-                self.thread_pool.waitForDone()
-                self.log(f"Waiting for {self.total_jobs - len(self.pending_jobs) - len(self.completed)} "
-                         f"threads to finish {self.check_thread()}")
-                if (self.total_jobs - len(self.pending_jobs) - len(self.completed)) == 0:
-                    self.finish_event.emit(self.completed, sum(self.completed))
-                self.check_thread()
-                return
-            active_threads = self.thread_pool.activeThreadCount()
-            available_threads = self.max_threads - active_threads
-            for i in range(0, min(available_threads, len(self.pending_jobs))):
-                self.log(f"Dispatching thread on empty slot... {self.check_thread()}")
-                runnable = self.pending_jobs.pop()
-                runnable.signals.__complete__.connect(self.thread_complete)
-                runnable.setAutoDelete(True)
-                # Execute
-                self.thread_pool.start(runnable)
-        else:
-            self.log(f"Waiting for threads to finish {self.check_thread()}")
-            if len(self.completed) == self.total_jobs:
-                total_time = sum(self.completed)
-                self.log(f"Done. Total work completed in...{total_time} {self.check_thread()}")
-                self.finish_event.emit(self.completed, total_time)
+        with self._condition:
+            self._dispatching = True
+            while True:
+                self._adjust_concurrency()
+                self._dispatch()
+                self._cancel_timed_out_commands()
+                if len(self._active) == 0 and (self.stop or len(self._pending) == 0):
+                    break
+                self._condition.wait(timeout=self._next_deadline())
+            self._dispatching = False
+            self._finished = True
+            total_time = sum(self.completed) if self.spool is None else self.completed.total_seconds
+        self.backend.shutdown()
+        self.log(f"Done. Total work completed in...{total_time}")
+        self.finish_event.emit(self.completed, int(total_time))
+
+    def _dispatch(self):
+        while len(self._pending) > 0 and not self.stop and len(self._active) < self.max_threads:
+            _, _, command = heapq.heappop(self._pending)
+            if command.queued_ns is not None:
+                command.tracer.add_span("queue_wait", command.queued_ns, now_ns())
+            timeout = command.timeout or self.job_timeout
+            self._active[command] = (None, time.monotonic() + timeout if timeout else None)
+            handle = self.backend.start(self, command)
+            if command in self._active:
+                self._active[command] = (handle, self._active[command][1])
+            self._condition.notify_all()
+
+    def _adjust_concurrency(self):
+        if self.controller is not None and self.controller.sample(len(self.completed)):
+            self.max_threads = self.controller.limit
+            self.log(f"Concurrency set to {self.max_threads}: {self.controller.reason}")
+            self.concurrency_event.emit(self.max_threads, self.controller.reason)
+
+    def _cancel_timed_out_commands(self):
+        now = time.monotonic()
+        for command, (_, deadline) in self._active.items():
+            if deadline is not None and deadline <= now and not command.is_cancelled():
+                self.log(f"{command} has timed out and will be cancelled")
+                self.tracer.count("timed_out")
+                command.cancel()
+                self.timed_out.append(command)
+
+    def _next_deadline(self):
+        deadlines = [deadline for command, (_, deadline) in self._active.items()
+                     if deadline is not None and not command.is_cancelled()]
+        if self.controller is not None:
+            deadlines.append(time.monotonic() + self.controller.interval)
+        if len(deadlines) == 0:
+            return None
+        return max(min(deadlines) - time.monotonic(), 0)
 
     def check_thread(self):
         # https://stackoverflow.com/questions/58511891/qthreadcreate-running-on-ui-thread
@@ -469,4 +1124,3 @@ class CommandExecutionFactory(QThread):
             self.logger.info(message)
         else:
             print(f"No Logger Set!!: {message}")
-
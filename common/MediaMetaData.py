@@ -1,14 +1,15 @@
 import json
 import mimetypes
 import os.path
-import shlex
-import subprocess
+import re
+import threading
 from collections import defaultdict
 from datetime import datetime
 from enum import Enum
+from functools import cache
 from shutil import which
 
-from common import CommonUtils
+from common import ChecksumCache, CommonUtils, MetaDataCache, ProcessSupervisor
 
 _MISSING_DATA = "Not Available"
 # http://www.imagemagick.org/script/identify.php
@@ -20,60 +21,301 @@ _MEDIA_COMMAND_ARGS = "ffprobe -v error -select_streams a:0 -show_entries " \
                 "sample_rate,bits_per_sample,avg_frame_rate : format=bit_rate,duration,format_long_name,size : " \
                 "format_tags : stream_tags' -of json "
 _CHUNK_SIZE = 8192
-
-if which("ffprobe") is None:
-    raise Exception("This package requires ffprobe which was not found on this system")
-
-if which("magick") is None:
-    raise Exception("This package requires imagemagick which was not found on this system")
-
-mimetypes.init()
-
-
-def get_metadata(file, include_checksum=False):
-    def _add_checksum(_metadata):
-        if include_checksum:
-            _metadata[MetaDataFields.checksum] = CommonUtils.calculate_sha256_hash(file)
-        return _metadata
-
+# Pillow image modes, as imagemagick names the colorspace and depth
+_PIL_COLORSPACES = {"1": "Gray", "L": "Gray", "LA": "Gray", "I": "Gray", "I;16": "Gray", "F": "Gray",
+                    "P": "sRGB", "RGB": "sRGB", "RGBA": "sRGB", "CMYK": "CMYK", "YCbCr": "YCbCr", "LAB": "LAB"}
+_PIL_DEPTHS = {"1": 1, "I;16": 16, "I": 32, "F": 32}
+# The formats as imagemagick names them, for the Pillow formats that describe them differently
+_PIL_FORMATS = {"JPEG": "JPEG (Joint Photographic Experts Group JFIF format)",
+                "PNG": "PNG (Portable Network Graphics)",
+                "GIF": "GIF (CompuServe graphics interchange format)",
+                "BMP": "BMP (Microsoft Windows bitmap image)",
+                "TIFF": "TIFF (Tagged Image File Format)",
+                "WEBP": "WEBP (WebP Image Format)"}
+# The fields read from the image header by Pillow, other image fields need imagemagick
+_PIL_FIELDS = {"codec_name", "codec_long_name", "geometry", "number_pixels", "colorspace", "color_depth", "exif_tags"}
+_STAT_FIELDS = {"filesize", "created", "accessed"}
+# Marks a cached record that was read for some of the fields only
+_RECORD_FIELDS_KEY = "__fields__"
+
+# Looking up executables and loading the mimetype database are deferred until a file is actually inspected, so that
+# they are not paid for when an application starts
+_tools = {}
+_mimetypes_ready = False
+_init_lock = threading.Lock()
+
+
+def _require_tool(executable, package):
+    """
+    Checks, once, that an executable is on the path
+    :param executable: the executable to look for
+    :param package: the package that provides the executable, for the error message
+    """
+    if executable not in _tools:
+        with _init_lock:
+            _tools[executable] = which(executable)
+    if _tools[executable] is None:
+        raise Exception(f"This package requires {package} which was not found on this system")
+
+
+def _guess_mime_type(file):
+    global _mimetypes_ready
+    if not _mimetypes_ready:
+        with _init_lock:
+            if not _mimetypes_ready:
+                mimetypes.init()
+                _mimetypes_ready = True
+    return mimetypes.guess_type(file)[0]
+
+
+def get_metadata(file, include_checksum=False, use_cache=True, fields=None):
+    """
+    Reads the metadata of an image or media file
+    :param file: the file
+    :param include_checksum: also calculate the checksum of the file
+    :param use_cache: reuse the metadata read before, if the file has not changed since. The metadata read from the
+    file is saved in the shared MetaDataCache
+    :param fields: the MetaDataFields to read, all of them if None. Only the work these fields need is done, the file
+    is probed only for media fields, stat-ed only for its size and times, and hashed only for the checksum.
+    The metadata returned contains only these fields
+    :return: the metadata, or None if the file does not exist or is not a recognized file type
+    """
+    return _run_steps(_get_metadata_steps(file, include_checksum, use_cache, fields))
+
+
+def _get_metadata_steps(file, include_checksum, use_cache, fields):
+    """
+    The steps of get_metadata. This generator yields the handle of each probe process it starts and is sent the
+    output of the process once it ends, so that the probes of many files can run at the same time
+    """
     if not os.path.exists(file):
         return None
 
     try:
-        mime_type = mimetypes.guess_type(file)[0].upper()
+        mime_type = _guess_mime_type(file).upper()
     except AttributeError:
         return None
 
+    fields = None if fields is None else frozenset(fields)
+    include_checksum = include_checksum or (fields is not None and MetaDataFields.checksum in fields)
+    stats = None
+    metadata = None
+    probed = _is_probed(mime_type) and (fields is None or any(field.is_probed() for field in fields))
+    if probed and use_cache:
+        stats = os.stat(file)
+        metadata = _from_record(MetaDataCache.get_default_cache().get(file, stats), fields)
+    if metadata is None:
+        metadata = (yield from _read_metadata(file, mime_type, fields)) if probed else defaultdict(lambda: None)
+        if metadata is None:
+            return None
+        # A probe that failed or printed nothing is not cached, the file is probed again next time
+        if probed and use_cache and len(metadata) > 0:
+            MetaDataCache.get_default_cache().put(file, _to_record(metadata, fields), stats)
+    return _complete(file, metadata, include_checksum, fields, stats)
+
+
+def _run_steps(steps, handle=None):
+    """
+    Runs the steps to the end, waiting for each process they start
+    :param steps: the steps
+    :param handle: the process the steps are waiting for, if they have been started already
+    :return: the value the steps return
+    """
+    try:
+        handle = next(steps) if handle is None else handle
+        while True:
+            handle = steps.send(handle.result().stdout)
+    except StopIteration as stop:
+        return stop.value
+
+
+def prefetch_metadata(files, include_checksum=False, fields=None):
+    """
+    Loads the cached metadata of many files at once. Files that are not in the cache, or that have changed since they
+    were cached, are left out and can be read with get_metadata
+    :param files: the files
+    :param include_checksum: also calculate the checksum of the files found
+    :param fields: the MetaDataFields to read, see get_metadata
+    :return: a dictionary of file to metadata
+    """
+    fields = None if fields is None else frozenset(fields)
+    include_checksum = include_checksum or (fields is not None and MetaDataFields.checksum in fields)
+    found = {}
+    for file, record in MetaDataCache.get_default_cache().get_many(files).items():
+        metadata = _from_record(record, fields)
+        if metadata is not None:
+            found[file] = _complete(file, metadata, include_checksum, fields)
+    return found
+
+
+def get_metadata_many(files, include_checksum=False, use_cache=True, fields=None):
+    """
+    Reads the metadata of many files. ffprobe and imagemagick only read one file per process, so the probes of all
+    the files that are not cached are started before waiting for any of them, and the shared ProcessSupervisor runs
+    them side by side
+    :param files: the files
+    :param include_checksum: also calculate the checksums of the files
+    :param use_cache: reuse the metadata read before, see get_metadata
+    :param fields: the MetaDataFields to read, see get_metadata
+    :return: the metadata of each file, in the same order as the files. None for files that could not be read
+    """
+    files = list(files)
+    cached = prefetch_metadata(files, include_checksum, fields) if use_cache else {}
+    pending = list(dict.fromkeys(file for file in files if file not in cached))
+    read = {}
+    started = []
+    for file in pending:
+        steps = _get_metadata_steps(file, include_checksum, use_cache, fields)
+        try:
+            started.append((file, steps, next(steps)))
+        except StopIteration as stop:
+            read[file] = stop.value
+    for file, steps, handle in started:
+        read[file] = _run_steps(steps, handle)
+    return [cached[file] if file in cached else read[file] for file in files]
+
+
+def _is_probed(mime_type):
+    return mime_type.startswith("IMAGE") or mime_type.startswith("AUDIO") or mime_type.startswith("VIDEO")
+
+
+def _read_metadata(file, mime_type, fields=None):
     metadata = defaultdict(lambda: None)
     if mime_type.startswith("IMAGE"):
-        metadata = _get_image_metadata(_execute(_IMAGE_COMMAND_ARGS + f"\"{file}\""))
+        metadata = None
+        # Pillow only reads some of the fields, a request for all of them needs magick
+        if fields is not None and all(field.name in _PIL_FIELDS for field in fields if field.is_probed()):
+            metadata = _read_image_header(file)
+        if metadata is None:
+            _require_tool("magick", "imagemagick")
+            metadata = _get_image_metadata((yield _execute(_IMAGE_COMMAND_ARGS + f"\"{file}\"")))
     elif mime_type.startswith("AUDIO") or mime_type.startswith("VIDEO"):
-        m_metadata = _execute(_MEDIA_COMMAND_ARGS + f"\"{file}\"")
+        _require_tool("ffprobe", "ffprobe")
+        m_metadata = yield _execute(_media_command(fields) + f"\"{file}\"")
         if m_metadata:
             metadata = _get_media_metadata(json.loads(m_metadata))
-    _add_file_details(file, metadata)
-    _add_checksum(metadata)
+    return metadata
+
+
+def _read_image_header(file):
+    """
+    Reads the dimensions, format and EXIF tags of an image from its header with Pillow, without decoding the image.
+    The values are formatted the way imagemagick reports them
+    :return: the metadata, or None if Pillow is not available or cannot read the image
+    """
+    try:
+        from PIL import ExifTags, Image, UnidentifiedImageError
+    except ImportError:
+        return None
+
+    try:
+        with Image.open(file) as image:
+            width, height = image.size
+            params = defaultdict(lambda: None)
+            image_format = _pil_format(image.format, image.format_description)
+            params[MetaDataFields.codec_name] = image_format
+            params[MetaDataFields.codec_long_name] = image_format
+            params[MetaDataFields.geometry] = f"{width}x{height}+0+0"
+            params[MetaDataFields.number_pixels] = str(width * height)
+            params[MetaDataFields.colorspace] = _PIL_COLORSPACES.get(image.mode, image.mode)
+            params[MetaDataFields.color_depth] = f"{_PIL_DEPTHS.get(image.mode, 8)}-bit"
+            exif = image.getexif()
+            if len(exif) > 0:
+                params[MetaDataFields.exif_tags] = {ExifTags.TAGS.get(tag, str(tag)): str(value).strip()
+                                                    for tag, value in exif.items()}
+            return params
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+
+
+def _pil_format(image_format, description):
+    if image_format in _PIL_FORMATS:
+        return _PIL_FORMATS[image_format]
+    if not description or description.upper().startswith(image_format.upper()):
+        return description or image_format
+    return f"{image_format} ({description})"
+
+
+def _media_command(fields):
+    if fields is None:
+        return _MEDIA_COMMAND_ARGS
+    # The stream type is always read, a file without an audio stream is not a media file
+    entries = ["stream=" + ",".join(["codec_type"] + [field.name for field in fields if field.field_type == "streams"])]
+    format_fields = [field.name for field in fields if field.field_type == "format"]
+    if len(format_fields) > 0:
+        entries.append("format=" + ",".join(format_fields))
+    if any(field.field_type == "tags" for field in fields):
+        entries.append("format_tags")
+    return f"ffprobe -v error -select_streams a:0 -show_entries '{' : '.join(entries)}' -of json "
+
+
+def _complete(file, metadata, include_checksum, fields=None, stats=None):
+    _add_file_details(file, metadata, fields, stats)
+    if include_checksum:
+        metadata[MetaDataFields.checksum] = CommonUtils.calculate_sha256_hash(
+            file, cache=ChecksumCache.get_default_cache())
+    if fields is not None:
+        metadata = defaultdict(lambda: None, {field: metadata[field] for field in fields if field in metadata})
+    return metadata
+
+
+def _to_record(metadata, fields=None):
+    record = {field.name: value for field, value in metadata.items()}
+    if fields is not None:
+        record[_RECORD_FIELDS_KEY] = sorted(field.name for field in fields if field.is_probed())
+    return record
+
+
+def _from_record(record, fields=None):
+    """
+    :return: the metadata in a cached record, or None if there is no record or it was read for fewer fields than needed
+    """
+    if record is None:
+        return None
+    if _RECORD_FIELDS_KEY in record:
+        needed = None if fields is None else {field.name for field in fields if field.is_probed()}
+        if needed is None or not needed <= set(record[_RECORD_FIELDS_KEY]):
+            return None
+    metadata = defaultdict(lambda: None)
+    for name, value in record.items():
+        if name != _RECORD_FIELDS_KEY:
+            metadata[MetaDataFields[name]] = value
     return metadata
 
 
 def _get_image_metadata(metadata):
+    pattern, fields_by_key = _magick_parser()
     params = defaultdict(lambda: None)
-    for line in metadata.split("\n"):
-        line = line.strip()
-        for metadata_field in MetaDataFields:
-            if metadata_field.magick_key and line.startswith(metadata_field.magick_key):
-                value = line.split(metadata_field.magick_key)[1].strip()
-                if metadata_field == MetaDataFields.exif_tags:
-                    key, exif_value = value.split(":", 1)
-                    if metadata_field in params:
-                        params[metadata_field][key.strip()] = exif_value.strip()
-                    else:
-                        params[metadata_field] = {key.strip(): exif_value.strip()}
+    for match in pattern.finditer(metadata):
+        key, value = match.group(1), match.group(2).strip()
+        for metadata_field in fields_by_key[key]:
+            if metadata_field == MetaDataFields.exif_tags:
+                exif_key, _, exif_value = value.partition(":")
+                if metadata_field in params:
+                    params[metadata_field][exif_key.strip()] = exif_value.strip()
                 else:
-                    params[metadata_field] = line.split(metadata_field.magick_key)[1].strip()
+                    params[metadata_field] = {exif_key.strip(): exif_value.strip()}
+            else:
+                params[metadata_field] = value
     return params
 
 
+@cache
+def _magick_parser():
+    """
+    Builds, once, a single pattern that finds every line of the identify output that starts with one of the
+    magick_keys, so that the output is scanned once rather than once per field
+    :return: the pattern, and a dictionary of magick_key to the fields read from lines with that key
+    """
+    fields_by_key = defaultdict(list)
+    for metadata_field in MetaDataFields:
+        if metadata_field.magick_key:
+            fields_by_key[metadata_field.magick_key].append(metadata_field)
+    # Longest keys first, so that a key is never shadowed by a shorter key it starts with
+    keys = "|".join(re.escape(key) for key in sorted(fields_by_key, key=len, reverse=True))
+    return re.compile(rf"^[ \t]*({keys})(.*)$", re.MULTILINE), dict(fields_by_key)
+
+
 def _get_media_metadata(metadata):
     def _merge_fields(source, dest, fields):
         for field in fields:
@@ -98,28 +340,26 @@ def _get_media_metadata(metadata):
     return params
 
 
-def _add_file_details(file, metadata):
+def _add_file_details(file, metadata, fields=None, stats=None):
     _, ext = os.path.splitext(file)
     file_path, file_name = os.path.split(file)
-    stats = os.stat(file)
     metadata[MetaDataFields.filename] = file_name
     metadata[MetaDataFields.filepath] = file_path
-    metadata[MetaDataFields.filesize] = stats.st_size
-    metadata[MetaDataFields.created] = stats.st_ctime
-    metadata[MetaDataFields.accessed] = stats.st_atime
     metadata[MetaDataFields.extension] = ext
-    metadata[MetaDataFields.mimetype] = mimetypes.guess_type(file)[0]
+    metadata[MetaDataFields.mimetype] = _guess_mime_type(file)
+    if fields is None or any(field.name in _STAT_FIELDS for field in fields):
+        stats = os.stat(file) if stats is None else stats
+        metadata[MetaDataFields.filesize] = stats.st_size
+        metadata[MetaDataFields.created] = stats.st_ctime
+        metadata[MetaDataFields.accessed] = stats.st_atime
 
 
 def _execute(command):
-    process = subprocess.Popen(
-        shlex.split(command),
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        universal_newlines=True
-    )
-    output, _ = process.communicate()
-    return output
+    """
+    Starts a probe process
+    :return: the ProcessHandle of the process
+    """
+    return ProcessSupervisor.get_default_supervisor().submit(command)
 
 
 class MetaDataFields(Enum):
@@ -171,8 +411,15 @@ class MetaDataFields(Enum):
             if field_type not in self.__class__.__lookup__:
                 self.__class__.__lookup__[field_type] = []
             self.__class__.__lookup__[field_type].append(self)
+        self.field_type = field_type
         self.magick_key = magick_key
 
+    def is_probed(self):
+        """
+        :return: True if the field is read from the file by ffprobe or imagemagick
+        """
+        return self.field_type is not None or self.magick_key is not None
+
     def __str__(self):
         return self.name
 
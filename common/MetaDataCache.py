@@ -0,0 +1,161 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from common import CommonUtils
+
+_QUERY_CHUNK_SIZE = 500
+
+# Reads record when metadata was last used, these updates are written with the next write, or once this many have
+# been collected, so that reads do not hold the write lock of a cache shared by many processes
+_TOUCH_BATCH_SIZE = 1000
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+class MetaDataCache:
+    """
+    A persistent cache of the metadata read from media files by ffprobe and imagemagick. Cached metadata is reused
+    as long as the size and modification time of the file have not changed since it was read. When the stored
+    metadata grows beyond max_bytes, the least recently used entries are evicted.
+    Metadata is stored as a JSON object, so it must be a dictionary of strings to JSON serializable values.
+    The cache can be shared between threads, and between processes, the database is in WAL mode
+    """
+    def __init__(self, cache_file=None, max_bytes=256 * 1048576):
+        if cache_file is None:
+            cache_file = os.path.join(CommonUtils.get_app_data_dir("common"), "metadata.sqlite")
+        self.cache_file = cache_file
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._touched = {}
+        self._db = sqlite3.connect(cache_file, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS metadata(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                         "data TEXT, bytes INTEGER, last_used REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_metadata_last_used ON metadata(last_used)")
+        self._db.commit()
+        self._entries, self._bytes = self._db.execute("SELECT COUNT(*), IFNULL(SUM(bytes), 0) FROM metadata").fetchone()
+
+    def get(self, file, stats=None):
+        """
+        Find the cached metadata of a file
+        :param file: the file
+        :param stats: the os.stat of the file, if already known
+        :return: the metadata, or None if the file is not cached or has changed since it was cached
+        """
+        stats = os.stat(file) if stats is None else stats
+        with self._lock:
+            record = self._db.execute("SELECT data FROM metadata WHERE path=? AND size=? AND mtime_ns=?",
+                                      [file, stats.st_size, stats.st_mtime_ns]).fetchone()
+            if record is None:
+                return None
+            self._touch([file])
+            return json.loads(record[0])
+
+    def get_many(self, files):
+        """
+        Find the cached metadata of many files with a few queries, rather than one per file
+        :param files: the files
+        :return: a dictionary of file to metadata for the files that are cached and unchanged
+        """
+        stats = {}
+        for file in files:
+            try:
+                stats[file] = os.stat(file)
+            except OSError:
+                pass
+        found = {}
+        paths = list(stats.keys())
+        with self._lock:
+            for i in range(0, len(paths), _QUERY_CHUNK_SIZE):
+                chunk = paths[i:i + _QUERY_CHUNK_SIZE]
+                records = self._db.execute(f"SELECT path, size, mtime_ns, data FROM metadata "
+                                           f"WHERE path IN ({','.join('?' * len(chunk))})", chunk)
+                for path, size, mtime_ns, data in records:
+                    if stats[path].st_size == size and stats[path].st_mtime_ns == mtime_ns:
+                        found[path] = json.loads(data)
+            self._touch(found)
+        return found
+
+    def put(self, file, metadata, stats=None):
+        """
+        Save the metadata of a file
+        :param file: the file
+        :param metadata: the metadata
+        :param stats: the os.stat of the file when the metadata was read
+        """
+        stats = os.stat(file) if stats is None else stats
+        data = json.dumps(metadata)
+        with self._lock:
+            self._write_touched()
+            existing = self._db.execute("SELECT bytes FROM metadata WHERE path=?", [file]).fetchone()
+            self._db.execute("INSERT OR REPLACE INTO metadata VALUES(?, ?, ?, ?, ?, ?)",
+                             [file, stats.st_size, stats.st_mtime_ns, data, len(data), time.time()])
+            if existing is None:
+                self._entries += 1
+            else:
+                self._bytes -= existing[0]
+            self._bytes += len(data)
+            if self._bytes > self.max_bytes:
+                # Other processes add to the cache too, the size is only an estimate until it is read again
+                self._entries, self._bytes = self._db.execute(
+                    "SELECT COUNT(*), IFNULL(SUM(bytes), 0) FROM metadata").fetchone()
+                if self._bytes > self.max_bytes:
+                    self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        # Evict down to 90% of the limit so that eviction does not run on every insert once the cache is full
+        keep = int(self.max_bytes * 0.9)
+        self._db.execute("DELETE FROM metadata WHERE path IN "
+                         "(SELECT path FROM (SELECT path, SUM(bytes) OVER (ORDER BY last_used DESC) AS running "
+                         "FROM metadata) WHERE running > ?)", [keep])
+        self._entries, self._bytes = self._db.execute("SELECT COUNT(*), IFNULL(SUM(bytes), 0) FROM metadata").fetchone()
+
+    def _touch(self, files):
+        now = time.time()
+        for file in files:
+            self._touched[file] = now
+        if len(self._touched) >= _TOUCH_BATCH_SIZE:
+            self._write_touched()
+            self._db.commit()
+
+    def _write_touched(self):
+        if len(self._touched) > 0:
+            self._db.executemany("UPDATE metadata SET last_used=? WHERE path=?",
+                                 [(last_used, path) for path, last_used in self._touched.items()])
+            self._touched.clear()
+
+    def __len__(self):
+        return self._entries
+
+    def size(self):
+        """
+        :return: the number of bytes of metadata stored
+        """
+        return self._bytes
+
+    def commit(self):
+        with self._lock:
+            self._write_touched()
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._write_touched()
+            self._db.commit()
+            self._db.close()
+
+
+def get_default_cache():
+    """
+    :return: the metadata cache shared by all applications
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = MetaDataCache()
+        return _default_cache
@@ -0,0 +1,219 @@
+import asyncio
+import codecs
+import os
+import re
+import shlex
+import threading
+from collections import namedtuple
+
+_READ_SIZE = 65536
+# Progress output from tools like ffmpeg ends lines with a carriage return only
+_LINE_BREAK = re.compile(r"\r\n|\r|\n")
+
+ProcessResult = namedtuple("ProcessResult", ["returncode", "stdout", "stderr", "timed_out", "cancelled"])
+
+_default_supervisor = None
+_default_supervisor_lock = threading.Lock()
+
+
+class ProcessHandle:
+    """
+    A child process started by a ProcessSupervisor
+    """
+    def __init__(self, supervisor, command):
+        self.command = command
+        self._supervisor = supervisor
+        self._future = None
+        self._task = None
+        self._cancel_requested = False
+
+    def result(self, timeout=None):
+        """
+        Waits for the process to end
+        :param timeout: the seconds to wait, None waits for ever
+        :return: the ProcessResult
+        :raises concurrent.futures.TimeoutError: if the process is still running after the timeout
+        """
+        return self._future.result(timeout)
+
+    def done(self):
+        return self._future.done()
+
+    def cancel(self):
+        """
+        Kills the process, or stops it from starting if it is still waiting for a free slot
+        """
+        self._cancel_requested = True
+        loop = self._supervisor._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._cancel_task)
+
+    def _cancel_task(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+class ProcessSupervisor:
+    """
+    Runs child processes on a single asyncio event loop, in one background thread, instead of using a thread per
+    process to read its pipes. At most max_processes children run at the same time, the others wait for a free slot.
+    Output lines are passed to on_line as they are read, from the supervisor thread, and can also be collected into
+    the ProcessResult. A process that runs for longer than its timeout, or that is cancelled, is killed.
+    Commands given as a string are split with shlex, unless they are run with shell=True
+    """
+    def __init__(self, max_processes=None):
+        self.max_processes = max_processes or (os.cpu_count() or 1) * 4
+        self._loop = None
+        self._semaphore = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, command, on_line=None, timeout=None, shell=False, merge_stderr=False, capture_output=True,
+               pipe_output=True, cwd=None):
+        """
+        Starts a process without waiting for it
+        :param command: the command, as a string or a list of arguments
+        :param on_line: called with each line of output and the name of the stream, "stdout" or "stderr"
+        :param timeout: the seconds the process may run before it is killed
+        :param shell: run the command through the shell
+        :param merge_stderr: send stderr to stdout
+        :param capture_output: collect the output into the ProcessResult
+        :param pipe_output: read the output of the process. If False, the process writes to the output of this process
+        :param cwd: the working directory of the process
+        :return: the ProcessHandle
+        """
+        loop = self._start()
+        handle = ProcessHandle(self, command)
+        handle._future = asyncio.run_coroutine_threadsafe(
+            self._run(handle, command, on_line, timeout, shell, merge_stderr, capture_output, pipe_output, cwd), loop)
+        return handle
+
+    def run(self, command, **kwargs):
+        """
+        Runs a process and waits for it to end. See submit for the arguments
+        :return: the ProcessResult
+        """
+        return self.submit(command, **kwargs).result()
+
+    def shutdown(self):
+        """
+        Stops the event loop. Processes still running are killed
+        """
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is not None:
+            loop.call_soon_threadsafe(self._cancel_all, loop)
+            thread.join()
+
+    def _start(self):
+        with self._lock:
+            if self._loop is None:
+                started = threading.Event()
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._serve, args=(self._loop, started),
+                                                name=type(self).__name__, daemon=True)
+                self._thread.start()
+                started.wait()
+            return self._loop
+
+    def _serve(self, loop, started):
+        asyncio.set_event_loop(loop)
+        self._semaphore = asyncio.Semaphore(self.max_processes)
+        loop.call_soon(started.set)
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    @staticmethod
+    def _cancel_all(loop):
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        # Let the cancelled tasks kill their processes before the loop stops
+        asyncio.ensure_future(asyncio.wait(tasks) if tasks else asyncio.sleep(0), loop=loop) \
+            .add_done_callback(lambda _: loop.stop())
+
+    async def _run(self, handle, command, on_line, timeout, shell, merge_stderr, capture_output, pipe_output, cwd):
+        handle._task = asyncio.current_task()
+        stdout, stderr = [], []
+        process = None
+        try:
+            async with self._semaphore:
+                if handle._cancel_requested:
+                    return ProcessResult(None, "", "", False, True)
+                process = await self._spawn(command, shell, merge_stderr, pipe_output, cwd)
+                waits = [process.wait()]
+                if pipe_output:
+                    waits.append(self._read(process.stdout, "stdout", on_line, stdout if capture_output else None))
+                    if not merge_stderr:
+                        waits.append(self._read(process.stderr, "stderr", on_line,
+                                                stderr if capture_output else None))
+                try:
+                    await asyncio.wait_for(asyncio.gather(*waits), timeout)
+                except asyncio.TimeoutError:
+                    return ProcessResult(await self._kill(process), "".join(stdout), "".join(stderr), True, False)
+                return ProcessResult(process.returncode, "".join(stdout), "".join(stderr), False, False)
+        except asyncio.CancelledError:
+            returncode = await self._kill(process) if process is not None else None
+            return ProcessResult(returncode, "".join(stdout), "".join(stderr), False, True)
+        finally:
+            if process is not None and process.returncode is None:
+                await self._kill(process)
+
+    @staticmethod
+    async def _spawn(command, shell, merge_stderr, pipe_output, cwd):
+        stdout = asyncio.subprocess.PIPE if pipe_output else None
+        stderr = (asyncio.subprocess.STDOUT if merge_stderr else asyncio.subprocess.PIPE) if pipe_output else None
+        if shell:
+            command = command if isinstance(command, str) else shlex.join(command)
+            return await asyncio.create_subprocess_shell(command, stdin=asyncio.subprocess.DEVNULL, stdout=stdout,
+                                                         stderr=stderr, cwd=cwd)
+        args = shlex.split(command) if isinstance(command, str) else list(command)
+        return await asyncio.create_subprocess_exec(*args, stdin=asyncio.subprocess.DEVNULL, stdout=stdout,
+                                                    stderr=stderr, cwd=cwd)
+
+    @staticmethod
+    async def _read(stream, name, on_line, collected):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        pending = ""
+        while True:
+            chunk = await stream.read(_READ_SIZE)
+            text = decoder.decode(chunk, final=not chunk)
+            if collected is not None:
+                collected.append(text)
+            if on_line is None:
+                if not chunk:
+                    return
+                continue
+            pending += text
+            # A carriage return at the end of a chunk may be the first half of a \r\n
+            held = "\r" if chunk and pending.endswith("\r") else ""
+            lines = _LINE_BREAK.split(pending[:-1] if held else pending)
+            pending = lines.pop() + held
+            for line in lines:
+                on_line(line + "\n", name)
+            if not chunk:
+                if pending:
+                    on_line(pending, name)
+                return
+
+    @staticmethod
+    async def _kill(process):
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+        return await process.wait()
+
+
+def get_default_supervisor():
+    """
+    :return: the process supervisor shared by all applications
+    """
+    global _default_supervisor
+    with _default_supervisor_lock:
+        if _default_supervisor is None:
+            _default_supervisor = ProcessSupervisor()
+        return _default_supervisor
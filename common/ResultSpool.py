@@ -0,0 +1,84 @@
+import os
+import pickle
+import tempfile
+import threading
+
+
+class ResultSpool:
+    """
+    An append-only file of results, so that the results of a very large number of commands do not have to be held in
+    memory until all of them are complete. Results are pickled one after another and can be read back, in the order
+    they were added, while results are still being appended.
+    The spool can be shared between threads
+    """
+    def __init__(self, spool_file=None, delete_on_close=None):
+        """
+        :param spool_file: the file to append to. A temporary file is used if not provided
+        :param delete_on_close: delete the file when the spool is closed. By default only a temporary file is deleted
+        """
+        if spool_file is None:
+            handle, spool_file = tempfile.mkstemp(prefix="results_", suffix=".spool")
+            os.close(handle)
+            delete_on_close = True if delete_on_close is None else delete_on_close
+        self.spool_file = spool_file
+        self.delete_on_close = bool(delete_on_close)
+        self._lock = threading.Lock()
+        self._file = open(spool_file, "ab")
+        self._count = 0
+
+    def append(self, result):
+        """
+        Adds a result to the end of the spool
+        :param result: any picklable object
+        """
+        data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._file.write(data)
+            self._count += 1
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        """
+        Reads the results back, one at a time
+        """
+        with self._lock:
+            self._file.flush()
+            count = self._count
+        with open(self.spool_file, "rb") as f:
+            for _ in range(0, count):
+                yield pickle.load(f)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        if self.delete_on_close and os.path.exists(self.spool_file):
+            os.remove(self.spool_file)
+
+
+class JobSummary:
+    """
+    Aggregates the time taken by completed commands without keeping the time of each command
+    """
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0
+        self.min_seconds = None
+        self.max_seconds = None
+
+    def append(self, seconds):
+        self.count += 1
+        self.total_seconds += seconds
+        self.min_seconds = seconds if self.min_seconds is None else min(self.min_seconds, seconds)
+        self.max_seconds = seconds if self.max_seconds is None else max(self.max_seconds, seconds)
+
+    def mean_seconds(self):
+        return self.total_seconds / self.count if self.count > 0 else 0
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return f"{self.count} jobs in {self.total_seconds:.2f}s " \
+               f"(min {self.min_seconds}s, max {self.max_seconds}s, mean {self.mean_seconds():.2f}s)"
@@ -0,0 +1,100 @@
+import os
+import sqlite3
+import threading
+import time
+
+from common import CommonUtils
+
+# Directories modified this recently may still be changing within the same mtime tick, so their listing is not trusted
+_RACY_INTERVAL_NS = 2 * 1000 * 1000 * 1000
+
+
+class ScanIndex:
+    """
+    A persistent index of directory listings that can be shared by FileScanner instances.
+    Each directory is stored with its mtime and entries. When a directory is scanned again and its mtime has not
+    changed, the stored entries are returned without listing the directory. Changed directories are listed again and
+    the files added and removed since the previous scan are reported.
+    The index can be shared by all the threads of a streaming scan
+    """
+    def __init__(self, index_file=None):
+        if index_file is None:
+            index_file = os.path.join(CommonUtils.get_app_data_dir("common"), "scan_index.sqlite")
+        self.index_file = index_file
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(index_file, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS directories(path TEXT PRIMARY KEY, mtime_ns INTEGER)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS entries(directory TEXT, name TEXT, is_dir INTEGER, "
+                         "PRIMARY KEY (directory, name))")
+        self._db.commit()
+
+    def list_directory(self, directory):
+        """
+        Lists a directory, using the index if the directory has not changed since it was last listed
+        :param directory: the directory to list
+        :return: Tuple of the (name, is_dir) entries of the directory, the paths of the files added and the paths of
+        the files removed since the last scan
+        """
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError:
+            with self._lock:
+                return [], [], self._forget_tree(directory)
+
+        with self._lock:
+            record = self._db.execute("SELECT mtime_ns FROM directories WHERE path=?", [directory]).fetchone()
+            if record is not None and record[0] == mtime_ns:
+                entries = self._db.execute("SELECT name, is_dir FROM entries WHERE directory=?",
+                                           [directory]).fetchall()
+                return [(name, bool(is_dir)) for name, is_dir in entries], [], []
+            previous = {} if record is None else dict(
+                self._db.execute("SELECT name, is_dir FROM entries WHERE directory=?", [directory]).fetchall())
+
+        entries = CommonUtils.list_directory(directory)
+
+        with self._lock:
+            current = dict(entries)
+            added = [os.path.join(directory, name) for name, is_dir in entries
+                     if not is_dir and (name not in previous or previous[name])]
+            removed = []
+            for name, was_dir in previous.items():
+                file = os.path.join(directory, name)
+                if was_dir and current.get(name) is not True:
+                    removed.extend(self._forget_tree(file))
+                elif not was_dir and (name not in current or current[name]):
+                    removed.append(file)
+            if time.time_ns() - mtime_ns < _RACY_INTERVAL_NS:
+                mtime_ns = -1
+            self._db.execute("INSERT OR REPLACE INTO directories VALUES(?, ?)", [directory, mtime_ns])
+            self._db.execute("DELETE FROM entries WHERE directory=?", [directory])
+            self._db.executemany("INSERT INTO entries VALUES(?, ?, ?)",
+                                 [(directory, name, int(is_dir)) for name, is_dir in entries])
+        return entries, added, removed
+
+    def _forget_tree(self, directory):
+        """
+        Removes a directory and all its sub directories from the index. The lock must be held by the caller
+        :param directory: the directory to remove
+        :return: the paths of all the files that were indexed in the tree
+        """
+        removed = []
+        directories = [directory]
+        while len(directories) > 0:
+            _dir = directories.pop()
+            for name, is_dir in self._db.execute("SELECT name, is_dir FROM entries WHERE directory=?", [_dir]):
+                if is_dir:
+                    directories.append(os.path.join(_dir, name))
+                else:
+                    removed.append(os.path.join(_dir, name))
+            self._db.execute("DELETE FROM entries WHERE directory=?", [_dir])
+            self._db.execute("DELETE FROM directories WHERE path=?", [_dir])
+        return removed
+
+    def commit(self):
+        with self._lock:
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
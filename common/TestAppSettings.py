@@ -0,0 +1,48 @@
+import unittest
+import uuid
+
+from PyQt5.QtCore import QCoreApplication, QEventLoop, QSettings, Qt, QTimer
+
+from common.CommonUtils import AppSettings
+
+
+class TestAppSettings(unittest.TestCase):
+
+    def setUp(self):
+        self.app = QCoreApplication.instance() or QCoreApplication([])
+        self.app_name = f"TestAppSettings-{uuid.uuid4()}"
+
+    def tearDown(self):
+        settings = QSettings("github.com/ag-sd", self.app_name)
+        settings.clear()
+        settings.sync()
+
+    def _stored(self):
+        return QSettings("github.com/ag-sd", self.app_name).value("app_settings")
+
+    def testWriteBehindBatchesWrites(self):
+        settings = AppSettings(self.app_name, {}, write_behind=True, flush_interval=50)
+        events = []
+        settings.settings_change_event.connect(lambda key, value: events.append((key, value)), Qt.DirectConnection)
+        for zoom in range(0, 100):
+            settings.apply_setting("zoom", zoom)
+        self.assertEqual(len(events), 100)
+        self.assertEqual(settings.get_setting("zoom"), 99)
+        self.assertIsNone(self._stored())
+
+        loop = QEventLoop()
+        QTimer.singleShot(200, loop.quit)
+        loop.exec_()
+        self.assertEqual(self._stored(), {"zoom": 99})
+
+    def testFlushWritesPendingChanges(self):
+        settings = AppSettings(self.app_name, {}, write_behind=True, flush_interval=60000)
+        settings.apply_setting("encode_list", [1, 2, 3])
+        self.assertIsNone(self._stored())
+        settings.flush()
+        self.assertEqual(self._stored(), {"encode_list": [1, 2, 3]})
+
+    def testWriteThrough(self):
+        settings = AppSettings(self.app_name, {})
+        settings.apply_setting("zoom", 5)
+        self.assertEqual(self._stored(), {"zoom": 5})
@@ -0,0 +1,101 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from common import CommonUtils
+from common.ChecksumCache import ChecksumCache
+
+
+class TestChecksum(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        self.cache = ChecksumCache(os.path.join(self.root, "checksums.sqlite"), max_entries=10)
+
+    def tearDown(self):
+        self.cache.close()
+        self.temp_dir.cleanup()
+
+    def _write(self, name, content):
+        file = os.path.join(self.root, name)
+        with open(file, "wb") as f:
+            f.write(content)
+        return file
+
+    def testHashMatchesHashlib(self):
+        content = os.urandom(3 * 1048576 + 17)
+        file = self._write("random.bin", content)
+        self.assertEqual(CommonUtils.calculate_sha256_hash(file), hashlib.sha256(content).hexdigest())
+        self.assertEqual(CommonUtils.calculate_sha256_hash(self._write("empty.bin", b"")),
+                         hashlib.sha256(b"").hexdigest())
+
+    def testCachedHashIsNotRecalculated(self):
+        file = self._write("file.bin", b"cached content")
+        expected = CommonUtils.calculate_sha256_hash(file, cache=self.cache)
+        with mock.patch("common.CommonUtils._sha256_file") as sha256_file:
+            self.assertEqual(CommonUtils.calculate_sha256_hash(file, cache=self.cache), expected)
+            sha256_file.assert_not_called()
+
+    def testChangedFileIsRehashed(self):
+        file = self._write("file.bin", b"original content")
+        CommonUtils.calculate_sha256_hash(file, cache=self.cache)
+        self._write("file.bin", b"modified content, longer")
+        self.assertEqual(CommonUtils.calculate_sha256_hash(file, cache=self.cache),
+                         hashlib.sha256(b"modified content, longer").hexdigest())
+
+    def testLeastRecentlyUsedEntriesAreEvicted(self):
+        files = [self._write(f"file_{i}.bin", f"content {i}".encode()) for i in range(0, 12)]
+        for file in files:
+            CommonUtils.calculate_sha256_hash(file, cache=self.cache)
+        self.assertLessEqual(len(self.cache), 10)
+        self.assertIsNone(self.cache.get(files[0]))
+        self.assertIsNotNone(self.cache.get(files[-1]))
+
+    def testReadsDoNotLockTheCache(self):
+        file = self._write("file.bin", b"cached content")
+        expected = CommonUtils.calculate_sha256_hash(file, cache=self.cache)
+        self.assertEqual(self.cache.get(file), expected)
+        # Another process writing to the shared cache is not blocked by the read
+        other = ChecksumCache(self.cache.cache_file)
+        other._db.execute("PRAGMA busy_timeout=0")
+        other.put(self._write("other.bin", b"other content"), "digest")
+        other.close()
+        self.cache.commit()
+        with sqlite3.connect(self.cache.cache_file) as db:
+            self.assertEqual(db.execute("SELECT COUNT(*) FROM checksums").fetchone()[0], 2)
+
+    def testParallelHashes(self):
+        files = [self._write(f"file_{i}.bin", f"content {i}".encode()) for i in range(0, 5)]
+        digests = CommonUtils.calculate_sha256_hashes(files, cache=self.cache, max_workers=2)
+        self.assertEqual(digests, {file: hashlib.sha256(f"content {i}".encode()).hexdigest()
+                                   for i, file in enumerate(files)})
+        self.assertEqual(CommonUtils.calculate_sha256_hashes(files, use_processes=True, max_workers=2), digests)
+
+    def testQuickFingerprint(self):
+        content = os.urandom(1048576)
+        file = self._write("file.bin", content)
+        same_samples = self._write("same_samples.bin", content[:100000] + b"x" + content[100001:])
+        different_tail = self._write("different_tail.bin", content[:-1] + b"x")
+        self.assertEqual(CommonUtils.calculate_quick_fingerprint(file),
+                         CommonUtils.calculate_quick_fingerprint(same_samples))
+        self.assertNotEqual(CommonUtils.calculate_quick_fingerprint(file),
+                            CommonUtils.calculate_quick_fingerprint(different_tail))
+
+    def testFindIdenticalFiles(self):
+        content = os.urandom(1048576)
+        copy_1 = self._write("copy_1.bin", content)
+        copy_2 = self._write("copy_2.bin", content)
+        # Only differs outside the sampled regions, so it needs a full hash to tell apart
+        self._write("same_samples.bin", content[:100000] + b"x" + content[100001:])
+        self._write("other_size.bin", content[:-1])
+        small_1 = self._write("small_1.bin", b"small")
+        small_2 = self._write("small_2.bin", b"small")
+        self._write("small_3.bin", b"SMALL")
+        groups = CommonUtils.find_identical_files(
+            [os.path.join(self.root, file) for file in os.listdir(self.root) if file.endswith(".bin")])
+        self.assertEqual(sorted(sorted(group) for group in groups), [sorted([copy_1, copy_2]),
+                                                                     sorted([small_1, small_2])])
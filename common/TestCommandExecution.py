@@ -0,0 +1,248 @@
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+import unittest
+from collections import namedtuple
+from unittest import mock
+
+from PyQt5.QtCore import QCoreApplication, Qt
+
+from common.CommonUtils import (
+    Command,
+    CommandExecutionFactory,
+    ConcurrencyController,
+    ProcessPoolBackend,
+    SchedulingPolicy,
+    SignalCoalescer,
+)
+from common.ResultSpool import ResultSpool
+from common.Tracing import Tracer
+
+_logger = logging.getLogger("TestCommandExecution")
+_CpuTimes = namedtuple("_CpuTimes", ["idle", "iowait"])
+
+
+class _RecordingCommand(Command):
+    def __init__(self, name, log, size=0, priority=0, release=None):
+        super().__init__()
+        self.name = name
+        self.log = log
+        self.size = size
+        self.priority = priority
+        self.release = release
+
+    def do_work(self):
+        if self.release is not None:
+            self.release.wait(5)
+        self.log.append(self.name)
+
+    def work_size(self):
+        return self.size
+
+
+class _CancellableCommand(Command):
+    def do_work(self):
+        start = time.monotonic()
+        while not self.is_cancelled() and time.monotonic() - start < 5:
+            time.sleep(0.01)
+
+
+class _PowerCommand(Command):
+    def __init__(self, base, exponent):
+        super().__init__()
+        self.base = base
+        self.exponent = exponent
+
+    def do_work(self):
+        self.process_result(pow(self.base, self.exponent))
+
+    def process_work(self):
+        return pow, (self.base, self.exponent)
+
+
+class TestCommandExecution(unittest.TestCase):
+
+    def _run(self, factory):
+        finished = []
+        factory.finish_event.connect(lambda results, total: finished.append((results, total)),
+                                      Qt.DirectConnection)
+        factory.start()
+        self.assertTrue(factory.wait(10000))
+        return finished
+
+    def testFifoOrder(self):
+        log = []
+        commands = [_RecordingCommand(i, log) for i in range(0, 20)]
+        finished = self._run(CommandExecutionFactory(commands, logger=_logger, max_threads=1))
+        self.assertEqual(log, list(range(0, 20)))
+        self.assertEqual(len(finished), 1)
+        self.assertEqual(len(finished[0][0]), 20)
+
+    def testPriorityOrder(self):
+        log = []
+        commands = [_RecordingCommand(i, log, priority=i % 3) for i in range(0, 9)]
+        self._run(CommandExecutionFactory(commands, logger=_logger, max_threads=1, policy=SchedulingPolicy.PRIORITY))
+        self.assertEqual(log, [2, 5, 8, 1, 4, 7, 0, 3, 6])
+
+    def testLargestFirstOrder(self):
+        log = []
+        commands = [_RecordingCommand(i, log, size=size) for i, size in enumerate([5, 50, 1, 20])]
+        self._run(CommandExecutionFactory(commands, logger=_logger, max_threads=1,
+                                          policy=SchedulingPolicy.LARGEST_FIRST))
+        self.assertEqual(log, [1, 3, 0, 2])
+
+    def testStopDropsPendingCommands(self):
+        log = []
+        release = threading.Event()
+        commands = [_RecordingCommand(i, log, release=release) for i in range(0, 10)]
+        factory = CommandExecutionFactory(commands, logger=_logger, max_threads=2)
+        finished = []
+        factory.finish_event.connect(lambda results, total: finished.append(results),
+                                      Qt.DirectConnection)
+        factory.start()
+        while factory.get_active_thread_count() < factory.get_max_threads():
+            time.sleep(0.01)
+        factory.stop_scan()
+        self.assertEqual(factory.get_pending_count(), 0)
+        release.set()
+        self.assertTrue(factory.wait(10000))
+        self.assertEqual(sorted(log), list(range(0, factory.get_max_threads())))
+        self.assertEqual(len(finished), 1)
+        self.assertFalse(factory.is_running())
+
+    def testTimedOutCommandsAreCancelled(self):
+        command = _CancellableCommand()
+        factory = CommandExecutionFactory([command], logger=_logger, job_timeout=0.1)
+        started = time.monotonic()
+        self._run(factory)
+        self.assertLess(time.monotonic() - started, 4)
+        self.assertTrue(command.is_cancelled())
+        self.assertEqual(factory.timed_out, [command])
+
+    def testAddTaskRestartsFinishedFactory(self):
+        log = []
+        factory = CommandExecutionFactory([_RecordingCommand(0, log)], logger=_logger)
+        finished = self._run(factory)
+        factory.add_task(_RecordingCommand(1, log))
+        self.assertTrue(factory.wait(10000))
+        self.assertEqual(log, [0, 1])
+        self.assertEqual(len(finished), 2)
+
+    def testBoundedQueue(self):
+        factory = CommandExecutionFactory([], logger=_logger, max_pending=2)
+        factory.add_task(_RecordingCommand(0, []))
+        factory.add_task(_RecordingCommand(1, []))
+        with self.assertRaises(queue.Full):
+            factory.add_task(_RecordingCommand(2, []), timeout=0.01)
+
+    def testProcessPoolBackend(self):
+        results = []
+        log = []
+        commands = [_PowerCommand(2, i) for i in range(0, 10)] + [_RecordingCommand("thread", log)]
+        for command in commands:
+            command.signals.result.connect(results.append, Qt.DirectConnection)
+        finished = self._run(CommandExecutionFactory(commands, logger=_logger, backend=ProcessPoolBackend(2)))
+        self.assertEqual(sorted(results), [pow(2, i) for i in range(0, 10)])
+        self.assertEqual(log, ["thread"])
+        self.assertEqual(len(finished[0][0]), 11)
+        self.assertTrue(all(command.time_taken_seconds is not None for command in commands))
+
+    def testConcurrencyControllerFeedback(self):
+        controller = ConcurrencyController(min_threads=1, max_threads=8, interval=1)
+        self.assertEqual(controller.limit, 4)
+        with mock.patch("common.CommonUtils.psutil.cpu_times_percent") as cpu_times_percent:
+            cpu_times_percent.return_value = _CpuTimes(idle=70.0, iowait=0.0)
+            self.assertFalse(controller.sample(0, now=0))
+            # Too soon to sample
+            self.assertFalse(controller.sample(0, now=0.5))
+            # Headroom, grow
+            self.assertTrue(controller.sample(10, now=1))
+            self.assertEqual(controller.limit, 5)
+            # Throughput fell after growing, revert
+            self.assertTrue(controller.sample(12, now=2))
+            self.assertEqual(controller.limit, 4)
+            # CPU saturated, hold
+            cpu_times_percent.return_value = _CpuTimes(idle=5.0, iowait=0.0)
+            self.assertFalse(controller.sample(14, now=3))
+            # Waiting on I/O, shrink down to the minimum
+            cpu_times_percent.return_value = _CpuTimes(idle=10.0, iowait=60.0)
+            for now in range(4, 10):
+                controller.sample(14 + 2 * now, now=now)
+            self.assertEqual(controller.limit, 1)
+            self.assertIn("I/O", controller.reason)
+
+    def testFactoryUsesControllerLimit(self):
+        log = []
+        controller = ConcurrencyController(min_threads=1, max_threads=1, interval=0.05)
+        factory = CommandExecutionFactory([_RecordingCommand(i, log) for i in range(0, 5)], logger=_logger,
+                                          controller=controller)
+        self.assertEqual(factory.get_max_threads(), 1)
+        self._run(factory)
+        self.assertEqual(log, list(range(0, 5)))
+
+    def testFactoryTrace(self):
+        log = []
+        factory = CommandExecutionFactory([_RecordingCommand(i, log) for i in range(0, 5)], logger=_logger,
+                                          max_threads=1)
+        self._run(factory)
+        summary = factory.tracer.summary()
+        self.assertEqual(summary["queue_wait"]["count"], 5)
+        self.assertEqual(summary["run"]["count"], 5)
+        self.assertEqual(factory.tracer.counters["completed"], 5)
+
+    def testTraceExport(self):
+        tracer = Tracer("test", max_spans=2)
+        for name in ["first", "second", "third"]:
+            with tracer.span(name, detail=name):
+                pass
+        tracer.count("files", 3)
+        self.assertEqual([span["name"] for span in tracer.spans], ["first", "second"])
+        self.assertEqual(tracer.counters["dropped_spans"], 1)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            jsonl_file = os.path.join(temp_dir, "trace.jsonl")
+            tracer.export_jsonl(jsonl_file)
+            with open(jsonl_file) as f:
+                lines = [json.loads(line) for line in f]
+            self.assertEqual(lines[0]["args"], {"detail": "first"})
+            self.assertEqual(lines[-1]["counters"], {"files": 3, "dropped_spans": 1})
+
+            chrome_file = os.path.join(temp_dir, "trace.json")
+            tracer.export_chrome_trace(chrome_file)
+            with open(chrome_file) as f:
+                events = json.load(f)["traceEvents"]
+            self.assertEqual([event["ph"] for event in events], ["X", "X", "C", "C"])
+
+    def testSpooledResults(self):
+        spool = ResultSpool()
+        commands = [_PowerCommand(3, i) for i in range(0, 50)]
+        factory = CommandExecutionFactory(commands, logger=_logger, max_threads=2, spool=spool)
+        finished = self._run(factory)
+        summary = finished[0][0]
+        self.assertEqual(len(summary), 50)
+        self.assertEqual(summary.count, 50)
+        self.assertEqual(len(spool), 50)
+        self.assertEqual(sorted(spool), [pow(3, i) for i in range(0, 50)])
+        spool.close()
+        self.assertFalse(os.path.exists(spool.spool_file))
+
+    def testSignalCoalescerMergesByKey(self):
+        app = QCoreApplication.instance() or QCoreApplication([])
+        coalescer = SignalCoalescer(key_function=lambda value: value[0], rate_hz=1000)
+        flushed = []
+        coalescer.flush_event.connect(flushed.append, Qt.DirectConnection)
+        workers = [threading.Thread(target=lambda w=w: [coalescer.post((i, w)) for i in range(0, 100)])
+                   for w in range(0, 4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        coalescer.stop()
+        self.assertEqual(len(flushed), 1)
+        self.assertEqual([key for key, _ in flushed[0]], list(range(0, 100)))
+        coalescer.flush()
+        self.assertEqual(len(flushed), 1)
+        app.processEvents()
@@ -0,0 +1,116 @@
+import itertools
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from common.CommonUtils import FileScanner, batch
+from common.ScanIndex import ScanIndex
+
+
+class TestFileScanner(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        self.expected = set()
+        for sub_dir in ["", "a", os.path.join("a", "b"), "c"]:
+            os.makedirs(os.path.join(self.root, sub_dir), exist_ok=True)
+            for i in range(0, 5):
+                self.expected.add(self._touch(os.path.join(self.root, sub_dir, f"file_{i}.mp3")))
+            self._touch(os.path.join(self.root, sub_dir, "cover.jpg"))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    @staticmethod
+    def _touch(file):
+        with open(file, "w") as f:
+            f.write(file)
+        return file
+
+    def testBatchIsLazy(self):
+        self.assertEqual(list(itertools.islice(batch(itertools.count(), batch_size=3), 2)), [[0, 1, 2], [3, 4, 5]])
+        self.assertEqual(list(batch(range(0, 7), batch_size=3)), [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(list(batch([])), [])
+
+    def testBatchSizeBudget(self):
+        sizes = [400, 300, 500, 2000, 100, 100]
+        self.assertEqual(list(batch(sizes, batch_size=None, max_batch_size=1000, size_of=lambda size: size)),
+                         [[400, 300], [500], [2000], [100, 100]])
+        self.assertEqual(list(batch(sizes, batch_size=1, max_batch_size=1000, size_of=lambda size: size)),
+                         [[size] for size in sizes])
+        with self.assertRaises(ValueError):
+            batch(sizes, max_batch_size=1000)
+
+    def testScanRecursive(self):
+        scanner = FileScanner([self.root], recurse=True, is_qfiles=False, supported_extensions=[".mp3"])
+        self.assertEqual(scanner.files, self.expected)
+        self.assertEqual(len(scanner.rejected_files), 4)
+
+    def testScanNotRecursive(self):
+        scanner = FileScanner([self.root], recurse=False, is_qfiles=False)
+        self.assertEqual(len(scanner.files), 6)
+
+    def testStreamingScanYieldsBatches(self):
+        scanner = FileScanner([self.root], recurse=True, is_qfiles=False, supported_extensions=[".mp3"],
+                              streaming=True)
+        self.assertEqual(scanner.files, set())
+        batches = list(scanner.scan_batches(batch_size=3))
+        self.assertTrue(all(len(batch) <= 3 for batch in batches))
+        found = [file for batch in batches for file in batch]
+        self.assertEqual(len(found), len(self.expected))
+        self.assertEqual(set(found), self.expected)
+        self.assertEqual(scanner.files, self.expected)
+
+    def testStreamingScanCancel(self):
+        scanner = FileScanner([self.root], recurse=True, is_qfiles=False, streaming=True)
+        batches = []
+        scanner.cancel()
+        self.assertEqual(list(scanner.scan_batches(batch_size=1)), [])
+        scanner = FileScanner([self.root], recurse=True, is_qfiles=False, streaming=True)
+        for files in scanner.scan_batches(batch_size=1):
+            batches.append(files)
+            scanner.cancel()
+        self.assertEqual(len(batches), 1)
+        self.assertTrue(scanner.is_cancelled())
+
+    def testIndexedRescanReportsDelta(self):
+        index = ScanIndex(os.path.join(self.root, "index.sqlite"))
+        music_dir = os.path.join(self.root, "a")
+        scanner = FileScanner([music_dir], recurse=True, is_qfiles=False, supported_extensions=[".mp3"], index=index)
+        first_scan = {file for file in self.expected if file.startswith(music_dir)}
+        self.assertEqual(scanner.files, first_scan)
+        self.assertEqual(scanner.added_files, first_scan)
+        self.assertEqual(scanner.removed_files, set())
+
+        added = self._touch(os.path.join(music_dir, "new.mp3"))
+        removed = os.path.join(music_dir, "file_0.mp3")
+        os.remove(removed)
+        nested = os.path.join(music_dir, "b")
+        for file in os.listdir(nested):
+            os.remove(os.path.join(nested, file))
+        os.rmdir(nested)
+        # Directory listings written within the same mtime tick are not trusted, so this also exercises the rescan
+        scanner = FileScanner([music_dir], recurse=True, is_qfiles=False, supported_extensions=[".mp3"], index=index)
+        self.assertEqual(scanner.added_files, {added})
+        self.assertEqual(scanner.removed_files,
+                         {removed} | {file for file in self.expected if file.startswith(nested)})
+        self.assertIn(added, scanner.files)
+        self.assertNotIn(removed, scanner.files)
+        index.close()
+
+    def testIndexSkipsUnchangedDirectories(self):
+        index = ScanIndex(os.path.join(self.root, "index.sqlite"))
+        old_time = 1_000_000_000
+        for dir_name, sub_dirs, _ in os.walk(self.root):
+            for sub_dir in sub_dirs:
+                os.utime(os.path.join(dir_name, sub_dir), (old_time, old_time))
+        sub_dir = os.path.join(self.root, "c")
+        FileScanner([sub_dir], recurse=True, is_qfiles=False, index=index)
+        with mock.patch("common.CommonUtils.list_directory") as list_directory:
+            scanner = FileScanner([sub_dir], recurse=True, is_qfiles=False, index=index)
+            list_directory.assert_not_called()
+        self.assertEqual(len(scanner.files), 6)
+        self.assertEqual(scanner.added_files, set())
+        index.close()
@@ -0,0 +1,195 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+from common import MediaMetaData, magick_parser_benchmarks
+from common.MediaMetaData import MetaDataFields
+from common.MetaDataCache import MetaDataCache
+from common.ProcessSupervisor import ProcessResult
+
+
+def _probe(output):
+    handle = mock.Mock()
+    handle.result.return_value = ProcessResult(0, output, "", False, False)
+    return handle
+
+
+_FFPROBE_OUTPUT = json.dumps({
+    "streams": [{"codec_name": "mp3", "codec_long_name": "MP3 (MPEG audio layer 3)", "sample_rate": "44100",
+                 "channels": 2}],
+    "format": {"bit_rate": "320000", "duration": "215.4", "tags": {"ARTIST": "Artist", "title": "Title"}}
+})
+
+
+class TestMetaDataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        self.cache = MetaDataCache(os.path.join(self.root, "metadata.sqlite"))
+
+    def tearDown(self):
+        self.cache.close()
+        self.temp_dir.cleanup()
+
+    def _write(self, name, content=b"not really audio"):
+        file = os.path.join(self.root, name)
+        with open(file, "wb") as f:
+            f.write(content)
+        return file
+
+    def testChangedFileIsNotReturned(self):
+        file = self._write("track.mp3")
+        self.cache.put(file, {"duration": "1.0"})
+        self.assertEqual(self.cache.get(file), {"duration": "1.0"})
+        self._write("track.mp3", b"re-tagged and longer")
+        self.assertIsNone(self.cache.get(file))
+        self.assertEqual(self.cache.get_many([file]), {})
+
+    def testGetMany(self):
+        files = [self._write(f"track_{i}.mp3") for i in range(0, 5)]
+        for i, file in enumerate(files[:3]):
+            self.cache.put(file, {"track": i})
+        found = self.cache.get_many(files + [os.path.join(self.root, "missing.mp3")])
+        self.assertEqual(found, {file: {"track": i} for i, file in enumerate(files[:3])})
+
+    def testReadsDoNotLockTheCache(self):
+        file = self._write("track.mp3")
+        self.cache.put(file, {"duration": "215.4"})
+        self.assertEqual(self.cache.get(file), {"duration": "215.4"})
+        self.assertEqual(self.cache.get_many([file]), {file: {"duration": "215.4"}})
+        # Another process writing to the shared cache is not blocked by the reads
+        other = MetaDataCache(self.cache.cache_file)
+        other._db.execute("PRAGMA busy_timeout=0")
+        other.put(self._write("other.mp3"), {"duration": "1.0"})
+        other.close()
+        self.cache.commit()
+        with sqlite3.connect(self.cache.cache_file) as db:
+            self.assertEqual(db.execute("SELECT COUNT(*) FROM metadata").fetchone()[0], 2)
+
+    def testLeastRecentlyUsedEntriesAreEvicted(self):
+        record = {"comment": "x" * 100}
+        record_size = len(json.dumps(record))
+        cache = MetaDataCache(os.path.join(self.root, "small.sqlite"), max_bytes=record_size * 10)
+        files = [self._write(f"track_{i}.mp3") for i in range(0, 12)]
+        for file in files:
+            cache.put(file, record)
+        self.assertLessEqual(cache.size(), record_size * 10)
+        self.assertIsNone(cache.get(files[0]))
+        self.assertEqual(cache.get(files[-1]), record)
+        cache.close()
+
+    def testGetMetadataIsCached(self):
+        file = self._write("track.mp3")
+        with mock.patch("common.MetaDataCache.get_default_cache", return_value=self.cache), \
+                mock.patch("common.MediaMetaData._require_tool"), \
+                mock.patch("common.MediaMetaData._execute", return_value=_probe(_FFPROBE_OUTPUT)) as execute:
+            first = MediaMetaData.get_metadata(file)
+            second = MediaMetaData.get_metadata(file)
+            prefetched = MediaMetaData.prefetch_metadata([file])
+            self.assertEqual(execute.call_count, 1)
+        self.assertEqual(second[MetaDataFields.artist], "Artist")
+        self.assertEqual(second[MetaDataFields.channels], 2)
+        self.assertEqual(dict(first), dict(second))
+        self.assertEqual(dict(prefetched[file]), dict(first))
+
+    def testFailedProbeIsNotCached(self):
+        file = self._write("track.mp3")
+        with mock.patch("common.MetaDataCache.get_default_cache", return_value=self.cache), \
+                mock.patch("common.MediaMetaData._require_tool"), \
+                mock.patch("common.MediaMetaData._execute", return_value=_probe("")) as execute:
+            MediaMetaData.get_metadata(file)
+            self.assertEqual(len(self.cache), 0)
+            MediaMetaData.get_metadata(file)
+            self.assertEqual(execute.call_count, 2)
+
+    def testGetMetadataManyKeepsInputOrder(self):
+        files = [self._write(f"track_{i}.mp3") for i in range(0, 6)]
+        missing = os.path.join(self.root, "missing.mp3")
+        with mock.patch("common.MetaDataCache.get_default_cache", return_value=self.cache), \
+                mock.patch("common.MediaMetaData._require_tool"), \
+                mock.patch("common.MediaMetaData._execute", return_value=_probe(_FFPROBE_OUTPUT)) as execute:
+            MediaMetaData.get_metadata(files[2])
+            results = MediaMetaData.get_metadata_many(files + [missing, files[0]])
+            self.assertEqual(execute.call_count, len(files))
+        self.assertEqual([result[MetaDataFields.filename] for result in results[:6]],
+                         [os.path.basename(file) for file in files])
+        self.assertIsNone(results[6])
+        self.assertEqual(dict(results[7]), dict(results[0]))
+
+    def testImageHeaderIsReadInProcess(self):
+        file = os.path.join(self.root, "wallpaper.png")
+        Image.new("RGB", (2560, 1440)).save(file)
+        broken = self._write("broken.jpg")
+        fields = [MetaDataFields.geometry, MetaDataFields.colorspace, MetaDataFields.codec_name]
+        with mock.patch("common.MetaDataCache.get_default_cache", return_value=self.cache), \
+                mock.patch("common.MediaMetaData._require_tool"), \
+                mock.patch("common.MediaMetaData._execute", return_value=_probe("  Geometry: 10x10+0+0\n")) as execute:
+            metadata = MediaMetaData.get_metadata(file, fields=fields)
+            execute.assert_not_called()
+            self.assertEqual(MediaMetaData.get_metadata(broken, fields=fields)[MetaDataFields.geometry], "10x10+0+0")
+            self.assertEqual(execute.call_count, 1)
+        self.assertEqual(metadata[MetaDataFields.geometry], "2560x1440+0+0")
+        self.assertEqual(metadata[MetaDataFields.colorspace], "sRGB")
+        self.assertEqual(metadata[MetaDataFields.codec_name], "PNG (Portable Network Graphics)")
+
+    def testAllImageFieldsNeedMagick(self):
+        file = os.path.join(self.root, "photo.jpg")
+        Image.new("RGB", (64, 48)).save(file, quality=90)
+        output = "  Geometry: 64x48+0+0\n  Units: Undefined\n  Type: TrueColor\n  Compression: JPEG\n  Quality: 90\n"
+        with mock.patch("common.MetaDataCache.get_default_cache", return_value=self.cache), \
+                mock.patch("common.MediaMetaData._require_tool"), \
+                mock.patch("common.MediaMetaData._execute", return_value=_probe(output)) as execute:
+            header = MediaMetaData.get_metadata(file, fields=[MetaDataFields.geometry, MetaDataFields.codec_name])
+            execute.assert_not_called()
+            self.assertEqual(header[MetaDataFields.geometry], "64x48+0+0")
+            self.assertEqual(header[MetaDataFields.codec_name], "JPEG (Joint Photographic Experts Group JFIF format)")
+
+            # The header record is partial, it is not returned for all the fields
+            metadata = MediaMetaData.get_metadata(file)
+            self.assertEqual(execute.call_count, 1)
+        self.assertEqual(metadata[MetaDataFields.units], "Undefined")
+        self.assertEqual(metadata[MetaDataFields.compression], "JPEG")
+        self.assertEqual(metadata[MetaDataFields.quality], "90")
+
+    def testFieldProjection(self):
+        file = self._write("track.mp3")
+        with mock.patch("common.MetaDataCache.get_default_cache", return_value=self.cache), \
+                mock.patch("common.MediaMetaData._require_tool"), \
+                mock.patch("common.MediaMetaData._execute", return_value=_probe(_FFPROBE_OUTPUT)) as execute:
+            metadata = MediaMetaData.get_metadata(file, fields=[MetaDataFields.duration, MetaDataFields.artist])
+            command = execute.call_args[0][0]
+            self.assertIn("format=duration", command)
+            self.assertIn("format_tags", command)
+            self.assertNotIn("codec_long_name", command)
+            self.assertEqual(dict(metadata), {MetaDataFields.duration: "215.4", MetaDataFields.artist: "Artist"})
+
+            # Fields not read the first time need a new probe, fields already read come from the cache
+            MediaMetaData.get_metadata(file, fields=[MetaDataFields.duration])
+            self.assertEqual(execute.call_count, 1)
+            MediaMetaData.get_metadata(file, fields=[MetaDataFields.channels])
+            self.assertEqual(execute.call_count, 2)
+
+            with mock.patch("common.MediaMetaData.os.stat") as stat:
+                metadata = MediaMetaData.get_metadata(file, use_cache=False, fields=[MetaDataFields.filename])
+                # Only the existence check
+                self.assertEqual(stat.call_count, 1)
+            self.assertEqual(execute.call_count, 2)
+            self.assertEqual(dict(metadata), {MetaDataFields.filename: "track.mp3"})
+
+    def testMagickOutputParser(self):
+        for name, output in magick_parser_benchmarks.recorded_outputs().items():
+            self.assertEqual(dict(MediaMetaData._get_image_metadata(output)),
+                             dict(magick_parser_benchmarks.reference_parser(output)), name)
+        metadata = MediaMetaData._get_image_metadata(magick_parser_benchmarks.recorded_outputs()
+                                                     ["identify_verbose_jpeg.txt"])
+        self.assertEqual(metadata[MetaDataFields.geometry], "4032x3024+0+0")
+        self.assertEqual(metadata[MetaDataFields.codec_long_name],
+                         "JPEG (Joint Photographic Experts Group JFIF format)")
+        self.assertEqual(metadata[MetaDataFields.exif_tags]["Model"], "iPhone 11")
+        self.assertEqual(metadata[MetaDataFields.exif_tags]["DateTime"], "2021:06:12 10:41:27")
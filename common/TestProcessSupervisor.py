@@ -0,0 +1,70 @@
+import sys
+import threading
+import time
+import unittest
+
+from common.ProcessSupervisor import ProcessSupervisor
+
+
+def _python(code):
+    return [sys.executable, "-c", code]
+
+
+class TestProcessSupervisor(unittest.TestCase):
+
+    def setUp(self):
+        self.supervisor = ProcessSupervisor(max_processes=2)
+
+    def tearDown(self):
+        self.supervisor.shutdown()
+
+    def testOutputLines(self):
+        lines = []
+        result = self.supervisor.run(
+            _python("import sys; sys.stdout.write('10%\\r20%\\r\\ndone\\n'); sys.stderr.write('warning\\n'); "
+                    "sys.exit(3)"),
+            on_line=lambda line, stream: lines.append((line, stream)))
+        self.assertEqual(result.returncode, 3)
+        self.assertEqual(result.stdout, "10%\r20%\r\ndone\n")
+        self.assertEqual(result.stderr, "warning\n")
+        self.assertEqual(sorted(lines), sorted([("10%\n", "stdout"), ("20%\n", "stdout"), ("done\n", "stdout"),
+                                                ("warning\n", "stderr")]))
+
+    def testTimeoutKillsProcess(self):
+        started = time.monotonic()
+        result = self.supervisor.run(_python("import time; time.sleep(30)"), timeout=0.5)
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertTrue(result.timed_out)
+        self.assertNotEqual(result.returncode, 0)
+
+    def testCancelKillsProcess(self):
+        handle = self.supervisor.submit(_python("import time; time.sleep(30)"))
+        waiting = self.supervisor.submit(_python("pass"))
+        queued = self.supervisor.submit(_python("pass"))
+        queued.cancel()
+        time.sleep(0.5)
+        handle.cancel()
+        self.assertTrue(handle.result(10).cancelled)
+        self.assertEqual(waiting.result(10).returncode, 0)
+        result = queued.result(10)
+        self.assertTrue(result.cancelled)
+        self.assertIsNone(result.returncode)
+
+    def testConcurrentProcessesAreCapped(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def on_line(line, _):
+            with lock:
+                if line.startswith("start"):
+                    running.append(line)
+                else:
+                    running.pop()
+                peak.append(len(running))
+
+        handles = [self.supervisor.submit(_python("import time; print('start', flush=True); time.sleep(0.2); "
+                                                  "print('end')"), on_line=on_line) for _ in range(0, 6)]
+        for handle in handles:
+            self.assertEqual(handle.result(30).returncode, 0)
+        self.assertEqual(max(peak), 2)
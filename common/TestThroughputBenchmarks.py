@@ -0,0 +1,32 @@
+import os
+import tempfile
+import unittest
+import wave
+
+from common import throughput_benchmarks
+
+
+class TestThroughputBenchmarks(unittest.TestCase):
+
+    def testSyntheticFiles(self):
+        with tempfile.TemporaryDirectory() as root:
+            files = throughput_benchmarks.make_tree(os.path.join(root, "tree"), width=2, depth=2, files_per_dir=3)
+            self.assertEqual(len(files), (1 + 2 + 4) * 3)
+            self.assertTrue(all(os.path.isfile(file) for file in files))
+            wavs = throughput_benchmarks.make_wavs(os.path.join(root, "audio"), count=2, seconds=1,
+                                                   sample_rate=8000)
+            with wave.open(wavs[0]) as f:
+                self.assertEqual(f.getnframes(), 8000)
+                self.assertEqual(f.getnchannels(), 2)
+
+    def testRunAndCompare(self):
+        results = throughput_benchmarks.run(["file_scanner", "command_factory"], repeats=1)
+        self.assertEqual(set(results["results"]), {"file_scanner", "file_scanner_streaming", "command_factory"})
+        for result in results["results"].values():
+            self.assertNotIn("error", result)
+            self.assertGreater(result["items_per_second"], 0)
+
+        baseline = {"results": {name: dict(result, seconds=result["seconds"] / 2)
+                                for name, result in results["results"].items()}}
+        self.assertEqual(throughput_benchmarks.compare(results, results, 0.25), {})
+        self.assertEqual(set(throughput_benchmarks.compare(results, baseline, 0.25)), set(results["results"]))
@@ -0,0 +1,134 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# perf_counter is monotonic but has no epoch. Offsetting it once keeps span times ordered and comparable to wall time
+_EPOCH_OFFSET_NS = time.time_ns() - time.perf_counter_ns()
+
+
+def now_ns():
+    return time.perf_counter_ns() + _EPOCH_OFFSET_NS
+
+
+class Tracer:
+    """
+    Records timed spans and counters. A tracer can be shared between threads and the spans of other tracers can be
+    merged into it, so that each command can keep its own trace and the factory that ran it can collect them all.
+    Once max_spans have been recorded, further spans are only counted in the dropped_spans counter
+    The trace can be exported as JSON lines or in the Chrome trace event format (chrome://tracing, Perfetto)
+    """
+    def __init__(self, name="", max_spans=100000):
+        self.name = name
+        self.max_spans = max_spans
+        self.spans = []
+        self.counters = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **args):
+        """
+        Records the time taken by the block
+            with tracer.span("file_check"):
+                ...
+        :param name: the name of the span
+        :param args: additional details recorded with the span
+        """
+        start = now_ns()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, now_ns(), **args)
+
+    def add_span(self, name, start_ns, end_ns, **args):
+        span = {
+            "name": name,
+            "category": self.name,
+            "start_ns": start_ns,
+            "duration_ns": end_ns - start_ns,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": args
+        }
+        with self._lock:
+            if len(self.spans) < self.max_spans:
+                self.spans.append(span)
+            else:
+                self.counters["dropped_spans"] += 1
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def merge(self, other):
+        """
+        Adds the spans and counters of another tracer to this one
+        :param other: the tracer to merge
+        """
+        with other._lock:
+            spans = list(other.spans)
+            counters = dict(other.counters)
+        with self._lock:
+            room = max(self.max_spans - len(self.spans), 0)
+            self.spans.extend(spans[:room])
+            if len(spans) > room:
+                self.counters["dropped_spans"] += len(spans) - room
+            for name, value in counters.items():
+                self.counters[name] += value
+
+    def summary(self):
+        """
+        :return: a dictionary of span name to the count, total and mean seconds of the spans with that name
+        """
+        totals = defaultdict(lambda: [0, 0])
+        with self._lock:
+            for span in self.spans:
+                totals[span["name"]][0] += 1
+                totals[span["name"]][1] += span["duration_ns"]
+        return {name: {"count": count, "total_seconds": total / 1e9, "mean_seconds": total / count / 1e9}
+                for name, (count, total) in totals.items()}
+
+    def export_jsonl(self, file):
+        """
+        Writes one JSON object per span, followed by one for the counters
+        :param file: the file to write
+        """
+        with self._lock:
+            spans = list(self.spans)
+            counters = dict(self.counters)
+        with open(file, "w") as f:
+            for span in spans:
+                f.write(json.dumps(span, default=str) + "\n")
+            f.write(json.dumps({"name": self.name, "counters": counters}) + "\n")
+
+    def export_chrome_trace(self, file):
+        """
+        Writes the trace in the Chrome trace event format
+        :param file: the file to write
+        """
+        with self._lock:
+            spans = list(self.spans)
+            counters = dict(self.counters)
+        events = [{
+            "name": span["name"],
+            "cat": span["category"],
+            "ph": "X",
+            "ts": span["start_ns"] / 1000,
+            "dur": span["duration_ns"] / 1000,
+            "pid": span["pid"],
+            "tid": span["tid"],
+            "args": span["args"]
+        } for span in spans]
+        end_ts = max((event["ts"] + event["dur"] for event in events), default=now_ns() / 1000)
+        events.extend({
+            "name": name,
+            "cat": self.name,
+            "ph": "C",
+            "ts": end_ts,
+            "pid": os.getpid(),
+            "args": {name: value}
+        } for name, value in counters.items())
+        with open(file, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
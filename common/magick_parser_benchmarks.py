@@ -0,0 +1,66 @@
+"""
+Compares the parser for imagemagick identify -verbose output with the line by line, field by field parser it replaced,
+on the recorded identify outputs in common/resources.
+
+    python -m common.magick_parser_benchmarks
+"""
+import glob
+import os
+import sys
+import timeit
+from collections import defaultdict
+
+from common import MediaMetaData
+from common.MediaMetaData import MetaDataFields
+
+_RESOURCES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources")
+
+
+def reference_parser(metadata):
+    """
+    The original parser, kept to check and compare against
+    """
+    params = defaultdict(lambda: None)
+    for line in metadata.split("\n"):
+        line = line.strip()
+        for metadata_field in MetaDataFields:
+            if metadata_field.magick_key and line.startswith(metadata_field.magick_key):
+                value = line.split(metadata_field.magick_key)[1].strip()
+                if metadata_field == MetaDataFields.exif_tags:
+                    key, exif_value = value.split(":", 1)
+                    if metadata_field in params:
+                        params[metadata_field][key.strip()] = exif_value.strip()
+                    else:
+                        params[metadata_field] = {key.strip(): exif_value.strip()}
+                else:
+                    params[metadata_field] = line.split(metadata_field.magick_key)[1].strip()
+    return params
+
+
+def recorded_outputs():
+    """
+    :return: a dictionary of fixture name to recorded identify -verbose output
+    """
+    outputs = {}
+    for file in sorted(glob.glob(os.path.join(_RESOURCES, "identify_*.txt"))):
+        with open(file) as f:
+            outputs[os.path.basename(file)] = f.read()
+    return outputs
+
+
+def main(number=2000):
+    failed = False
+    for name, output in recorded_outputs().items():
+        if dict(MediaMetaData._get_image_metadata(output)) != dict(reference_parser(output)):
+            print(f"{name}: the parsers do not agree")
+            failed = True
+            continue
+        reference = timeit.timeit(lambda output=output: reference_parser(output), number=number) / number
+        current = timeit.timeit(lambda output=output: MediaMetaData._get_image_metadata(output), number=number) / number
+        print(f"{name:40} reference {reference * 1e6:8.1f} us  current {current * 1e6:8.1f} us  "
+              f"{reference / current:5.1f}x")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
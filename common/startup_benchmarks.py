@@ -0,0 +1,109 @@
+"""
+Measures the import time of each application entry point with python -X importtime, so that work creeping back onto
+the startup path is noticed.
+
+    python -m common.startup_benchmarks --output startup.json
+    python -m common.startup_benchmarks --baseline startup.json
+
+When a baseline is given, the run fails if any entry point became slower than the baseline by more than the tolerance
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ENTRY_POINTS = [
+    "common.MediaMetaData",
+    "TransCoda.TransCodaApp",
+    "FileWrangler.FileWranglerApp",
+    "DupliKate.ImageDuplicateFinderDialog",
+    "Imageplay.ImagePlayApp",
+    "Duplo.DuploApp",
+]
+
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_import(module, repeats=3):
+    """
+    Imports a module in a fresh interpreter and reads the -X importtime report
+    :param module: the module to import
+    :param repeats: the number of imports to run, the fastest is reported
+    :return: a dictionary with the total cumulative import time in microseconds and the slowest imports, or the
+    error if the module could not be imported
+    """
+    best = None
+    for _ in range(0, repeats):
+        process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                 cwd=_REPO_ROOT, capture_output=True, text=True,
+                                 env=dict(os.environ, QT_QPA_PLATFORM=os.environ.get("QT_QPA_PLATFORM", "offscreen")))
+        if process.returncode != 0:
+            return {"error": process.stderr.strip().split("\n")[-1]}
+        imports = _parse_importtime(process.stderr)
+        total = sum(cumulative for name, _, cumulative in imports if name == module)
+        if best is None or total < best["total_us"]:
+            slowest = sorted(imports, key=lambda entry: entry[1], reverse=True)[:10]
+            best = {
+                "total_us": total,
+                "modules": len(imports),
+                "slowest_self_us": {name: self_us for name, self_us, _ in slowest}
+            }
+    return best
+
+
+def _parse_importtime(report):
+    # import time: self [us] | cumulative | imported package
+    # import time:       102 |        102 |   _io
+    imports = []
+    for line in report.split("\n"):
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|", 2)
+        imports.append((name.strip(), int(self_us), int(cumulative)))
+    return imports
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: the entry points that are slower than the baseline by more than the tolerance
+    """
+    regressions = {}
+    for module, result in results.items():
+        expected = baseline.get(module, {}).get("total_us")
+        if expected and "total_us" in result and result["total_us"] > expected * (1 + tolerance):
+            regressions[module] = {"baseline_us": expected, "total_us": result["total_us"]}
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the import time of the application entry points")
+    parser.add_argument("modules", nargs="*", default=ENTRY_POINTS)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare the results with this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="The fraction by which an entry point can be slower than the baseline")
+    args = parser.parse_args()
+
+    results = {module: measure_import(module, args.repeats) for module in args.modules}
+    for module, result in results.items():
+        if "error" in result:
+            print(f"{module:40} failed: {result['error']}")
+        else:
+            print(f"{module:40} {result['total_us'] / 1000:8.1f} ms  {result['modules']} modules")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for module, regression in regressions.items():
+            print(f"{module} regressed from {regression['baseline_us'] / 1000:.1f} ms "
+                  f"to {regression['total_us'] / 1000:.1f} ms")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,326 @@
+"""
+Times the throughput of FileScanner, calculate_sha256_hash, get_metadata and CommandExecutionFactory on a synthetic
+directory tree, images and audio files that are generated in a temporary directory, so that the results do not
+depend on the files of the machine they are run on and can be compared across commits.
+
+    python -m common.throughput_benchmarks --output throughput.json
+    python -m common.throughput_benchmarks --baseline throughput.json
+
+When a baseline is given, the run fails if any benchmark became slower than the baseline by more than the tolerance.
+Benchmarks that need a tool that is not installed, such as ffprobe for the audio files, report the error instead
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import random
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from contextlib import contextmanager
+
+from PyQt5.QtCore import Qt
+
+from common import CommonUtils, MediaMetaData, MetaDataCache
+from common.CommonUtils import Command, CommandExecutionFactory, FileScanner
+
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_TREE_EXTENSIONS = [".mp3", ".flac", ".jpg", ".png", ".txt", ".log"]
+_SEED = 20200101
+_logger = logging.getLogger("throughput_benchmarks")
+
+
+def make_tree(root, width=4, depth=3, files_per_dir=20):
+    """
+    Creates a tree of empty files
+    :param root: the directory to create the tree in
+    :param width: the number of sub directories in each directory
+    :param depth: the number of levels of sub directories
+    :param files_per_dir: the number of files in each directory, with extensions taken in turn from a fixed list
+    :return: the files created
+    """
+    files = []
+    dirs = [root]
+    for level in range(0, depth + 1):
+        next_dirs = []
+        for _dir in dirs:
+            os.makedirs(_dir, exist_ok=True)
+            for i in range(0, files_per_dir):
+                file = os.path.join(_dir, f"file_{i}{_TREE_EXTENSIONS[i % len(_TREE_EXTENSIONS)]}")
+                open(file, "w").close()
+                files.append(file)
+            if level < depth:
+                next_dirs.extend(os.path.join(_dir, f"dir_{i}") for i in range(0, width))
+        dirs = next_dirs
+    return files
+
+
+def make_data_files(root, count=20, size=4 * 1024 * 1024):
+    """
+    Creates files of random bytes. The bytes are the same on every run
+    :return: the files created
+    """
+    os.makedirs(root, exist_ok=True)
+    generator = random.Random(_SEED)
+    files = []
+    for i in range(0, count):
+        file = os.path.join(root, f"data_{i}.bin")
+        with open(file, "wb") as f:
+            f.write(generator.randbytes(size))
+        files.append(file)
+    return files
+
+
+def make_images(root, count=20, width=1920, height=1080):
+    """
+    Creates PNG and JPEG images, in turn, with Pillow
+    :return: the images created
+    """
+    from PIL import Image
+
+    os.makedirs(root, exist_ok=True)
+    image = Image.merge("RGB", [Image.linear_gradient("L").resize((width, height)),
+                                Image.radial_gradient("L").resize((width, height)),
+                                Image.effect_noise((width, height), 64)])
+    files = []
+    for i in range(0, count):
+        file = os.path.join(root, f"image_{i}.{'png' if i % 2 == 0 else 'jpg'}")
+        image.save(file)
+        files.append(file)
+    return files
+
+
+def make_wavs(root, count=20, seconds=5, sample_rate=44100):
+    """
+    Creates 16-bit stereo WAV files of a sine wave
+    :return: the files created
+    """
+    os.makedirs(root, exist_ok=True)
+    frames = b"".join(struct.pack("<hh", sample, sample) for sample in
+                      (int(math.sin(2 * math.pi * 440 * i / sample_rate) * 16000) for i in range(0, sample_rate)))
+    files = []
+    for i in range(0, count):
+        file = os.path.join(root, f"tone_{i}.wav")
+        with wave.open(file, "wb") as f:
+            f.setnchannels(2)
+            f.setsampwidth(2)
+            f.setframerate(sample_rate)
+            for _ in range(0, seconds):
+                f.writeframes(frames)
+        files.append(file)
+    return files
+
+
+class _NoOpCommand(Command):
+    def do_work(self):
+        self.signals.result.emit(None)
+
+
+def bench_file_scanner(root, scale, repeats):
+    tree = os.path.join(root, "tree")
+    files = make_tree(tree, width=4, depth=3, files_per_dir=20 * scale)
+    extensions = [".mp3", ".flac"]
+
+    def walk():
+        return FileScanner([tree], recurse=True, supported_extensions=extensions, is_qfiles=False)
+
+    def stream():
+        scanner = FileScanner([tree], recurse=True, supported_extensions=extensions, is_qfiles=False, streaming=True)
+        for _ in scanner.scan_batches():
+            pass
+        return scanner
+
+    return {
+        "file_scanner": _measure(walk, len(files), repeats),
+        "file_scanner_streaming": _measure(stream, len(files), repeats),
+    }
+
+
+def bench_sha256(root, scale, repeats):
+    files = make_data_files(os.path.join(root, "data"), count=10 * scale)
+    total_bytes = sum(os.path.getsize(file) for file in files)
+
+    def hash_files():
+        for file in files:
+            CommonUtils.calculate_sha256_hash(file)
+
+    result = _measure(hash_files, len(files), repeats)
+    if "error" not in result:
+        result["mb_per_second"] = total_bytes / 1024 / 1024 / result["seconds"] if result["seconds"] else None
+    return {"sha256": result}
+
+
+def bench_metadata(root, scale, repeats):
+    results = {}
+    os.makedirs(root, exist_ok=True)
+    with _private_metadata_cache(root):
+        try:
+            images = make_images(os.path.join(root, "images"), count=10 * scale)
+        except ImportError as e:
+            results["metadata_images"] = {"error": str(e)}
+        else:
+            # The header fields, as read by the wallpaper finder, all the fields of an image need magick
+            fields = [MediaMetaData.MetaDataFields.geometry, MediaMetaData.MetaDataFields.colorspace]
+            results["metadata_images"] = _measure(
+                lambda: [MediaMetaData.get_metadata(image, use_cache=False, fields=fields) for image in images],
+                len(images), repeats)
+
+        wavs = make_wavs(os.path.join(root, "audio"), count=10 * scale)
+        results["metadata_audio"] = _measure(
+            lambda: MediaMetaData.get_metadata_many(wavs, use_cache=False), len(wavs), repeats)
+        if "error" not in results["metadata_audio"]:
+            MediaMetaData.get_metadata_many(wavs)
+            results["metadata_audio_cached"] = _measure(lambda: MediaMetaData.get_metadata_many(wavs), len(wavs),
+                                                        repeats)
+    return results
+
+
+def bench_command_factory(_, scale, repeats):
+    count = 1000 * scale
+
+    def run_commands():
+        finished = []
+        factory = CommandExecutionFactory([_NoOpCommand() for _ in range(0, count)], logger=_logger)
+        factory.finish_event.connect(lambda results, _: finished.append(len(results)), Qt.DirectConnection)
+        factory.start()
+        factory.wait()
+        if finished != [count]:
+            raise Exception(f"Expected {count} commands to complete, {finished} did")
+
+    return {"command_factory": _measure(run_commands, count, repeats)}
+
+
+BENCHMARKS = {
+    "file_scanner": bench_file_scanner,
+    "sha256": bench_sha256,
+    "metadata": bench_metadata,
+    "command_factory": bench_command_factory,
+}
+
+
+def _measure(function, items, repeats):
+    """
+    Runs a function several times
+    :param function: the function to time
+    :param items: the number of items the function processes, to report the throughput
+    :param repeats: the number of runs, the fastest is reported
+    :return: a dictionary with the fastest and median time and the items per second of the fastest run, or the error
+    if the function failed
+    """
+    times = []
+    for _ in range(0, repeats):
+        start = time.perf_counter()
+        try:
+            function()
+        except Exception as e:
+            return {"error": str(e)}
+        times.append(time.perf_counter() - start)
+    best = min(times)
+    return {
+        "items": items,
+        "seconds": best,
+        "median_seconds": statistics.median(times),
+        "items_per_second": items / best if best else None
+    }
+
+
+@contextmanager
+def _private_metadata_cache(root):
+    """
+    Points the shared metadata cache to a temporary file, so that the synthetic files are not added to the cache of
+    the applications
+    """
+    cache = MetaDataCache.MetaDataCache(os.path.join(root, "metadata.sqlite"))
+    with MetaDataCache._default_cache_lock:
+        previous, MetaDataCache._default_cache = MetaDataCache._default_cache, cache
+    try:
+        yield cache
+    finally:
+        with MetaDataCache._default_cache_lock:
+            MetaDataCache._default_cache = previous
+        cache.close()
+
+
+def _commit():
+    process = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=_REPO_ROOT, capture_output=True, text=True)
+    return process.stdout.strip() if process.returncode == 0 else None
+
+
+def run(benchmarks=None, scale=1, repeats=3, work_dir=None):
+    """
+    Generates the synthetic files and runs the benchmarks
+    :param benchmarks: the names of the benchmarks to run, all of them if None
+    :param scale: multiplies the number of files and commands of each benchmark
+    :param repeats: the number of runs of each benchmark, the fastest is reported
+    :param work_dir: the directory to generate the files in. A temporary directory is used if not provided
+    :return: a dictionary with the run details and the results of each benchmark
+    """
+    results = {}
+    with tempfile.TemporaryDirectory(dir=work_dir) as root:
+        for name in benchmarks or BENCHMARKS:
+            results.update(BENCHMARKS[name](os.path.join(root, name), scale, repeats))
+    return {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "scale": scale,
+        "repeats": repeats,
+        "results": results
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: the benchmarks that are slower than the baseline by more than the tolerance
+    """
+    regressions = {}
+    for name, result in results["results"].items():
+        expected = baseline["results"].get(name, {}).get("seconds")
+        if expected and "seconds" in result and result["seconds"] > expected * (1 + tolerance):
+            regressions[name] = {"baseline_seconds": expected, "seconds": result["seconds"]}
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the throughput of the common utilities on synthetic files")
+    parser.add_argument("benchmarks", nargs="*", help=f"The benchmarks to run, from {', '.join(BENCHMARKS)}")
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--work-dir", help="Generate the files in this directory instead of the temporary directory")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare the results with this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="The fraction by which a benchmark can be slower than the baseline")
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(unknown)}")
+
+    results = run(args.benchmarks, args.scale, args.repeats, args.work_dir)
+    for name, result in results["results"].items():
+        if "error" in result:
+            print(f"{name:25} failed: {result['error']}")
+        else:
+            print(f"{name:25} {result['seconds'] * 1000:10.1f} ms  {result['items_per_second']:12.1f} items/s")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, regression in regressions.items():
+            print(f"{name} regressed from {regression['baseline_seconds'] * 1000:.1f} ms "
+                  f"to {regression['seconds'] * 1000:.1f} ms")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
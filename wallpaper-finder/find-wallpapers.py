@@ -38,7 +38,7 @@ def _copy_wallpaper(file, copy_dir_name):
 
     file_path = Path(file)
     dest_file = Path(copy_dir_name) / file_path.name
-    details = MediaMetaData.get_metadata(file)
+    details = MediaMetaData.get_metadata(file, fields=[MediaMetaData.MetaDataFields.geometry])
     geometry = details[MediaMetaData.MetaDataFields.geometry]
     width = float(geometry[0:geometry.find("x")])
     height = float(geometry[geometry.find("x") + 1:geometry.find("+")])